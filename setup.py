@@ -36,6 +36,9 @@ setup(name='zaltys-python-utils',
                   'zaltys_dvbs2d_driver',
                   'zaltys_dvbs2fd_driver',
                   'zaltys_plsv_utils',
+                  'zaltys_rrc_utils',
+                  'zaltys_config_program',
                   'zaltys_smpi_gateway',
                   'zaltys_zwire',
+                  'zaltys_buffer_utils',
                   'libgse_wrapper'])
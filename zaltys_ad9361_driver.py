@@ -20,7 +20,12 @@
 ##  A wrapper for the Zaltys AD9361 driver (libzaltys-ad9361.so).
 ##
 
+import time
+import errno
 import ctypes
+import threading
+
+import zaltys_smpi_gateway
 
 #
 # Callback functions (called from libzaltys-ad9361 C code)
@@ -30,13 +35,27 @@ import ctypes
 # invoked from C has no notion of self, so cannot find other methods
 # or attributes.
 #
-g_smpi_gateway = None
+# The library holds a single set of callbacks, registered once per
+# process by load_library.  Each callback is routed to the driver
+# instance whose library call is running in the calling thread
+# (g_active.driver, see AD9361Driver.call_library), so several AD9361
+# chips, each behind its own SMPI-to-SPI bridge, can be driven from
+# different threads.
+#
+# The library's SPI receive buffer (ad9361_write_rxbuf) is global, and
+# ctypes releases the GIL during library calls, so calls into the
+# library are serialised by g_call_lock: only one driver instance is in
+# the library at a time.
+#
+g_lib = None
 
-g_smpi2spi_base_address = 0
+g_callbacks = None
 
-g_lib = None
+g_lib_lock = threading.Lock()
+
+g_call_lock = threading.RLock()
 
-g_rf_phy = None
+g_active = threading.local()
 
 def spi_init(device_id, clk_pha, clk_pol):
     return 0
@@ -45,40 +64,89 @@ def spi_read(bytes_number):
     return 0
 
 def spi_write_then_read(txbuf, n_tx, n_rx):
-    global g_lib, g_smpi_gateway, g_smpi2spi_base_address
-
-    if n_tx == 2:
-        # Perform a read
-        if n_rx >= 1 and n_rx <= 8:
-            nbi = n_rx - 1
-            cmd_addr = (nbi/4)*2**28 + 2**27 + (nbi%4)*2**25 + 2**24 + txbuf[0]*2**8 + txbuf[1]
-            wait_for_spi_ready()
-            g_smpi_gateway.register_write(g_smpi2spi_base_address, cmd_addr)
-            wait_for_spi_ready()
-            dat_hi = g_smpi_gateway.register_read(g_smpi2spi_base_address+5)
-            dat_lo = g_smpi_gateway.register_read(g_smpi2spi_base_address+2)
-            dat = dat_hi*2**32 + dat_lo
-            for n in range(n_rx):
-                g_lib.ad9361_write_rxbuf(ctypes.c_ubyte((dat >> (8*(n_rx-1-n))) & 0xFF), ctypes.c_uint(n))
-
-    elif n_tx >= 3 and n_tx <= 10:
-        # Perform a write
-        nbi = n_tx-3
-        cmd_addr = (nbi/4)*2**28 + 2**27 + (nbi%4)*2**25 +  txbuf[0]*2**8 + txbuf[1]
-        dat = 0
-        for n in range(2,n_tx):
-            dat = dat + ((txbuf[n] & 0xFF) << (8*(n_tx-1-n)))
-        dat_hi = dat / 2**32
-        dat_lo = dat % 2**32
-        wait_for_spi_ready()
-        g_smpi_gateway.register_write(g_smpi2spi_base_address+4, dat_hi)
-        g_smpi_gateway.register_write(g_smpi2spi_base_address+1, dat_lo)
-        g_smpi_gateway.register_write(g_smpi2spi_base_address, cmd_addr)
-    return 0
+    return g_active.driver.spi_write_then_read(txbuf, n_tx, n_rx)
 
-def wait_for_spi_ready():
-    while (g_smpi_gateway.register_read(g_smpi2spi_base_address+3)%2 == 1):
-        None
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+#
+# AD9361 SPI registers
+#
+# Registers that the chip itself changes (status, readback, calibration
+# control and the read ports of the indirect table interfaces) are
+# volatile, so always read from the chip; others are shadowed by
+# AD9361Driver.  A soft reset (SPI configuration register) or the start
+# of a calibration (calibration control register) clears the shadow, as
+# both update registers behind the driver's back.  Registers not listed
+# are taken to change only when written: any other found to change should
+# be declared with AD9361Driver.set_spi_volatile, or the shadow disabled
+# (spi_shadow_enabled).
+#
+AD9361_REG_SPI_CONF    = 0x000
+AD9361_REG_CALIBRATION = 0x016
+AD9361_SOFT_RESET      = 0x81
+
+AD9361_REG_RFPLL_DIVIDERS = 0x005
+
+AD9361_SYNTH_REGISTERS = {"RX" : [(AD9361_REG_RFPLL_DIVIDERS, 1), (0x230, 0x40)],
+                          "TX" : [(AD9361_REG_RFPLL_DIVIDERS, 1), (0x270, 0x40)]}
+AD9361_DIVIDER_MASK    = {"RX" : 0x0F, "TX" : 0xF0}  # each path's field of REG_RFPLL_DIVIDERS
+AD9361_SYNTH_FREQUENCY = {"RX" : (0x231, 5), "TX" : (0x271, 5)}  # integer and fractional words
+AD9361_VCO_LOCK        = {"RX" : (0x247, 0x02), "TX" : (0x287, 0x02)}  # (register, mask)
+
+AD9361_VOLATILE_REGISTERS = [(0x000,  1),  # SPI configuration
+                             (0x00E,  1),  # temperature
+                             (0x016,  2),  # calibration control, ENSM state
+                             (0x01E,  2),  # AuxADC word
+                             (0x05E,  1),  # BBPLL lock
+                             (0x063,  2),  # Tx FIR coefficient read data
+                             (0x0A7,  2),  # Tx quadrature calibration status
+                             (0x0F3,  2),  # Rx FIR coefficient read data
+                             (0x134,  3),  # gain table read data
+                             (0x1A7,  6),  # RSSI
+                             (0x244,  1),  # Rx synth CP calibration status
+                             (0x247,  1),  # Rx synth VCO lock
+                             (0x284,  1),  # Tx synth CP calibration status
+                             (0x287,  1),  # Tx synth VCO lock
+                             (0x2B0, 16)]  # gain and AGC state readback
+
+
+def spi_instruction(write, register, count):
+    # The 16-bit instruction word starting an AD9361 SPI transfer
+    return (0x8000 if write else 0) + ((count - 1) << 12) + (register & 0x3FF)
+
+def coalesce_spi_writes(writes, separate=()):
+    '''
+    Reduce a sequence of (register, values) SPI writes, values being for
+    registers register, register-1, ..., to the last value written to
+    each register.  Registers keep the order of their last writes, and
+    runs of descending adjacent registers are merged into writes of up to
+    8 bytes, except that registers in separate are always written alone.
+    Returns a list of (register, values).
+    '''
+    last = {}
+    order = 0
+    for register, values in writes:
+        for n in range(len(values)):
+            last[register - n] = (order, values[n])
+            order = order + 1
+    coalesced = []
+    for register in sorted(last, key=lambda register: last[register][0]):
+        value = last[register][1]
+        if coalesced and register not in separate:
+            start, values = coalesced[-1]
+            if start not in separate and start - len(values) == register and len(values) < 8:
+                values.append(value)
+                continue
+        coalesced.append((register, [value]))
+    return coalesced
+
+
+#
+# AD9361 driver exceptions
+#
+class AD9361DriverError(Exception): pass
 
 
 #
@@ -92,6 +160,58 @@ class RF_RSSI(ctypes.Structure):
                 ("duration",      ctypes.c_byte)]
 
 
+#
+# Load the driver library and register the callback functions, once per
+# process.  Returns the library.
+#
+LIBRARY_PATH = '/usr/lib/libzaltys-ad9361.so'
+
+def load_library():
+    global g_lib, g_callbacks
+    with g_lib_lock:
+        if g_lib is None:
+            lib = ctypes.CDLL(LIBRARY_PATH)
+            lib.ad9361_cmos_init.restype = ctypes.c_void_p
+            lib.ad9361_lvds_init.restype = ctypes.c_void_p
+            lib.ad9361_write_rxbuf.restype = None
+            lib.ad9361_write_rxbuf.argtypes = [ctypes.c_ubyte, ctypes.c_uint]
+            lib.ad9361_read_rxbuf.restype  = ctypes.c_ubyte
+            lib.ad9361_get_rx_rssi.restype = ctypes.c_int
+
+            # Setup SPI read/write callbacks
+            #
+            # Note: callback objects are kept in g_callbacks to prevent
+            # garbage collection -- these are the objects that the C code
+            # calls, which then redirect to their associated module
+            # functions.
+            SPI_INIT_CBTYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_uint, ctypes.c_ubyte, ctypes.c_ubyte)
+            SPI_READ_CBTYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_ubyte)
+            SPI_WRITE_THEN_READ_CBTYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_ubyte), ctypes.c_uint, ctypes.c_uint)
+            callbacks = (SPI_INIT_CBTYPE(spi_init),
+                         SPI_READ_CBTYPE(spi_read),
+                         SPI_WRITE_THEN_READ_CBTYPE(spi_write_then_read))
+            lib.ad9361_set_fn_spi_init(callbacks[0])
+            lib.ad9361_set_fn_spi_read(callbacks[1])
+            lib.ad9361_set_fn_spi_write_then_read(callbacks[2])
+
+            # Nullify unused callbacks
+            lib.ad9361_set_fn_usleep(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_gpio_init(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_gpio_direction(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_gpio_is_valid(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_gpio_set_value(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_udelay(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_mdelay(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_msleep_interruptable(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_axiadc_init(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_axiadc_read(ctypes.c_void_p(0))
+            lib.ad9361_set_fn_axiadc_write(ctypes.c_void_p(0))
+
+            g_callbacks = callbacks
+            g_lib = lib
+    return g_lib
+
+
 #
 # Base class for AD9361 objects
 #
@@ -102,60 +222,41 @@ class AD9361 (object):
 #
 # AD9361 driver class
 #
-# Instantiate a single instance of this class with an smpi_gateway
-# object and an appropriate smpi2spi_base_address value.
+# Instantiate one instance of this class per AD9361, each with an
+# smpi_gateway object and an appropriate smpi2spi_base_address value.
+# Instances may be used from separate threads, though their library
+# calls are serialised (see call_library).
 #
 # When ready to initialize the AD9361 then call the init_ad9361()
 # method.  After this you can call set_ad9361_configuration() or
 # get_ad9361_configuration() as desired.
 #
+# For fast frequency hopping, store LO profiles for the hop frequencies
+# with store_ad9361_lo_profiles(), then retune with hop_ad9361_lo().
+#
 class AD9361Driver (AD9361):
     '''
         Configuration wrapper for the AD9361 driver
     '''
     def __init__(self, smpi_gateway, smpi2spi_base_address):
-        global g_smpi_gateway, g_smpi2spi_base_address, g_lib
-
-        # Initialize module variables
-        g_smpi_gateway = smpi_gateway
-        g_smpi2spi_base_address = smpi2spi_base_address
-        g_lib = ctypes.CDLL('/usr/lib/libzaltys-ad9361.so')
-        g_lib.ad9361_cmos_init.restype = ctypes.c_void_p
-        g_lib.ad9361_lvds_init.restype = ctypes.c_void_p
-        g_lib.ad9361_write_rxbuf.restype = None
-        g_lib.ad9361_read_rxbuf.restype  = ctypes.c_ubyte
-        g_lib.ad9361_get_rx_rssi.restype = ctypes.c_int
-
-        # Setup SPI read/write callbacks
-        #
-        # Note: callback objects assigned to self attributes to
-        # prevent garbage collection -- these are the objects that the
-        # C code calls, which then redirect to their associated global
-        # python functions.
-        SPI_INIT_CBTYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_uint, ctypes.c_ubyte, ctypes.c_ubyte)
-        self.spi_init_callback = SPI_INIT_CBTYPE(spi_init)
-        g_lib.ad9361_set_fn_spi_init(self.spi_init_callback)
-
-        SPI_READ_CBTYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_ubyte)
-        self.spi_read_callback = SPI_READ_CBTYPE(spi_read)
-        g_lib.ad9361_set_fn_spi_read(self.spi_read_callback)
-
-        SPI_WRITE_THEN_READ_CBTYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_ubyte), ctypes.c_uint, ctypes.c_uint)
-        self.spi_write_then_read_callback = SPI_WRITE_THEN_READ_CBTYPE(spi_write_then_read)
-        g_lib.ad9361_set_fn_spi_write_then_read(self.spi_write_then_read_callback)
-
-        # Nullify unused callbacks
-        g_lib.ad9361_set_fn_usleep(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_gpio_init(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_gpio_direction(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_gpio_is_valid(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_gpio_set_value(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_udelay(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_mdelay(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_msleep_interruptable(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_axiadc_init(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_axiadc_read(ctypes.c_void_p(0))
-        g_lib.ad9361_set_fn_axiadc_write(ctypes.c_void_p(0))
+        self.smpi_gateway = smpi_gateway
+        self.smpi2spi_base_address = smpi2spi_base_address
+        self.lib = load_library()
+        self.rf_phy = None
+        self.spi_busy = True  # bridge state unknown until first polled
+        self.spi_timeout = 1.0  # seconds to wait for the bridge to be ready
+
+        # SPI register shadow
+        self.spi_shadow = {}
+        self.spi_shadow_enabled = True
+        self.spi_volatile = list(AD9361_VOLATILE_REGISTERS)
+        self.spi_shadow_hits = 0
+        self.spi_shadow_misses = 0
+
+        # LO hopping profiles
+        self.spi_recording = None
+        self.lo_profiles = {}
+        self.lo_retune_stats = zaltys_smpi_gateway.WaitStatistics()
 
         # Initialize object attributes
         self.interface = "CMOS"
@@ -165,15 +266,169 @@ class AD9361Driver (AD9361):
         self.tx_bandwidth = self.sample_rate//2
         self.rx_bandwidth = self.sample_rate//2
 
-    def init_ad9361(self, interface="CMOS"):
-        global g_rf_phy
+    def call_library(self, function, *args):
+        '''
+        Call a library function, routing the SPI callbacks it makes in
+        this thread to this driver's SMPI-to-SPI bridge.  Calls from all
+        driver instances are serialised, as the library's SPI receive
+        buffer is shared.
+        '''
+        with g_call_lock:
+            previous = getattr(g_active, 'driver', None)
+            g_active.driver = self
+            try:
+                return function(*args)
+            finally:
+                g_active.driver = previous
+
+    def set_spi_volatile(self, register, count=1):
+        '''
+        Mark count AD9361 registers from register as volatile, so never
+        shadowed.
+        '''
+        self.spi_volatile.append((register, count))
+        self.invalidate_spi_shadow(register, count)
+
+    def invalidate_spi_shadow(self, register=None, count=1):
+        '''
+        Forget the shadowed values of count registers from register, or
+        of all registers if register is None.
+        '''
+        if register is None:
+            self.spi_shadow.clear()
+        else:
+            for n in range(register, register + count):
+                self.spi_shadow.pop(n, None)
+
+    def is_spi_cacheable(self, register):
+        for start, count in self.spi_volatile:
+            if start <= register < start + count:
+                return False
+        return True
+
+    def _spi_shadow_read(self, register, count):
+        # Values of registers register, register-1, ... if all are shadowed
+        if not self.spi_shadow_enabled:
+            return None
+        shadow = self.spi_shadow
+        values = []
+        for n in range(count):
+            value = shadow.get(register - n)
+            if value is None:
+                self.spi_shadow_misses = self.spi_shadow_misses + 1
+                return None
+            values.append(value)
+        self.spi_shadow_hits = self.spi_shadow_hits + 1
+        return values
+
+    def _spi_shadow_update(self, register, values):
+        # values are for registers register, register-1, ...  While the
+        # shadow is disabled the registers' old values are dropped, so
+        # re-enabling it never serves a value overwritten meanwhile.
+        if register == AD9361_REG_CALIBRATION or (register == AD9361_REG_SPI_CONF and values[0] & AD9361_SOFT_RESET):
+            self.spi_shadow.clear()
+        elif self.spi_shadow_enabled:
+            for n in range(len(values)):
+                if self.is_spi_cacheable(register - n):
+                    self.spi_shadow[register - n] = values[n]
+        else:
+            for n in range(len(values)):
+                self.spi_shadow.pop(register - n, None)
+
+    def spi_write_then_read(self, txbuf, n_tx, n_rx):
+        register = ((txbuf[0] << 8) + txbuf[1]) & 0x3FF
+        if n_tx == 2:
+            # Perform a read
+            if n_rx >= 1 and n_rx <= 8:
+                values = self.spi_read(register, n_rx)
+                if values is None:
+                    return -errno.ETIMEDOUT
+                write_rxbuf = self.lib.ad9361_write_rxbuf
+                for n in range(n_rx):
+                    write_rxbuf(values[n], n)
+
+        elif n_tx >= 3 and n_tx <= 10:
+            # Perform a write
+            if not self.spi_write(register, [txbuf[n] & 0xFF for n in range(2,n_tx)]):
+                return -errno.ETIMEDOUT
+        return 0
+
+    #
+    # SMPI-to-SPI bridge registers (relative to smpi2spi_base_address):
+    #   +0 command/address, +1/+4 write data lo/hi, +2/+5 read data
+    #   lo/hi, +3 status (bit 0 busy).
+    #
+    # Only a transfer can make the bridge busy, so readiness is polled
+    # only while one may still be in progress (spi_busy).  Both data words
+    # are written for every write and read for every read, as the bridge
+    # has always been driven.  If the bridge stays busy for spi_timeout
+    # seconds the transfer fails.
+    #
+    # A write's data and command registers are issued as one scatter
+    # write.  ZwireSmpiGateway sends that as one batch over ZwireTCP, but
+    # over Zwire SPI it is still three register writes.
+    #
+    # Multi-byte transfers address registers in descending order.
+    # Reads wholly of shadowed registers never reach the bridge.
+    #
+    def spi_read(self, register, count=1):
+        '''
+        Read count (1 to 8) AD9361 registers, from register downwards.
+        Returns a list of byte values, or None on timeout.
+        '''
+        values = self._spi_shadow_read(register, count)
+        if values is None:
+            base = self.smpi2spi_base_address
+            nbi = count - 1
+            cmd_addr = (nbi//4)*2**28 + 2**27 + (nbi%4)*2**25 + 2**24 + spi_instruction(False, register, count)
+            if not self.wait_for_spi_ready():
+                return None
+            self.smpi_gateway.register_write(base, cmd_addr)
+            self.spi_busy = True
+            if not self.wait_for_spi_ready():
+                return None
+            dat = self.smpi_gateway.register_read(base+5) << 32
+            dat = dat + self.smpi_gateway.register_read(base+2)
+            values = [(dat >> (8*(count-1-n))) & 0xFF for n in range(count)]
+            self._spi_shadow_update(register, values)
+        return values
+
+    def spi_write(self, register, values):
+        '''
+        Write 1 to 8 byte values to AD9361 registers, from register
+        downwards.  Returns false on timeout.
+        '''
+        base = self.smpi2spi_base_address
+        count = len(values)
+        nbi = count - 1
+        cmd_addr = (nbi//4)*2**28 + 2**27 + (nbi%4)*2**25 + spi_instruction(True, register, count)
+        dat = 0
+        for n in range(count):
+            dat = dat + (values[n] << (8*(count-1-n)))
+        if not self.wait_for_spi_ready():
+            return False
+        self.smpi_gateway.register_scatter_write([base+4, base+1, base], [dat >> 32, dat % 2**32, cmd_addr])
+        self.spi_busy = True
+        self._spi_shadow_update(register, values)
+        if self.spi_recording is not None:
+            self.spi_recording.append((register, values))
+        return True
+
+    def wait_for_spi_ready(self):
+        if self.spi_busy:
+            if not self.smpi_gateway.wait_for(self.smpi2spi_base_address+3, 1, 0, timeout=self.spi_timeout):
+                return False
+            self.spi_busy = False
+        return True
 
+    def init_ad9361(self, interface="CMOS"):
+        self.invalidate_spi_shadow()
         if interface.upper() == "CMOS":
             self.interface = "CMOS"
-            g_rf_phy = g_lib.ad9361_cmos_init()
+            self.rf_phy = self.call_library(self.lib.ad9361_cmos_init)
         else:
             self.interface = "LVDS"
-            g_rf_phy = g_lib.ad9361_lvds_init()
+            self.rf_phy = self.call_library(self.lib.ad9361_lvds_init)
 
     def set_ad9361_configuration(self, sample_rate=None, tx_carrier_freq=None, rx_carrier_freq=None,
                                  tx_bandwidth=None, rx_bandwidth=None):
@@ -195,13 +450,13 @@ class AD9361Driver (AD9361):
         self.tx_bandwidth = min(self.tx_bandwidth, self.sample_rate//2, 56000000)
         self.rx_bandwidth = min(self.rx_bandwidth, self.sample_rate//2, 56000000)
 
-        g_lib.ad9361_set_tx_sampling_freq(g_rf_phy, ctypes.c_ulong(self.sample_rate))
-        g_lib.ad9361_set_rx_sampling_freq(g_rf_phy, ctypes.c_ulong(self.sample_rate))
-        g_lib.ad9361_set_tx_rf_bandwidth(g_rf_phy, ctypes.c_ulong(self.tx_bandwidth))
-        g_lib.ad9361_set_rx_rf_bandwidth(g_rf_phy, ctypes.c_ulong(self.rx_bandwidth))
+        self.call_library(self.lib.ad9361_set_tx_sampling_freq, self.rf_phy, ctypes.c_ulong(self.sample_rate))
+        self.call_library(self.lib.ad9361_set_rx_sampling_freq, self.rf_phy, ctypes.c_ulong(self.sample_rate))
+        self.call_library(self.lib.ad9361_set_tx_rf_bandwidth, self.rf_phy, ctypes.c_ulong(self.tx_bandwidth))
+        self.call_library(self.lib.ad9361_set_rx_rf_bandwidth, self.rf_phy, ctypes.c_ulong(self.rx_bandwidth))
 
-        g_lib.ad9361_set_tx_lo_freq(g_rf_phy, ctypes.c_ulonglong(self.tx_carrier_freq))
-        g_lib.ad9361_set_rx_lo_freq(g_rf_phy, ctypes.c_ulonglong(self.rx_carrier_freq))
+        self.call_library(self.lib.ad9361_set_tx_lo_freq, self.rf_phy, ctypes.c_ulonglong(self.tx_carrier_freq))
+        self.call_library(self.lib.ad9361_set_rx_lo_freq, self.rf_phy, ctypes.c_ulonglong(self.rx_carrier_freq))
 
     def get_ad9361_configuration(self):
         tx_sampling_freq = ctypes.c_ulong(0)
@@ -211,28 +466,28 @@ class AD9361Driver (AD9361):
         tx_lo_freq = ctypes.c_ulonglong(0)
         rx_lo_freq = ctypes.c_ulonglong(0)
 
-        g_lib.ad9361_get_tx_sampling_freq(g_rf_phy, ctypes.byref(tx_sampling_freq))
-        g_lib.ad9361_get_rx_sampling_freq(g_rf_phy, ctypes.byref(rx_sampling_freq))
+        self.call_library(self.lib.ad9361_get_tx_sampling_freq, self.rf_phy, ctypes.byref(tx_sampling_freq))
+        self.call_library(self.lib.ad9361_get_rx_sampling_freq, self.rf_phy, ctypes.byref(rx_sampling_freq))
 
-        g_lib.ad9361_get_tx_rf_bandwidth(g_rf_phy, ctypes.byref(tx_rf_bandwidth))
-        g_lib.ad9361_get_rx_rf_bandwidth(g_rf_phy, ctypes.byref(rx_rf_bandwidth))
+        self.call_library(self.lib.ad9361_get_tx_rf_bandwidth, self.rf_phy, ctypes.byref(tx_rf_bandwidth))
+        self.call_library(self.lib.ad9361_get_rx_rf_bandwidth, self.rf_phy, ctypes.byref(rx_rf_bandwidth))
         
-        g_lib.ad9361_get_tx_lo_freq(g_rf_phy, ctypes.byref(tx_lo_freq))
-        g_lib.ad9361_get_rx_lo_freq(g_rf_phy, ctypes.byref(rx_lo_freq))
+        self.call_library(self.lib.ad9361_get_tx_lo_freq, self.rf_phy, ctypes.byref(tx_lo_freq))
+        self.call_library(self.lib.ad9361_get_rx_lo_freq, self.rf_phy, ctypes.byref(rx_lo_freq))
 
         return (tx_sampling_freq.value, rx_sampling_freq.value, tx_rf_bandwidth.value, rx_rf_bandwidth.value, tx_lo_freq.value, rx_lo_freq.value)
 
     def set_ad9361_tx_attenuation(self, atten_level, channel=0):
-        g_lib.ad9361_set_tx_attenuation(g_rf_phy, ctypes.c_byte(channel), ctypes.c_ulong(atten_level))
+        self.call_library(self.lib.ad9361_set_tx_attenuation, self.rf_phy, ctypes.c_byte(channel), ctypes.c_ulong(atten_level))
 
     def get_ad9361_tx_attenuation(self, channel=0):
         atten_level = ctypes.c_ulong(0)
-        g_lib.ad9361_get_tx_attenuation(g_rf_phy, ctypes.c_byte(channel), ctypes.byref(atten_level))
+        self.call_library(self.lib.ad9361_get_tx_attenuation, self.rf_phy, ctypes.c_byte(channel), ctypes.byref(atten_level))
         return atten_level.value
 
     def get_ad9361_rf_rssi(self, channel=0):
         rf_rssi = RF_RSSI()
-        g_lib.ad9361_get_rx_rssi(g_rf_phy, ctypes.c_byte(channel), ctypes.byref(rf_rssi))
+        self.call_library(self.lib.ad9361_get_rx_rssi, self.rf_phy, ctypes.c_byte(channel), ctypes.byref(rf_rssi))
         try:
             rssi = -1.0 * float(rf_rssi.symbol) / float(rf_rssi.multiplier)
         except:
@@ -242,20 +497,104 @@ class AD9361Driver (AD9361):
     def update_ad9361_tx_configuration(self, carrier_freq=None, bandwidth=None):
         if carrier_freq:
             self.tx_carrier_freq = int(carrier_freq)
-            g_lib.ad9361_set_tx_lo_freq(g_rf_phy, ctypes.c_ulonglong(self.tx_carrier_freq))
+            self.call_library(self.lib.ad9361_set_tx_lo_freq, self.rf_phy, ctypes.c_ulonglong(self.tx_carrier_freq))
 
         if bandwidth:
             self.tx_bandwidth = min(self.sample_rate//2, int(bandwidth))
-            g_lib.ad9361_set_tx_rf_bandwidth(g_rf_phy, ctypes.c_ulong(self.tx_bandwidth))
+            self.call_library(self.lib.ad9361_set_tx_rf_bandwidth, self.rf_phy, ctypes.c_ulong(self.tx_bandwidth))
 
     def update_ad9361_rx_configuration(self, carrier_freq=None, bandwidth=None):
         if carrier_freq:
             self.rx_carrier_freq = int(carrier_freq)
-            g_lib.ad9361_set_rx_lo_freq(g_rf_phy, ctypes.c_ulonglong(self.rx_carrier_freq))
+            self.call_library(self.lib.ad9361_set_rx_lo_freq, self.rf_phy, ctypes.c_ulonglong(self.rx_carrier_freq))
 
         if bandwidth:
             self.rx_bandwidth = min(self.sample_rate//2, int(bandwidth))
-            g_lib.ad9361_set_rx_rf_bandwidth(g_rf_phy, ctypes.c_ulong(self.rx_bandwidth))
+            self.call_library(self.lib.ad9361_set_rx_rf_bandwidth, self.rf_phy, ctypes.c_ulong(self.rx_bandwidth))
+
+    def store_ad9361_lo_profiles(self, frequencies, path="TX"):
+        '''
+        Tune the path's ("TX" or "RX") LO to each frequency through the
+        driver library, storing the synthesizer register writes it makes
+        as a profile for hop_ad9361_lo.  The LO is left tuned to the last
+        frequency.
+
+        A profile holds the last value the library wrote to each register,
+        in multi-byte writes where registers are adjacent.  Raises
+        AD9361DriverError if the library wrote no synthesizer integer or
+        fractional word for a frequency.
+        '''
+        path = path.upper()
+        ranges = AD9361_SYNTH_REGISTERS[path]
+        for frequency in frequencies:
+            frequency = int(frequency)
+            self.spi_recording = []
+            try:
+                if path == "TX":
+                    self.update_ad9361_tx_configuration(carrier_freq=frequency)
+                else:
+                    self.update_ad9361_rx_configuration(carrier_freq=frequency)
+            finally:
+                recording, self.spi_recording = self.spi_recording, None
+            profile = coalesce_spi_writes([(register, values) for register, values in recording
+                                           if any(start <= register < start + count for start, count in ranges)],
+                                          separate=(AD9361_REG_RFPLL_DIVIDERS,))
+            start, count = AD9361_SYNTH_FREQUENCY[path]
+            if not any(start <= register - n < start + count for register, values in profile for n in range(len(values))):
+                raise AD9361DriverError('No {} synthesizer frequency writes made for {} Hz'.format(path, frequency))
+            self.lo_profiles[(path, frequency)] = profile
+
+    def hop_ad9361_lo(self, frequency, path="TX"):
+        '''
+        Retune the path's LO to a frequency stored by
+        store_ad9361_lo_profiles, by replaying its synthesizer register
+        writes directly, then wait for the VCO to lock.  Returns true if
+        locked within spi_timeout.  Retune times are gathered in
+        lo_retune_stats.
+
+        The driver library is not involved, so its own record of the LO
+        frequency is not updated by a hop.  If a hop stops part way
+        through (an SPI timeout) the LO is left undefined, partly
+        retuned, until a later hop or library retune succeeds.
+        '''
+        path = path.upper()
+        frequency = int(frequency)
+        profile = self.lo_profiles.get((path, frequency))
+        if profile is None:
+            raise AD9361DriverError('No {} LO profile stored for {} Hz'.format(path, frequency))
+
+        start = _clock()
+        deadline = start + self.spi_timeout
+        locked = False
+        polls = 0
+        for register, values in profile:
+            if register == AD9361_REG_RFPLL_DIVIDERS:
+                # Shared with the other path, only change this path's divider
+                current = self.spi_read(register)
+                if current is None:
+                    break
+                mask = AD9361_DIVIDER_MASK[path]
+                values = [(current[0] & ~mask) | (values[0] & mask)] + values[1:]
+            if not self.spi_write(register, values):
+                break
+        else:
+            lock_register, lock_mask = AD9361_VCO_LOCK[path]
+            while True:
+                polls = polls + 1
+                value = self.spi_read(lock_register)
+                if value is not None and value[0] & lock_mask:
+                    locked = True
+                    break
+                if _clock() >= deadline:
+                    break
+        self.lo_retune_stats.record(polls, _clock() - start, locked)
+
+        if locked:
+            if path == "TX":
+                self.tx_carrier_freq = frequency
+            else:
+                self.rx_carrier_freq = frequency
+        return locked
 
 
 #
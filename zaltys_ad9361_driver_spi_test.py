@@ -0,0 +1,214 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test the AD9361 driver's SPI path, with libzaltys-ad9361 replaced by
+##  python stand-ins and each chip by a register file behind a simulated
+##  SMPI-to-SPI bridge (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_ad9361_driver_spi_test.py
+##
+
+import time
+import threading
+
+import zaltys_smpi_gateway
+import zaltys_ad9361_driver
+from zaltys_test_utils import check, finish, silenced
+
+
+class StandInLibrary(object):
+    '''
+        Stands in for libzaltys-ad9361: one SPI receive buffer, shared by
+        every driver instance as in the C library.
+    '''
+    def __init__(self):
+        self.rxbuf = [0] * 8
+
+    def ad9361_write_rxbuf(self, value, n):
+        self.rxbuf[n] = value
+
+    def spi_write(self, register, values):
+        txbuf = [0x80 | ((len(values) - 1) << 4) | (register >> 8), register & 0xFF] + values
+        return zaltys_ad9361_driver.spi_write_then_read(txbuf, len(txbuf), 0)
+
+    def ad9361_set_tx_lo_freq(self, rf_phy, frequency):
+        # Divider, a VCO setting rewritten, then the fractional and
+        # integer words, as multi-byte writes from the top register down
+        frequency = frequency.value
+        if frequency == 0:
+            return 0
+        self.spi_write(0x005, [0x20])
+        self.spi_write(0x27A, [0x00])
+        self.spi_write(0x275, [(frequency >> 32) & 0xFF, (frequency >> 24) & 0xFF, (frequency >> 16) & 0xFF])
+        self.spi_write(0x272, [(frequency >> 8) & 0xFF, frequency & 0xFF])
+        self.spi_write(0x27A, [0x81])
+        return 0
+
+    def read_register(self, register):
+        # As the library's register read: an SPI transfer, then (with the
+        # GIL released in a real library call) a read of the receive buffer
+        txbuf = [(register >> 8) & 0x03, register & 0xFF]
+        if zaltys_ad9361_driver.spi_write_then_read(txbuf, 2, 1) != 0:
+            return None
+        time.sleep(0.0001)
+        return self.rxbuf[0]
+
+
+class SimulatedBridge(object):
+    '''
+        An AD9361 register file behind an SMPI-to-SPI bridge at base in a
+        SimulatedSmpiGateway.
+    '''
+    def __init__(self, gateway, base):
+        self.gateway = gateway
+        self.base    = base
+        self.chip    = {}
+        gateway.set_behaviour(base, write=self.command)
+
+    def command(self, cmd_addr):
+        count    = ((cmd_addr >> 28) & 1)*4 + ((cmd_addr >> 25) & 3) + 1
+        register = cmd_addr & 0x3FF
+        if cmd_addr & 2**24:
+            dat = 0
+            for n in range(count):
+                dat = (dat << 8) + self.chip.get(register - n, 0)
+            self.gateway.poke(self.base + 2, dat % 2**32)
+            self.gateway.poke(self.base + 5, dat >> 32)
+        else:
+            dat = (self.gateway.peek(self.base + 4) << 32) + self.gateway.peek(self.base + 1)
+            for n in range(count):
+                self.chip[register - n] = (dat >> (8*(count-1-n))) & 0xFF
+
+library = StandInLibrary()
+zaltys_ad9361_driver.g_lib = library
+
+def make_driver(base=0x1000):
+    gateway = zaltys_smpi_gateway.SimulatedSmpiGateway()
+    bridge  = SimulatedBridge(gateway, base)
+    return zaltys_ad9361_driver.AD9361Driver(gateway, smpi2spi_base_address=base), bridge
+
+
+# Two chips read from threads each see their own data, though the
+# library's receive buffer is shared
+drivers = []
+for value in (0x11, 0x22):
+    driver, bridge = make_driver()
+    bridge.chip[0x00E] = value    # temperature, volatile so always read from the chip
+    drivers.append((driver, value))
+
+mismatches = []
+def read_temperature(driver, value):
+    for n in range(200):
+        data = driver.call_library(library.read_register, 0x00E)
+        if data != value:
+            mismatches.append((value, data))
+
+threads = [threading.Thread(target=read_temperature, args=pair) for pair in drivers]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+check('concurrent library calls kept apart', mismatches == [])
+
+# Both bridge data words are written and read for every transfer, however short
+driver, bridge = make_driver()
+gateway = driver.smpi_gateway
+gateway.poke(0x1004, 0xFFFFFFFF)
+check('1-byte write', driver.spi_write(0x0F0, [0x5A]) and bridge.chip[0x0F0] == 0x5A)
+check('1-byte write sets high data word', gateway.peek(0x1004) == 0)
+high_reads = []
+gateway.set_behaviour(0x1005, read=lambda: high_reads.append(1) or 0)
+check('1-byte read', driver.spi_read(0x00E) == [0])
+check('1-byte read reads high data word', len(high_reads) == 1)
+
+# The shadow against the simulated chip: volatile registers always come
+# from the chip, others from the shadow once known, matching the chip
+driver, bridge = make_driver()
+gateway = driver.smpi_gateway
+stale = []
+for start, count in zaltys_ad9361_driver.AD9361_VOLATILE_REGISTERS:
+    for register in range(start, start + count):
+        bridge.chip[register] = 0x01
+        first = driver.spi_read(register)
+        bridge.chip[register] = 0x02
+        if first != [0x01] or driver.spi_read(register) != [0x02]:
+            stale.append(register)
+check('volatile registers read from chip', stale == [])
+driver.spi_write(0x23B, [0x12, 0x34])
+gateway.reset_counters()
+check('shadowed multi-byte read', driver.spi_read(0x23B, 2) == [bridge.chip[0x23B], bridge.chip[0x23A]] == [0x12, 0x34])
+check('shadowed read skips bridge', gateway.writes == 0 and gateway.reads == 0)
+driver.spi_write(0x016, [0x01])    # calibration start
+gateway.reset_counters()
+driver.spi_read(0x23B)
+check('calibration clears shadow', gateway.writes == 1)
+driver.spi_read(0x23B)
+driver.spi_write(0x000, [zaltys_ad9361_driver.AD9361_SOFT_RESET])
+gateway.reset_counters()
+driver.spi_read(0x23B)
+check('soft reset clears shadow', gateway.writes == 1)
+
+# Writes while the shadow is disabled aren't served stale once re-enabled
+driver.spi_write(0x23B, [0x56])
+driver.spi_shadow_enabled = False
+driver.spi_write(0x23B, [0x78])
+driver.spi_shadow_enabled = True
+check('write while shadow disabled', driver.spi_read(0x23B) == [0x78] == [bridge.chip[0x23B]])
+
+# And against the dummy gateway, whose register reads are all 0
+with silenced():
+    driver = zaltys_ad9361_driver.AD9361Driver(zaltys_smpi_gateway.DummySmpiGateway(), smpi2spi_base_address=0x1000)
+    results = [driver.spi_write(0x23B, [0x9A]), driver.spi_read(0x23B), driver.spi_read(0x247)]
+    hits = driver.spi_shadow_hits
+check('dummy gateway: shadowed read', results[:2] == [True, [0x9A]] and hits == 1)
+check('dummy gateway: volatile read', results[2] == [0])
+
+# SPI writes coalesce to the last value of each register, adjacent
+# registers (descending) merged into writes of up to 8 bytes
+coalesce = zaltys_ad9361_driver.coalesce_spi_writes
+check('coalesce last values', coalesce([(0x10, [1]), (0x20, [2]), (0x10, [3])]) == [(0x20, [2]), (0x10, [3])])
+check('coalesce adjacent registers', coalesce([(0x12, [1, 2]), (0x10, [3]), (0x0F, [4])]) == [(0x12, [1, 2, 3, 4])])
+check('coalesce up to 8 bytes', coalesce([(0x20 - n, [n]) for n in range(10)]) == [(0x20, list(range(8))), (0x18, [8, 9])])
+check('coalesce keeps separate registers apart', coalesce([(0x006, [1]), (0x005, [2]), (0x004, [3])], separate=(0x005,)) == [(0x006, [1]), (0x005, [2]), (0x004, [3])])
+
+# LO profiles are stored coalesced and hop to the tuned register state
+driver, bridge = make_driver()
+driver.rf_phy = 1
+bridge.chip[0x287] = 0x02    # Tx synth VCO locked
+frequencies = [0x0123456789, 0x0223456789]
+tuned = {}
+for frequency in frequencies:
+    driver.update_ad9361_tx_configuration(carrier_freq=frequency)
+    tuned[frequency] = dict(bridge.chip)
+driver.store_ad9361_lo_profiles(frequencies)
+profile = driver.lo_profiles[('TX', frequencies[0])]
+check('stored profile coalesced', profile == [(0x005, [0x20]), (0x275, [0x01, 0x23, 0x45, 0x67, 0x89]), (0x27A, [0x81])])
+for frequency in frequencies:
+    bridge.chip[0x27A] = 0x00
+    check('hop to 0x{0:x}'.format(frequency), driver.hop_ad9361_lo(frequency) and bridge.chip == tuned[frequency])
+try:
+    driver.store_ad9361_lo_profiles([0])
+    check('profile without frequency writes rejected', False)
+except zaltys_ad9361_driver.AD9361DriverError:
+    check('profile without frequency writes rejected', ('TX', 0) not in driver.lo_profiles)
+
+finish()
@@ -51,3 +51,17 @@ print("rx_rf_bandwidth =", str(config[3]))
 print("tx_lo_freq =", str(config[4]))
 print("rx_lo_freq =", str(config[5]))
 print("Done")
+
+print("\nStoring Tx LO profiles (1000000000, 1100000000, 1200000000)...")
+hop_freqs = [1000000000, 1100000000, 1200000000]
+ad9361.store_ad9361_lo_profiles(hop_freqs, path="TX")
+print("Done\n")
+
+print("Hopping Tx LO...")
+for freq in hop_freqs*3:
+    if not ad9361.hop_ad9361_lo(freq, path="TX"):
+        print("Tx LO failed to lock at", str(freq))
+stats = ad9361.lo_retune_stats
+print("hops =", str(stats.waits), ", lock failures =", str(stats.timeouts))
+print("mean retune time = {:.1f}us, longest = {:.1f}us".format(1e6*stats.mean(), 1e6*stats.longest))
+print("Done")
@@ -0,0 +1,108 @@
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Packed word buffer utilities shared by the Zwire interfaces and SMPI
+##  gateways.
+##
+##  Register data is held in packed word arrays (array('I')) and in
+##  caller-owned buffers holding one register value per item, byte
+##  buffers holding native-endian 32-bit words.  On Python 3 buffers are
+##  viewed as words with memoryview.cast; Python 2 lacks it (and
+##  array.tobytes/frombytes), so the fallbacks here are used instead.
+##
+
+import array
+import ctypes
+import struct
+
+
+def words_tobytes(words):
+    '''
+    Return the contents of a packed word array as bytes.
+    '''
+    if hasattr(words, 'tobytes'):
+        return words.tobytes()
+    return words.tostring()
+
+def words_frombytes(typecode, data):
+    '''
+    Return a packed word array holding the bytes data.
+    '''
+    words = array.array(typecode)
+    if hasattr(words, 'frombytes'):
+        words.frombytes(data)
+    elif isinstance(data, memoryview):
+        words.fromstring(data.tobytes())
+    else:
+        words.fromstring(bytes(data))
+    return words
+
+
+class WordBuffer(object):
+    '''
+    Python 2 stand-in for a memoryview cast to register values, reading
+    and writing the items of buf (obj) through struct.  Slicing returns
+    a WordBuffer viewing part of the same buffer.
+    '''
+    readonly = False
+
+    def __init__(self, buf, start=0, count=None):
+        if isinstance(buf, WordBuffer):
+            if count is None:
+                count = len(buf) - start
+            start = buf.start + start
+            buf   = buf.obj
+        self.obj = buf
+        if isinstance(buf, ctypes.Array):
+            size = ctypes.sizeof(buf._type_)
+        elif isinstance(buf, array.array):
+            size = buf.itemsize
+        else:
+            size = 1
+        self.itemsize = size if size > 1 else 4
+        self.format   = {2: 'H', 4: 'I', 8: 'Q'}[self.itemsize]
+        self.start    = start
+        self.count    = len(buf) * size // self.itemsize - start if count is None else count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            return WordBuffer(self, start, max(0, stop - start))
+        return struct.unpack_from(self.format, self.obj, self._offset(index))[0]
+
+    def __setitem__(self, index, values):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            count = max(0, stop - start)
+            struct.pack_into('{0}{1}'.format(count, self.format), self.obj, (self.start + start) * self.itemsize, *values)
+        else:
+            struct.pack_into(self.format, self.obj, self._offset(index), values)
+
+    def _offset(self, index):
+        if index < 0:
+            index = index + self.count
+        if not 0 <= index < self.count:
+            raise IndexError('WordBuffer index out of range')
+        return (self.start + index) * self.itemsize
+
+    def tolist(self):
+        return list(struct.unpack_from('{0}{1}'.format(self.count, self.format), self.obj, self.start * self.itemsize))
@@ -0,0 +1,393 @@
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Record and replay register configuration sequences.
+##
+##  For a given parameter set a driver's configuration is a deterministic
+##  sequence of register writes and barriers.  A ConfigProgram holds such
+##  a sequence compactly, can be saved to and loaded from a binary file,
+##  and can be replayed to any SMPI gateway as coalesced bulk writes.
+##
+##  Like SmpiGateway objects, programs work with *register* addresses.
+##
+##  A ConfigProgramCache keeps compiled programs on disk, keyed by a hash
+##  of the driver (class and version) and parameters that produced them,
+##  so that reconfiguring to a previously seen profile is a single bulk
+##  replay.
+##
+
+import os
+import sys
+import mmap
+import array
+import struct
+import hashlib
+import numbers
+
+import zaltys_buffer_utils
+import zaltys_smpi_gateway
+
+
+#
+# Constants
+#
+CONFIG_PROGRAM_MAGIC   = b'ZCFGPRG1'
+CONFIG_PROGRAM_HEADER  = struct.Struct('<8sI')
+CONFIG_PROGRAM_BARRIER = 0xFFFFFFFF  # address marking a barrier
+CONFIG_PROGRAM_VERSION = 1           # bump when capture changes what programs hold
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+
+#
+#  ConfigProgram exceptions
+#
+class ConfigProgramError(Exception): pass
+
+
+class ConfigProgram(object):
+    '''
+    A sequence of register writes and barriers, held as packed address
+    and data columns.
+
+    Example usage:-
+      program = ConfigProgram()
+      program.write(0x0100, 0x00000001)
+      program.barrier()
+      program.save('profile.zcfg')
+
+      ConfigProgram.load('profile.zcfg').replay(gateway)
+    '''
+    def __init__(self, addresses=None, data=None):
+        self.addresses = array.array('I') if addresses is None else addresses
+        self.data      = array.array('I') if data is None else data
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __eq__(self, other):
+        return self.addresses == other.addresses and self.data == other.data
+
+    def __ne__(self, other):
+        return not self == other
+
+    def write(self, address, data):
+        self.addresses.append(address)
+        self.data.append(data % 2**32)
+
+    def multi_write(self, address, data, sequential=False):
+        data  = zaltys_smpi_gateway.register_values(data)
+        count = len(data)
+        if sequential:
+            self.addresses.extend(range(address, address + count))
+        else:
+            self.addresses.extend(array.array('I', [address]) * count)
+        self.data.extend(array.array('I', [int(d) % 2**32 for d in data]))
+
+    def barrier(self):
+        self.addresses.append(CONFIG_PROGRAM_BARRIER)
+        self.data.append(0)
+
+    def segments(self):
+        '''
+        Yield (addresses, data, barrier) for each run of writes, where
+        barrier is true if the run is followed by a barrier.
+        '''
+        start = 0
+        for n in range(len(self.addresses)):
+            if self.addresses[n] == CONFIG_PROGRAM_BARRIER:
+                yield self.addresses[start:n], self.data[start:n], True
+                start = n + 1
+        if start < len(self.addresses):
+            yield self.addresses[start:], self.data[start:], False
+
+    def replay(self, gateway):
+        '''
+        Issue the program to an SMPI gateway.  Writes between barriers are
+        sent as one scatter write, so coalesced into bulk transfers (see
+        coalesce_register_writes), and each barrier is passed on as a
+        register_barrier call.
+        '''
+        for addresses, data, barrier in self.segments():
+            if len(addresses):
+                gateway.register_scatter_write(addresses, data)
+            if barrier:
+                gateway.register_barrier()
+
+    def tobytes(self):
+        addresses = array.array('I', self.addresses)
+        data      = array.array('I', self.data)
+        if sys.byteorder == 'big':
+            addresses.byteswap()
+            data.byteswap()
+        return (CONFIG_PROGRAM_HEADER.pack(CONFIG_PROGRAM_MAGIC, len(addresses)) +
+                zaltys_buffer_utils.words_tobytes(addresses) + zaltys_buffer_utils.words_tobytes(data))
+
+    @classmethod
+    def frombytes(cls, buf):
+        '''
+        Build a program from its binary form, held in any buffer (bytes,
+        bytearray, mmap, ...).
+        '''
+        if len(buf) < CONFIG_PROGRAM_HEADER.size:
+            raise ConfigProgramError('Truncated configuration program')
+        magic, count = CONFIG_PROGRAM_HEADER.unpack_from(buf)
+        if magic != CONFIG_PROGRAM_MAGIC:
+            raise ConfigProgramError('Not a configuration program')
+        start = CONFIG_PROGRAM_HEADER.size
+        if len(buf) < start + 8*count:
+            raise ConfigProgramError('Truncated configuration program')
+        addresses = zaltys_buffer_utils.words_frombytes('I', buf[start:start+4*count])
+        data      = zaltys_buffer_utils.words_frombytes('I', buf[start+4*count:start+8*count])
+        if sys.byteorder == 'big':
+            addresses.byteswap()
+            data.byteswap()
+        return cls(addresses, data)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.frombytes(f.read())
+
+
+class RecordingSmpiGateway(zaltys_smpi_gateway.SmpiGateway):
+    '''
+    Record register writes and barriers into a ConfigProgram.  If a
+    gateway is given accesses are also passed through to it, otherwise
+    nothing reaches the hardware and reads are refused.
+
+    Example usage:-
+      recorder = RecordingSmpiGateway()
+      dvbs2m = Dvbs2mDriver(recorder, base_address=0x0000)
+      dvbs2m.configure_mod()
+      recorder.program.save('dvbs2m.zcfg')
+    '''
+    def __init__(self, gateway=None, program=None):
+        self.gateway = gateway
+        self.program = ConfigProgram() if program is None else program
+
+    def register_barrier(self):
+        self.program.barrier()
+        if self.gateway:
+            self.gateway.register_barrier()
+
+    def register_write(self, address, data):
+        self.program.write(address, data)
+        if self.gateway:
+            self.gateway.register_write(address, data)
+
+    def register_multi_write(self, address, data, sequential=False):
+        self.program.multi_write(address, data, sequential)
+        if self.gateway:
+            self.gateway.register_multi_write(address, data, sequential)
+
+    def register_scatter_write(self, addresses, data):
+        for n in range(len(addresses)):
+            self.program.write(addresses[n], data[n])
+        if self.gateway:
+            self.gateway.register_scatter_write(addresses, data)
+
+    def _target(self):
+        if not self.gateway:
+            raise ConfigProgramError('Register reads cannot be recorded without a gateway')
+        return self.gateway
+
+    def register_read(self, address):
+        return self._target().register_read(address)
+
+    def register_multi_read(self, address, count, sequential=False, packed=False):
+        return self._target().register_multi_read(address, count, sequential, packed)
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        return self._target().register_multi_read_into(address, buf, sequential)
+
+
+#
+# Driver parameter sets
+#
+def struct_params(config):
+    '''
+    Return the fields of a ctypes driver parameter structure as a list of
+    (name, value) pairs, suitable for driver_params.
+    '''
+    return [(name, getattr(config, name)) for name, ctype in config._fields_]
+
+def attribute_params(driver):
+    '''
+    Return the plain (numeric, boolean and string) attributes of a pure
+    python driver as a sorted list of (name, value) pairs, suitable for
+    driver_params.
+    '''
+    return sorted((name, value) for name, value in vars(driver).items()
+                  if isinstance(value, numbers.Number) or isinstance(value, STRING_TYPES))
+
+def file_version(path):
+    '''
+    Return (path, size, mtime) identifying the version of a file, or just
+    (path,) if it cannot be found (e.g. a library found by the loader).
+    '''
+    if path.endswith('.pyc') or path.endswith('.pyo'):
+        path = path[:-1]
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path,)
+    return (path, st.st_size, int(st.st_mtime))
+
+def driver_params(driver, params, library_path=None):
+    '''
+    Return a parameter set for ConfigProgramCache.key identifying the
+    driver class and the version of its module (and shared library, if
+    given) as well as its parameters, so that programs captured by an
+    older driver are not replayed after an upgrade.
+    '''
+    cls   = type(driver)
+    files = [file_version(sys.modules[cls.__module__].__file__)]
+    if library_path is not None:
+        files.append(file_version(library_path))
+    return (cls.__module__, cls.__name__, files, params)
+
+
+class ConfigProgramCache(object):
+    '''
+    An on-disk cache of configuration programs, keyed by a hash of the
+    driver parameter set, holding at most max_bytes of programs.  When
+    full the least recently used programs are evicted.  Programs are
+    loaded by mapping their files into memory.
+
+    Example usage:-
+      cache = ConfigProgramCache('/var/cache/zaltys')
+      dvbs2d = Dvbs2dDriver(gateway, base_address=0x400)
+      dvbs2d.program_cache = cache
+      dvbs2d.configure_demod()  # replays from the cache after the first time
+    '''
+    suffix = '.zcfg'
+
+    def __init__(self, directory, max_bytes=2**24):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits   = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, params):
+        '''
+        Return the cache key for a parameter set, any value with a stable
+        repr, usually built by driver_params.  The program format version
+        is part of the key.
+        '''
+        return hashlib.sha1(repr((CONFIG_PROGRAM_VERSION, params)).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        '''
+        Return the cached program for key, or None.
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    program = ConfigProgram.frombytes(map)
+                finally:
+                    map.close()
+            os.utime(path, None)  # mark as recently used
+        except (IOError, OSError, ValueError):
+            self.misses = self.misses + 1
+            return None
+        except ConfigProgramError:
+            self.discard(key)
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return program
+
+    def put(self, key, program):
+        '''
+        Store a program under key, then evict down to max_bytes.
+        '''
+        path = self._path(key)
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(program.tobytes())
+        if hasattr(os, 'replace'):
+            os.replace(temp, path)
+        else:
+            os.rename(temp, path)
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        '''
+        Return (mtime, size, path) for each cached program, most recently used first.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries, reverse=True)
+
+    def evict(self):
+        '''
+        Remove least recently used programs until the cache fits in max_bytes.
+        '''
+        total = 0
+        for mtime, size, path in self.entries():
+            total = total + size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            os.remove(path)
+
+    def program(self, params, capture):
+        '''
+        Return the program for a parameter set, calling capture() to
+        build it (and caching the result) on a miss.
+        '''
+        key = self.key(params)
+        program = self.get(key)
+        if program is None:
+            program = capture()
+            self.put(key, program)
+        return program
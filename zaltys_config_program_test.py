@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test configuration program record and replay, using the simulated
+##  SMPI gateway (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_config_program_test.py
+##
+
+import os
+import sys
+import tempfile
+
+import zaltys_smpi_gateway
+import zaltys_config_program
+import zaltys_dvbs2m_driver
+
+# Configure directly
+direct = zaltys_smpi_gateway.SimulatedSmpiGateway()
+dvbs2m = zaltys_dvbs2m_driver.Dvbs2mDriver(direct, base_address=0x0000, legacy_mode=False)
+dvbs2m.symbol_rate = 10e6
+dvbs2m.configure_mod()
+
+# Record the same configuration, without touching any hardware
+program = dvbs2m.capture_mod_program()
+
+# Save and reload it
+path = os.path.join(tempfile.mkdtemp(), 'dvbs2m.zcfg')
+program.save(path)
+loaded = zaltys_config_program.ConfigProgram.load(path)
+print('Program: {} entries, {} bytes on disk, reload {}'.format(len(program), os.path.getsize(path), 'OK' if loaded == program else 'FAILED'))
+
+# Replay it
+replayed = zaltys_smpi_gateway.SimulatedSmpiGateway()
+loaded.replay(replayed)
+print('Direct  : {} transfers, {} words'.format(direct.writes, direct.words_written))
+print('Replayed: {} transfers, {} words'.format(replayed.writes, replayed.words_written))
+
+for address in range(0x0000, 0x0400):
+    if direct.peek(address) != replayed.peek(address):
+        print('MISMATCH 0x{0:04x}: 0x{1:08x} != 0x{2:08x}'.format(address, direct.peek(address), replayed.peek(address)))
+        sys.exit(1)
+print('Replayed register state matches')
+
+# Configure through a program cache: first a miss (capture), then a hit (replay)
+cache = zaltys_config_program.ConfigProgramCache(os.path.join(tempfile.mkdtemp(), 'cache'))
+cached = zaltys_smpi_gateway.SimulatedSmpiGateway()
+dvbs2m = zaltys_dvbs2m_driver.Dvbs2mDriver(cached, base_address=0x0000, legacy_mode=False)
+dvbs2m.symbol_rate = 10e6
+dvbs2m.program_cache = cache
+dvbs2m.configure_mod()
+dvbs2m.configure_mod(full=True)
+print('Cache   : {} hits, {} misses, {} programs'.format(cache.hits, cache.misses, len(cache.entries())))
+
+for address in range(0x0000, 0x0400):
+    if direct.peek(address) != cached.peek(address):
+        print('MISMATCH 0x{0:04x}: 0x{1:08x} != 0x{2:08x}'.format(address, direct.peek(address), cached.peek(address)))
+        sys.exit(1)
+print('Cached register state matches')
+
+# Cache keys identify the driver and program format, not just the parameters
+class OtherDriver(zaltys_dvbs2m_driver.Dvbs2mDriver): pass
+params = zaltys_config_program.attribute_params(dvbs2m)
+key    = cache.key(zaltys_config_program.driver_params(dvbs2m, params))
+other  = cache.key(zaltys_config_program.driver_params(OtherDriver(cached), params))
+zaltys_config_program.CONFIG_PROGRAM_VERSION += 1
+newer  = cache.key(zaltys_config_program.driver_params(dvbs2m, params))
+zaltys_config_program.CONFIG_PROGRAM_VERSION -= 1
+if key in (other, newer):
+    print('Cache keys do not identify the driver: FAILED')
+    sys.exit(1)
+print('Cache keys identify the driver')
@@ -22,6 +22,9 @@
 ## Requires demodulator version 7.0 or compatible.
 ##
 import ctypes
+import threading
+
+import zaltys_config_program
 
 #
 # Callback functions (called from libzaltys-dvbs2d C code)
@@ -31,22 +34,47 @@ import ctypes
 # invoked from C has no notion of self, so cannot find other methods
 # or attributes.
 #
-g_smpi_gateway = None
-
+# The library holds a single set of callbacks, registered once per
+# process by load_library.  Each callback is routed to the gateway of the
+# driver instance whose configuration is running in the calling thread
+# (g_active.gateway, see call_library), so several driver instances, each
+# with its own gateway, can be used from threads.
+#
+# Nothing shows that the library keeps no global state between or
+# during its configuration calls, and ctypes releases the GIL during
+# library calls, so calls into the library are serialised by
+# g_call_lock: only one driver instance is in the library at a time.
+#
+# Each register write the library makes is a Python callback sent to
+# the gateway as it is made.  To turn a configuration's writes into a few
+# bulk transfers, wrap the gateway in zaltys_smpi_gateway's
+# BatchingSmpiGateway, which merges them and flushes at each barrier.
+# Avoiding the per-write Python callback altogether would need a native
+# callback, i.e. a compiled helper, which this package does not ship.
+#
 g_lib = None
 
+g_callbacks = None
+
+g_lib_lock = threading.Lock()
+
+g_call_lock = threading.RLock()
+
+g_active = threading.local()
+
 def register_init(config):
     None
 
 def register_write(address, data):
     # C driver supplies byte-address, need to convert to SMPI register-address
-    g_smpi_gateway.register_write(int(address)//4, int(data))
+    g_active.gateway.register_write(int(address)//4, int(data))
 
 def register_barrier():
-    None
+    # Flush any writes the gateway is holding back (e.g. BatchingSmpiGateway)
+    g_active.gateway.register_barrier()
 
 def register_done(config):
-    None
+    g_active.gateway.register_barrier()
 
 #
 # The DVB-S2 demodulator driver parameter structure.
@@ -77,6 +105,40 @@ class DVBS2DCONFIG(ctypes.Structure):
                 ("config.s2p_enable",      ctypes.c_byte)]
 
 
+#
+# Load the driver library and register the callback functions, once per
+# process.  Returns the library.
+#
+LIBRARY_PATH = '/usr/lib/libzaltys-dvbs2d.so'
+
+def load_library():
+    global g_lib, g_callbacks
+    with g_lib_lock:
+        if g_lib is None:
+            lib = ctypes.CDLL(LIBRARY_PATH)
+
+            # Note: callback objects are kept in g_callbacks to prevent
+            # garbage collection -- these are the objects that the C code
+            # calls, which then redirect to their associated module
+            # functions.
+            INITCBTYPE    = ctypes.CFUNCTYPE(None, ctypes.POINTER(DVBS2DCONFIG))
+            WRITECBTYPE   = ctypes.CFUNCTYPE(None, ctypes.c_ulong, ctypes.c_uint)
+            BARRIERCBTYPE = ctypes.CFUNCTYPE(None)
+            DONECBTYPE    = ctypes.CFUNCTYPE(None, ctypes.POINTER(DVBS2DCONFIG))
+            callbacks = (INITCBTYPE(register_init),
+                         WRITECBTYPE(register_write),
+                         BARRIERCBTYPE(register_barrier),
+                         DONECBTYPE(register_done))
+            lib.zaltys_dvbs2_demod_set_callback_reg_init(callbacks[0])
+            lib.zaltys_dvbs2_demod_set_callback_reg_write(callbacks[1])
+            lib.zaltys_dvbs2_demod_set_callback_reg_barrier(callbacks[2])
+            lib.zaltys_dvbs2_demod_set_callback_reg_done(callbacks[3])
+
+            g_callbacks = callbacks
+            g_lib = lib
+    return g_lib
+
+
 #
 # DVB-S2 Demodulator driver exceptions
 #
@@ -86,8 +148,9 @@ class Dvbs2dDriverError(Exception): pass
 #
 # DVB-S2 Demodulator driver class
 #
-# Instantiate a single instance of this class with an smpi_gateway
-# object and appropriate base_address and datapath_extension values.
+# Instantiate one instance of this class per demodulator, each with an
+# smpi_gateway object and appropriate base_address and datapath_extension
+# values.  Instances may be configured concurrently from separate threads.
 #
 class Dvbs2dDriver (object):
     '''
@@ -100,33 +163,8 @@ class Dvbs2dDriver (object):
           dvbs2d.configure_demod()
     '''
     def __init__(self, smpi_gateway, base_address=0, datapath_extension=4, tmtf_is_programmable=True, tmtf_tap_length=101, tmtf_coeff_size=12):
-        global g_smpi_gateway, g_lib
-
-        # Initialize module variables
-        g_smpi_gateway = smpi_gateway
-        g_lib = ctypes.CDLL('/usr/lib/libzaltys-dvbs2d.so')
-
-        # Setup callback functions
-        #
-        # Note: callback objects assigned to self attributes to
-        # prevent garbage collection -- these are the objects that the
-        # C code calls, which then redirect to their associated global
-        # python functions.
-        INITCBTYPE = ctypes.CFUNCTYPE(None, ctypes.POINTER(DVBS2DCONFIG))
-        self.reg_init_callback = INITCBTYPE(register_init)
-        g_lib.zaltys_dvbs2_demod_set_callback_reg_init(self.reg_init_callback)
-
-        WRITECBTYPE = ctypes.CFUNCTYPE(None, ctypes.c_ulong, ctypes.c_uint)
-        self.reg_write_callback = WRITECBTYPE(register_write)
-        g_lib.zaltys_dvbs2_demod_set_callback_reg_write(self.reg_write_callback)
-
-        BARRIERCBTYPE = ctypes.CFUNCTYPE(None)
-        self.reg_barrier_callback = BARRIERCBTYPE(register_barrier)
-        g_lib.zaltys_dvbs2_demod_set_callback_reg_barrier(self.reg_barrier_callback)
-
-        DONECBTYPE = ctypes.CFUNCTYPE(None, ctypes.POINTER(DVBS2DCONFIG))
-        self.reg_done_callback = DONECBTYPE(register_done)
-        g_lib.zaltys_dvbs2_demod_set_callback_reg_done(self.reg_done_callback)
+        self.smpi_gateway = smpi_gateway
+        self.lib = load_library()
 
         # Set default driver parameters
         self.base_address           = base_address
@@ -153,6 +191,9 @@ class Dvbs2dDriver (object):
         self.pls_value              = 0
         self.s2p_enable             = False
 
+        # No configuration program cache by default
+        self.program_cache = None
+
         # Initialize driver structure
         self.dvbs2d_config = DVBS2DCONFIG()
         self.fill_driver_struct()
@@ -183,5 +224,50 @@ class Dvbs2dDriver (object):
         self.dvbs2d_config.s2p_enable             = ctypes.c_byte(self.s2p_enable)
 
     def configure_demod(self):
+        '''
+        Configure the demodulator.  If program_cache is set the register
+        writes are replayed from a cached configuration program, captured
+        the first time each parameter set is seen.
+        '''
+        if self.program_cache is None:
+            self._configure_demod()
+        else:
+            self.fill_driver_struct()
+            params = zaltys_config_program.driver_params(self, zaltys_config_program.struct_params(self.dvbs2d_config), LIBRARY_PATH)
+            self.apply_program(self.program_cache.program(params, self.capture_demod_program))
+
+    def call_library(self, function, gateway=None):
+        '''
+        Call a library configuration function with this driver's parameter
+        structure, routing the register callbacks it makes in this thread
+        to gateway (by default this driver's smpi_gateway).  Calls from
+        different driver instances are serialised.
+        '''
+        with g_call_lock:
+            previous = getattr(g_active, 'gateway', None)
+            g_active.gateway = self.smpi_gateway if gateway is None else gateway
+            try:
+                function(ctypes.byref(self.dvbs2d_config))
+            finally:
+                g_active.gateway = previous
+
+    def _configure_demod(self, gateway=None):
         self.fill_driver_struct()
-        g_lib.zaltys_dvbs2_demod_utils_config_dvbs2(ctypes.byref(self.dvbs2d_config))
+        self.call_library(self.lib.zaltys_dvbs2_demod_utils_config_dvbs2, gateway)
+
+    def capture_demod_program(self):
+        '''
+        Run configure_demod with the current parameters, recording the
+        register writes and barriers into a ConfigProgram instead of
+        sending them to the hardware.
+        '''
+        recorder = zaltys_config_program.RecordingSmpiGateway()
+        self._configure_demod(recorder)
+        return recorder.program
+
+    def apply_program(self, program):
+        '''
+        Replay a ConfigProgram captured by capture_demod_program, skipping
+        the driver library entirely.
+        '''
+        program.replay(self.smpi_gateway)
@@ -23,6 +23,13 @@
 ##
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import zaltys_config_program
+
 # PLSV indexed information = [bits_per_symbol, code_id]
 plsv_infos = {  4: [2, 36],   6: [2, 12],   8: [2, 39],  10: [2, 20],  12: [2, 41],  14: [2, 21],  16: [2, 44],  18: [2, 23],
                20: [2, 52],  22: [2, 28],  24: [2, 58],  26: [2, 30],  28: [2, 67],  30: [2, 32],  32: [2, 71],  34: [2, 33],
@@ -92,6 +99,71 @@ code_infos = {12: [16200,  3240, [ 8424,   4374,   3024,   2010,  1784,  1392,
               74: [64800, 57600, [32580,  16380,  10980,   6660,  5580,  3420,  2340]],
               75: [64800, 58320, [32562,  16362,  10962,   6642,  5562,  3402,  2322]]}
 
+# Supported parallelism levels, in code_infos clks_per_iter order
+par_levels = [12, 24, 36, 60, 72, 120, 180]
+
+# Max iterations for PLSVs with no plsv_infos entry
+default_max_iterations = 50
+
+#
+# Max iterations tables
+#
+# Tables have one entry per even PLSV, so entry n is for PLSV 2*n.  They
+# are computed in one pass over the PLSV and code information (with NumPy
+# when installed) and cached by (sysclk, symbol_rate, par_level).
+#
+max_iterations_tables = {}
+
+def _plsv_columns():
+    plsvs = sorted(plsv_infos)
+    return (plsvs,
+            [plsv_infos[plsv][0] for plsv in plsvs],
+            [code_infos[plsv_infos[plsv][1]][0] for plsv in plsvs],
+            [code_infos[plsv_infos[plsv][1]][1] for plsv in plsvs],
+            [code_infos[plsv_infos[plsv][1]][2] for plsv in plsvs])
+
+def compute_max_iterations_table(sysclk, symbol_rate, par_level):
+    '''
+    Compute the max iterations table for a decoder clock, symbol rate and
+    parallelism level.  Returns a list of 256 integers.
+    '''
+    par_idx = par_levels.index(par_level)
+    par = par_level
+    plsvs, bits_per_sym, fsize, kldpc, clks = _plsv_columns()
+    table = [default_max_iterations] * 256
+
+    if numpy is not None:
+        bits_per_sym = numpy.array(bits_per_sym, dtype=float)
+        fsize = numpy.array(fsize, dtype=float)
+        kldpc = numpy.array(kldpc, dtype=float)
+        clks  = numpy.array(clks, dtype=float)[:, par_idx]
+
+        avail = (sysclk/symbol_rate)*(fsize/bits_per_sym)
+        ovhd = (kldpc/par)*math.ceil(par/8) + (360/par)*(par+9)*numpy.ceil((fsize-kldpc)/2880) + 2*fsize/par + 500
+        max_iters = numpy.minimum(numpy.floor((avail-ovhd)/clks)-1, 255).astype(int)
+        for plsv, iters in zip(plsvs, max_iters.tolist()):
+            table[plsv//2] = iters
+    else:
+        for n in range(len(plsvs)):
+            avail = (sysclk/symbol_rate)*(fsize[n]/bits_per_sym[n])
+            ovhd = (kldpc[n]/par)*math.ceil(par/8) + (360/par)*(par+9)*math.ceil((fsize[n]-kldpc[n])/2880) + 2*fsize[n]/par + 500
+            table[plsvs[n]//2] = int(min(math.floor((avail-ovhd)/clks[n][par_idx])-1,255))
+    return table
+
+def max_iterations_table(sysclk, symbol_rate, par_level):
+    '''
+    Return the (cached) max iterations table for a decoder clock, symbol
+    rate and parallelism level, as a tuple of 256 integers, entry n being
+    for PLSV 2*n.
+    '''
+    key = (sysclk, symbol_rate, par_level)
+    table = max_iterations_tables.get(key)
+    if table is None:
+        table = tuple(compute_max_iterations_table(sysclk, symbol_rate, par_level))
+        max_iterations_tables[key] = table
+    return table
+
+
 #
 # DVB-S2 Decoder driver exceptions
 #
@@ -124,7 +196,52 @@ class Dvbs2fdDriver (object):
         # Set default driver parameters
         self.symbol_rate = 1000000
 
+        # No configuration program cache by default
+        self.program_cache = None
+
     def configure_dec(self):
+        '''
+        Configure the decoder.  If program_cache is set the register
+        writes are replayed from a cached configuration program, captured
+        the first time each parameter set is seen.
+        '''
+        if self.program_cache is None:
+            self._configure_dec()
+        else:
+            params = zaltys_config_program.driver_params(self, zaltys_config_program.attribute_params(self))
+            self.apply_program(self.program_cache.program(params, self.capture_dec_program))
+
+    def capture_dec_program(self):
+        '''
+        Run the configuration with the current parameters, recording the
+        register writes and barriers into a ConfigProgram instead of
+        sending them to the hardware.
+        '''
+        gateway = self.smpi_gateway
+        recorder = zaltys_config_program.RecordingSmpiGateway()
+        self.smpi_gateway = recorder
+        try:
+            self._configure_dec()
+        finally:
+            self.smpi_gateway = gateway
+        return recorder.program
+
+    def apply_program(self, program):
+        '''
+        Replay a ConfigProgram captured by capture_dec_program.
+        '''
+        program.replay(self.smpi_gateway)
+
+    def max_iterations_table(self):
+        '''
+        Return the max iterations for each PLSV at the current symbol rate,
+        as a tuple of 256 integers, entry n being for PLSV 2*n.
+        '''
+        if self.par_level not in par_levels:
+            raise Dvbs2fdDriverError('Illegal par_level: {}, only 12, 24, 36, 60, 72, 120, or 180 supported'.format(self.par_level))
+        return max_iterations_table(self.sysclk, self.symbol_rate, self.par_level)
+
+    def _configure_dec(self):
         # Hold datapath in reset
         self.smpi_gateway.register_write(self.base_address + 0x00, 0x00000001)
 
@@ -136,29 +253,17 @@ class Dvbs2fdDriver (object):
         # them in reverse order to ensure that the second write is the correct
         # one.
         #
-        par_idx = {12:0, 24:1, 36:2, 60:3, 72:4, 120:5, 180:6}.get(self.par_level, None)
-        if par_idx:
-            for plsv in range(510,-2,-2):
-                plsv_info = plsv_infos.get(plsv, None)
-
-                if plsv_info:
-                    bits_per_sym = plsv_info[0]
-                    code_idx = plsv_info[1]
-                    fsize = code_infos.get(code_idx)[0]
-                    kldpc = code_infos.get(code_idx)[1]
-                    clks = code_infos.get(code_idx)[2][par_idx]
-                    par = self.par_level
-
-                    avail = (self.sysclk/self.symbol_rate)*(fsize/bits_per_sym)
-                    ovhd = (kldpc/par)*math.ceil(par/8) + (360/par)*(par+9)*math.ceil((fsize-kldpc)/2880) + 2*fsize/par + 500
-                    max_iters = int(min(math.floor((avail-ovhd)/clks)-1,255))
-                else:
-                    max_iters = 50
-
-                self.smpi_gateway.register_write(self.base_address + 0x04, (plsv << 16) + 1)
-                self.smpi_gateway.register_write(self.base_address + 0x05, max_iters)
-        else:
-            raise Dvbs2fdDriverError('Illegal par_level: {}, only 12, 24, 36, 60, 72, 120, or 180 supported'.format(self.par_level))
+        # Each PLSV takes a select write then a value write, all issued as
+        # one scatter write.
+        #
+        table = self.max_iterations_table()
+        addresses = [self.base_address + 0x04, self.base_address + 0x05] * 256
+        data = []
+        for plsv in range(510,-2,-2):
+            data.append((plsv << 16) + 1)
+            data.append(table[plsv//2])
+        self.smpi_gateway.register_scatter_write(addresses, data)
 
         # Release datapath from reset
         self.smpi_gateway.register_write(self.base_address + 0x00, 0x00000000)
+        self.smpi_gateway.register_barrier()
@@ -21,6 +21,9 @@
 ##
 ## Requires modulator version 3.2 or compatible.
 ##
+import zaltys_config_program
+import zaltys_hdrmm_driver
+import zaltys_rrc_utils
 
 # 
 # Legacy mode RRC coefficients
@@ -118,6 +121,12 @@ standard_rrc_select = {  5 : rrc05_181tap_16bit_coeffs,
                         35 : rrc35_181tap_16bit_coeffs,
                         40 : rrc40_181tap_16bit_coeffs }
 
+# Use the tables as they are for these roll-offs, other roll-offs are designed on demand
+for alpha, coeffs in legacy_rrc_select.items():
+    zaltys_rrc_utils.add_rrc_coeffs(alpha, coeffs, centre_tap=8192)
+for alpha, coeffs in standard_rrc_select.items():
+    zaltys_rrc_utils.add_rrc_coeffs(alpha, coeffs[:90])
+
 #
 # DVB-S2 Modulator driver exceptions
 #
@@ -160,7 +169,124 @@ class Dvbs2mDriver (object):
         self.ccm_mode           = False
         self.pls_value          = 0
 
-    def configure_mod(self):
+        # No configuration program cache by default
+        self.program_cache = None
+
+        # Live register state last applied to the hardware, None if unknown
+        self.applied_state = None
+
+    def mod_structure(self):
+        '''
+        Return the parameters that can only be changed with the datapath
+        held in reset.
+        '''
+        return (self.base_address, self.legacy_mode, self.txfilt_num_taps, self.txfilt_full_coeff_width, self.rrc_alpha)
+
+    def mod_state(self):
+        '''
+        Return the structure and the live register values for the current
+        parameters, as compared by configure_mod.
+        '''
+        iif, nco = self.interpolation()
+        return {'structure'   : self.mod_structure(),
+                'enc_control' : self.enc_control(),
+                'iif'         : iif,
+                'nco'         : nco,
+                'spll_ctrl'   : 0x00000010 if self.free_running else 0x00000000,
+                'dac_ctrl'    : self.dac_ctrl()}
+
+    def enc_control(self):
+        # DVBS2FE CCM/VCM mode, enable BB scrambler
+        return (self.pls_value << 16) | ((1 if self.ccm_mode else 0) << 6) | (1 << 5)
+
+    def interpolation(self):
+        '''
+        Return the IIF_CTRL and SPLL_INCR values for the symbol rate.
+        '''
+        return zaltys_hdrmm_driver.hdrmm_interpolation(self.sample_rate, self.symbol_rate)
+
+    def dac_ctrl(self):
+        return zaltys_hdrmm_driver.hdrmm_dac_ctrl(self.spectral_inversion)
+
+    def configure_mod(self, full=False):
+        '''
+        Configure the modulator.
+
+        If the modulator was last configured by this driver with the same
+        mod_structure() then only the live registers that differ are
+        written (ENC_CONTROL, IIF_CTRL, SPLL_INCR, SPLL_CTRL, DAC_CTRL) and
+        the datapath is not reset.  Otherwise, or if full is true, the
+        whole datapath is reset and rewritten.
+
+        If program_cache is set full register writes are replayed from a
+        cached configuration program, captured the first time each
+        parameter set is seen.
+        '''
+        state = self.mod_state()
+        old = self.applied_state
+
+        # Unknown until configured, in case of failure part way through
+        self.applied_state = None
+        if not full and old and old['structure'] == state['structure']:
+            self.update_mod(old, state)
+        elif self.program_cache is None:
+            self._configure_mod()
+        else:
+            params = zaltys_config_program.driver_params(self, zaltys_config_program.attribute_params(self))
+            self.apply_program(self.program_cache.program(params, self.capture_mod_program))
+        self.applied_state = state
+
+    def update_mod(self, old, new):
+        '''
+        Write the live registers that differ between two mod_state()
+        values, without resetting the datapath.
+        '''
+        zaltys_hdrmm_driver.update_hdrmm_live(self.smpi_gateway, self.base_address + 0x300, old, new)
+
+        if new['enc_control'] != old['enc_control']:
+            self.smpi_gateway.register_write(self.base_address + 0x100, new['enc_control'])   # FE: ENC_CONTROL
+        self.smpi_gateway.register_barrier()
+
+    def capture_mod_program(self):
+        '''
+        Run the configuration with the current parameters, recording the
+        register writes and barriers into a ConfigProgram instead of
+        sending them to the hardware.
+        '''
+        gateway = self.smpi_gateway
+        recorder = zaltys_config_program.RecordingSmpiGateway()
+        self.smpi_gateway = recorder
+        try:
+            self._configure_mod()
+        finally:
+            self.smpi_gateway = gateway
+        return recorder.program
+
+    def apply_program(self, program):
+        '''
+        Replay a ConfigProgram captured by capture_mod_program.
+        '''
+        self.applied_state = None
+        program.replay(self.smpi_gateway)
+
+    def txfilt_coeffs(self):
+        '''
+        Return the transmit filter coefficient register values, raising
+        Dvbs2mDriverError for an illegal roll-off.
+        '''
+        if not 0 < self.rrc_alpha <= 100:
+            raise Dvbs2mDriverError('Illegal RRC roll-off: {}, must be in the range 0% to 100%'.format(self.rrc_alpha))
+        if self.legacy_mode:
+            # 24 coefficient registers, centre tap of 8192
+            return zaltys_rrc_utils.txfilt_registers(self.rrc_alpha, 24, centre_tap=8192)
+        # One side of the filter loaded outermost coefficient first via a single register
+        return zaltys_rrc_utils.txfilt_registers(self.rrc_alpha, (self.txfilt_num_taps - 1)//2,
+                                                 coeff_width=self.txfilt_full_coeff_width, reverse=True)
+
+    def _configure_mod(self):
+        # Check parameters before writing any register
+        rrc_coeffs = self.txfilt_coeffs()
+
         # Hold datapath in reset
         enc_control = 0x00000001
         self.smpi_gateway.register_write(self.base_address + 0x100, enc_control) # FE: ENC_CONTROL
@@ -169,7 +295,7 @@ class Dvbs2mDriver (object):
         self.smpi_gateway.register_write(self.base_address + 0x300, 0x00000001)  # HDRMM: SYS_CTRL
 
         # DVBS2FE CCM/VCM mode, enable BB scrambler
-        enc_control = enc_control | (self.pls_value << 16) | ((1 if self.ccm_mode else 0) << 6) | (1 << 5)
+        enc_control = enc_control | self.enc_control()
         self.smpi_gateway.register_write(self.base_address + 0x100, enc_control) # ENC_CONTROL
 
         # HDRMM symbol mapper bypass
@@ -178,12 +304,7 @@ class Dvbs2mDriver (object):
         # HDRMM interpolation filter and SPLL setup
         self.smpi_gateway.register_write(self.base_address + 0x310, 0x00000001) # SPLL_CTRL, hold SPLL in reset
 
-        sr = self.sample_rate/5
-        iif = 0
-        while self.symbol_rate < sr:
-            sr = sr/2
-            iif = iif + 1
-        nco = int(round((self.symbol_rate / self.sample_rate) * 2**iif * 2**28))
+        iif, nco = self.interpolation()
         self.smpi_gateway.register_write(self.base_address + 0x308, iif)   # IIF_CTRL
         self.smpi_gateway.register_write(self.base_address + 0x311, nco)   # SPLL_INCR
 
@@ -203,8 +324,7 @@ class Dvbs2mDriver (object):
             self.smpi_gateway.register_write(self.base_address + 0x310, 0x00000000)  # enable SPLL
 
         # HDRMM DAC control setup
-        dac_ctrl = 0x00000302
-        if self.spectral_inversion: dac_ctrl = dac_ctrl | 0x00000020
+        dac_ctrl = self.dac_ctrl()
         self.smpi_gateway.register_write(self.base_address + 0x309, dac_ctrl)    # DAC_CTRL
         self.smpi_gateway.register_write(self.base_address + 0x30A, 0x00000000)  # DAC_IOFFSET
         self.smpi_gateway.register_write(self.base_address + 0x30B, 0x00000000)  # DAC_QOFFSET
@@ -213,19 +333,11 @@ class Dvbs2mDriver (object):
         
         # HDRMM transmit filter setup
         if self.legacy_mode:
-            rrc_coeffs = legacy_rrc_select.get(self.rrc_alpha)
-            if rrc_coeffs:
-                for offset in range(0,24):
-                    self.smpi_gateway.register_write(self.base_address + 0x320 + offset, rrc_coeffs[offset] % 65536)
-            else:
-                raise Dvbs2mDriverError('Illegal legacy RRC roll-off: {}, only 20%, 25%, 30%, 35%, 40% supported'.format(self.rrc_alpha))
+            # 24 coefficient registers
+            self.smpi_gateway.register_multi_write(self.base_address + 0x320, rrc_coeffs, sequential=True)
         else:
-            rrc_coeffs = standard_rrc_select.get(self.rrc_alpha)
-            if rrc_coeffs:
-                for offset in range(89,-1,-1):
-                    self.smpi_gateway.register_write(self.base_address + 0x320, int(round(float(rrc_coeffs[offset])/float(2**(16-self.txfilt_full_coeff_width)))) % 65536)
-            else:
-                raise Dvbs2mDriverError('Illegal RRC roll-off: {}, only 5%, 10%, 15%, 20%, 25%, 30%, 35%, 40% supported'.format(self.rrc_alpha))
+            # Coefficient loading port
+            self.smpi_gateway.register_multi_write(self.base_address + 0x320, rrc_coeffs)
 
         self.smpi_gateway.register_write(self.base_address + 0x338, 0x00000000)
             
@@ -235,3 +347,4 @@ class Dvbs2mDriver (object):
         self.smpi_gateway.register_write(self.base_address + 0x200, 0x00000000)  # PLF: PLF_CONTROL
         enc_control = enc_control & 0xFFFFFFFE
         self.smpi_gateway.register_write(self.base_address + 0x100, enc_control) # FE: ENC_CONTROL
+        self.smpi_gateway.register_barrier()
@@ -22,6 +22,9 @@
 ## Requires demodulator version 7.7 or compatible.
 ##
 import ctypes
+import threading
+
+import zaltys_config_program
 
 #
 # Callback functions (called from libzaltys-hdrmd C code)
@@ -31,22 +34,47 @@ import ctypes
 # invoked from C has no notion of self, so cannot find other methods
 # or attributes.
 #
-g_smpi_gateway = None
-
+# The library holds a single set of callbacks, registered once per
+# process by load_library.  Each callback is routed to the gateway of the
+# driver instance whose configuration is running in the calling thread
+# (g_active.gateway, see call_library), so several driver instances, each
+# with its own gateway, can be used from threads.
+#
+# Nothing shows that the library keeps no global state between or
+# during its configuration calls, and ctypes releases the GIL during
+# library calls, so calls into the library are serialised by
+# g_call_lock: only one driver instance is in the library at a time.
+#
+# Each register write the library makes is a Python callback sent to
+# the gateway as it is made.  To turn a configuration's writes into a few
+# bulk transfers, wrap the gateway in zaltys_smpi_gateway's
+# BatchingSmpiGateway, which merges them and flushes at each barrier.
+# Avoiding the per-write Python callback altogether would need a native
+# callback, i.e. a compiled helper, which this package does not ship.
+#
 g_lib = None
 
+g_callbacks = None
+
+g_lib_lock = threading.Lock()
+
+g_call_lock = threading.RLock()
+
+g_active = threading.local()
+
 def register_init(config):
     None
 
 def register_write(address, data):
     # C driver supplies byte-address, need to convert to SMPI register-address
-    g_smpi_gateway.register_write(int(address)//4, int(data))
+    g_active.gateway.register_write(int(address)//4, int(data))
 
 def register_barrier():
-    None
+    # Flush any writes the gateway is holding back (e.g. BatchingSmpiGateway)
+    g_active.gateway.register_barrier()
 
 def register_done(config):
-    None
+    g_active.gateway.register_barrier()
 
 #
 # The HDRM demodulator driver parameter structure.
@@ -85,6 +113,40 @@ class HDRMDCONFIG(ctypes.Structure):
                 ("coarse_steps",           ctypes.c_uint)]
 
 
+#
+# Load the driver library and register the callback functions, once per
+# process.  Returns the library.
+#
+LIBRARY_PATH = '/usr/lib/libzaltys-hdrmd.so'
+
+def load_library():
+    global g_lib, g_callbacks
+    with g_lib_lock:
+        if g_lib is None:
+            lib = ctypes.CDLL(LIBRARY_PATH)
+
+            # Note: callback objects are kept in g_callbacks to prevent
+            # garbage collection -- these are the objects that the C code
+            # calls, which then redirect to their associated module
+            # functions.
+            INITCBTYPE    = ctypes.CFUNCTYPE(None, ctypes.POINTER(HDRMDCONFIG))
+            WRITECBTYPE   = ctypes.CFUNCTYPE(None, ctypes.c_ulong, ctypes.c_uint)
+            BARRIERCBTYPE = ctypes.CFUNCTYPE(None)
+            DONECBTYPE    = ctypes.CFUNCTYPE(None, ctypes.POINTER(HDRMDCONFIG))
+            callbacks = (INITCBTYPE(register_init),
+                         WRITECBTYPE(register_write),
+                         BARRIERCBTYPE(register_barrier),
+                         DONECBTYPE(register_done))
+            lib.zaltys_hdrm_demod_set_callback_reg_init(callbacks[0])
+            lib.zaltys_hdrm_demod_set_callback_reg_write(callbacks[1])
+            lib.zaltys_hdrm_demod_set_callback_reg_barrier(callbacks[2])
+            lib.zaltys_hdrm_demod_set_callback_reg_done(callbacks[3])
+
+            g_callbacks = callbacks
+            g_lib = lib
+    return g_lib
+
+
 #
 # HDRM Demodulator driver exceptions
 #
@@ -94,8 +156,9 @@ class HdrmdDriverError(Exception): pass
 #
 # HDRM Demodulator driver class
 #
-# Instantiate a single instance of this class with an smpi_gateway
-# object and appropriate base_address and datapath_extension values.
+# Instantiate one instance of this class per demodulator, each with an
+# smpi_gateway object and appropriate base_address and datapath_extension
+# values.  Instances may be configured concurrently from separate threads.
 #
 class HdrmdDriver (object):
     '''
@@ -109,33 +172,8 @@ class HdrmdDriver (object):
           hdrmd.configure_demod()
     '''
     def __init__(self, smpi_gateway, base_address=0, datapath_extension=4):
-        global g_smpi_gateway, g_lib
-
-        # Initialize module variables
-        g_smpi_gateway = smpi_gateway
-        g_lib = ctypes.CDLL('/usr/lib/libzaltys-hdrmd.so')
-
-        # Setup callback functions
-        #
-        # Note: callback objects assigned to self attributes to
-        # prevent garbage collection -- these are the objects that the
-        # C code calls, which then redirect to their associated global
-        # python functions.
-        INITCBTYPE = ctypes.CFUNCTYPE(None, ctypes.POINTER(HDRMDCONFIG))
-        self.reg_init_callback = INITCBTYPE(register_init)
-        g_lib.zaltys_hdrm_demod_set_callback_reg_init(self.reg_init_callback)
-
-        WRITECBTYPE = ctypes.CFUNCTYPE(None, ctypes.c_ulong, ctypes.c_uint)
-        self.reg_write_callback = WRITECBTYPE(register_write)
-        g_lib.zaltys_hdrm_demod_set_callback_reg_write(self.reg_write_callback)
-
-        BARRIERCBTYPE = ctypes.CFUNCTYPE(None)
-        self.reg_barrier_callback = BARRIERCBTYPE(register_barrier)
-        g_lib.zaltys_hdrm_demod_set_callback_reg_barrier(self.reg_barrier_callback)
-
-        DONECBTYPE = ctypes.CFUNCTYPE(None, ctypes.POINTER(HDRMDCONFIG))
-        self.reg_done_callback = DONECBTYPE(register_done)
-        g_lib.zaltys_hdrm_demod_set_callback_reg_done(self.reg_done_callback)
+        self.smpi_gateway = smpi_gateway
+        self.lib = load_library()
 
         # Set default driver parameters
         self.modulation_scheme      = "QPSK"
@@ -171,6 +209,9 @@ class HdrmdDriver (object):
         self.search_range           = 5
         self.coarse_steps           = 10
 
+        # No configuration program cache by default
+        self.program_cache = None
+
         # Initialize driver structure
         self.hdrmd_config = HDRMDCONFIG()
         self.fill_driver_struct()
@@ -209,39 +250,84 @@ class HdrmdDriver (object):
         self.hdrmd_config.coarse_steps           = ctypes.c_uint(int(self.coarse_steps))
 
     def configure_demod(self):
+        '''
+        Configure the demodulator.  If program_cache is set the register
+        writes are replayed from a cached configuration program, captured
+        the first time each parameter set is seen.
+        '''
+        if self.program_cache is None:
+            self._configure_demod()
+        else:
+            self.fill_driver_struct()
+            params = zaltys_config_program.driver_params(self, (self.modulation_scheme.upper(), zaltys_config_program.struct_params(self.hdrmd_config)), LIBRARY_PATH)
+            self.apply_program(self.program_cache.program(params, self.capture_demod_program))
+
+    def call_library(self, function, gateway=None):
+        '''
+        Call a library configuration function with this driver's parameter
+        structure, routing the register callbacks it makes in this thread
+        to gateway (by default this driver's smpi_gateway).  Calls from
+        different driver instances are serialised.
+        '''
+        with g_call_lock:
+            previous = getattr(g_active, 'gateway', None)
+            g_active.gateway = self.smpi_gateway if gateway is None else gateway
+            try:
+                function(ctypes.byref(self.hdrmd_config))
+            finally:
+                g_active.gateway = previous
+
+    def _configure_demod(self, gateway=None):
         self.fill_driver_struct()
 
         if self.modulation_scheme.upper() == "BPSK":
-            g_lib.zaltys_hdrm_demod_utils_config_bpsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_bpsk, gateway)
         elif self.modulation_scheme.upper() == "QPSK":
-            g_lib.zaltys_hdrm_demod_utils_config_qpsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_qpsk, gateway)
         elif self.modulation_scheme.upper() == "8PSK":
-            g_lib.zaltys_hdrm_demod_utils_config_8psk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_8psk, gateway)
         elif self.modulation_scheme.upper() == "16QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_16qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_16qam, gateway)
         elif self.modulation_scheme.upper() == "OQPSK":
-            g_lib.zaltys_hdrm_demod_utils_config_oqpsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_oqpsk, gateway)
         elif self.modulation_scheme.upper() == "CQPSK":
-            g_lib.zaltys_hdrm_demod_utils_config_cqpsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_cqpsk, gateway)
         elif self.modulation_scheme.upper() == "DQPSK":
-            g_lib.zaltys_hdrm_demod_utils_config_dqpsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_dqpsk, gateway)
         elif self.modulation_scheme.upper() == "8QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_8qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_8qam, gateway)
         elif self.modulation_scheme.upper() == "16APSK":
-            g_lib.zaltys_hdrm_demod_utils_config_16apsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_16apsk, gateway)
         elif self.modulation_scheme.upper() == "32APSK":
-            g_lib.zaltys_hdrm_demod_utils_config_32apsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_32apsk, gateway)
         elif self.modulation_scheme.upper() == "8APSK":
-            g_lib.zaltys_hdrm_demod_utils_config_8apsk(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_8apsk, gateway)
         elif self.modulation_scheme.upper() == "64QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_64qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_64qam, gateway)
         elif self.modulation_scheme.upper() == "OS8QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_os8qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_os8qam, gateway)
         elif self.modulation_scheme.upper() == "32QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_32qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_32qam, gateway)
         elif self.modulation_scheme.upper() == "C32QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_c32qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_c32qam, gateway)
         elif self.modulation_scheme.upper() == "C128QAM":
-            g_lib.zaltys_hdrm_demod_utils_config_c128qam(ctypes.byref(self.hdrmd_config))
+            self.call_library(self.lib.zaltys_hdrm_demod_utils_config_c128qam, gateway)
         else:
             raise HdrmdDriverError('Unknown modulation scheme: {}'.format(self.modulation_scheme))
+
+    def capture_demod_program(self):
+        '''
+        Run configure_demod with the current parameters, recording the
+        register writes and barriers into a ConfigProgram instead of
+        sending them to the hardware.
+        '''
+        recorder = zaltys_config_program.RecordingSmpiGateway()
+        self._configure_demod(recorder)
+        return recorder.program
+
+    def apply_program(self, program):
+        '''
+        Replay a ConfigProgram captured by capture_demod_program, skipping
+        the driver library entirely.
+        '''
+        program.replay(self.smpi_gateway)
@@ -23,6 +23,8 @@
 ##
 import math
 
+import zaltys_rrc_utils
+
 #
 # Standard constellations -- as documented in HDRMD programming guide
 # (mappings as used by HDRMD stats block)
@@ -199,6 +201,10 @@ legacy_rrc_select = { 20 : legacy_rrc_20,
                       35 : legacy_rrc_35,
                       40 : legacy_rrc_40 }
 
+# Use the tables as they are for these roll-offs, other roll-offs are designed on demand
+for alpha, coeffs in legacy_rrc_select.items():
+    zaltys_rrc_utils.add_rrc_coeffs(alpha, coeffs, centre_tap=8192)
+
 #
 # An easy-to-use function to access the above tables
 #
@@ -220,6 +226,54 @@ def make_constellation_map(modulation_scheme="QPSK", map_scheme="ZALTYS"):
 class HdrmmDriverError(Exception): pass
 
 
+#
+# HDRM Modulator live registers
+#
+# Shared with drivers whose datapath includes the HDRM Modulator (e.g. the
+# DVB-S2 Modulator, with its HDRMM registers at base_address + 0x300).
+#
+def hdrmm_interpolation(sample_rate, symbol_rate):
+    '''
+    Return the IIF_CTRL and SPLL_INCR values for the symbol rate.
+    '''
+    sr = sample_rate/5
+    iif = 0
+    while symbol_rate < sr:
+        sr = sr/2
+        iif = iif + 1
+    nco = int(round((symbol_rate / sample_rate) * 2**iif * 2**28))
+    return iif, nco
+
+def hdrmm_dac_ctrl(spectral_inversion):
+    '''
+    Return the DAC_CTRL value.
+    '''
+    dac_ctrl = 0x00000302
+    if spectral_inversion: dac_ctrl = dac_ctrl | 0x00000020
+    return dac_ctrl
+
+def update_hdrmm_live(smpi_gateway, hdrmm_address, old, new):
+    '''
+    Write the HDRMM live registers (IIF_CTRL, SPLL_INCR, SPLL_CTRL,
+    DAC_CTRL) that differ between two mod_state() values, without
+    resetting the datapath.  hdrmm_address is the address of the HDRMM
+    SYS_CTRL register.
+    '''
+    if new['iif'] != old['iif']:
+        smpi_gateway.register_write(hdrmm_address + 0x10, 0x00000001)       # SPLL_CTRL, hold SPLL in reset
+        smpi_gateway.register_write(hdrmm_address + 0x08, new['iif'])       # IIF_CTRL
+        smpi_gateway.register_write(hdrmm_address + 0x11, new['nco'])       # SPLL_INCR
+        smpi_gateway.register_write(hdrmm_address + 0x10, new['spll_ctrl']) # SPLL_CTRL
+    else:
+        if new['nco'] != old['nco']:
+            smpi_gateway.register_write(hdrmm_address + 0x11, new['nco'])       # SPLL_INCR
+        if new['spll_ctrl'] != old['spll_ctrl']:
+            smpi_gateway.register_write(hdrmm_address + 0x10, new['spll_ctrl']) # SPLL_CTRL
+
+    if new['dac_ctrl'] != old['dac_ctrl']:
+        smpi_gateway.register_write(hdrmm_address + 0x09, new['dac_ctrl'])      # DAC_CTRL
+
+
 #
 # HDRM Modulator driver class
 #
@@ -236,8 +290,14 @@ class HdrmmDriver (object):
           hdrmm.sample_rate = 125e6
           hdrmm.symbol_rate = 10e6
           hdrmm.configure_mod()
+
+          # Preload alternative maps, then switch with single register writes
+          hdrmm.preload_constellation("16APSK", make_constellation_map("16APSK"))
+          hdrmm.switch_constellation("16APSK")
+          hdrmm.switch_to_cw()
+          hdrmm.switch_constellation()   # back to the configured map
     '''
-    def __init__(self, smpi_gateway, base_address=0, legacy_mode=True, txfilt_num_taps=49, txfilt_full_coeff_width=14):
+    def __init__(self, smpi_gateway, base_address=0, legacy_mode=True, txfilt_num_taps=49, txfilt_full_coeff_width=14, map_ram_size=256):
         self.smpi_gateway            = smpi_gateway
 
         # Set hardware configuration parameters
@@ -255,10 +315,155 @@ class HdrmmDriver (object):
         self.offset_mode        = False   # set to True for OQPSK support
         self.spectral_inversion = False
 
+        # Live register state last applied to the hardware, None if unknown
+        self.applied_state = None
+
+        # Constellation maps held in the symbol mapper RAM: name -> (base, map)
+        self.map_ram_size        = map_ram_size
+        self.constellation_banks = {}
+        self.active_bank         = None
+
     def select_constellation_map(self, modulation_scheme="QPSK", map_scheme="ZALTYS"):
         self.constellation_map = make_constellation_map(modulation_scheme, map_scheme)
-        
-    def configure_mod(self):
+
+    def allocate_constellation_bank(self, size):
+        '''
+        Return the lowest base address, aligned to size, of a free region
+        of size entries in the symbol mapper RAM.
+        '''
+        for base in range(0, self.map_ram_size - size + 1, size):
+            if all(base + size <= other or other + len(map) <= base for other, map in self.constellation_banks.values()):
+                return base
+        raise HdrmmDriverError('No room for a {}-point constellation in the symbol mapper RAM'.format(size))
+
+    def load_constellation_bank(self, name, base, constellation_map):
+        '''
+        Write a constellation map into the symbol mapper RAM at base, in
+        one bulk transfer, and record it as a bank.
+        '''
+        self.smpi_gateway.register_write(self.base_address + 0x06, 0x00010000 | base)  # MAP_PBASE
+        self.smpi_gateway.register_multi_write(self.base_address + 0x07, constellation_map)  # MAP_PBOX
+        self.smpi_gateway.register_write(self.base_address + 0x06, 0x00000000)         # MAP_PBASE
+        self.constellation_banks[name] = (base, tuple(constellation_map))
+
+    def preload_constellation(self, name, constellation_map):
+        '''
+        Load a constellation map (see make_constellation_map) into a free
+        bank of the symbol mapper RAM, ready for switch_constellation.
+        Maps must have the same number of points as the configured one to
+        be switched to.  Returns the bank's base address.
+
+        Banks other than the configured map ('configured') and the CW map
+        ('CW') survive reconfiguration unless the new maps overlap them.
+        '''
+        bank = self.constellation_banks.get(name)
+        if bank and bank[1] == tuple(constellation_map):
+            return bank[0]
+        self.constellation_banks.pop(name, None)
+        base = self.allocate_constellation_bank(len(constellation_map))
+        self.load_constellation_bank(name, base, constellation_map)
+        return base
+
+    def switch_constellation(self, name='configured'):
+        '''
+        Switch the symbol mapper to a preloaded constellation bank (or back
+        to the configured map, or to 'CW') with a single MAP_CBASE write.
+        '''
+        bank = self.constellation_banks.get(name)
+        if bank is None:
+            raise HdrmmDriverError('Constellation bank not loaded: {}'.format(name))
+        base, constellation_map = bank
+        if len(constellation_map) != len(self.constellation_map):
+            raise HdrmmDriverError('Constellation bank {} has {} points, {} configured: use configure_mod'.format(name, len(constellation_map), len(self.constellation_map)))
+        self.smpi_gateway.register_write(self.base_address + 0x05, base)  # MAP_CBASE
+        self.active_bank = name
+
+        if name != 'CW':
+            self.constellation_map = list(constellation_map)
+            if self.applied_state:
+                self.applied_state['structure'] = self.mod_structure()
+
+    def switch_to_cw(self):
+        '''
+        Switch to the constant (CW test tone) symbol map.
+        '''
+        self.switch_constellation('CW')
+
+    def mod_structure(self):
+        '''
+        Return the parameters that can only be changed with the datapath
+        held in reset.
+        '''
+        return (self.base_address, self.legacy_mode, self.txfilt_num_taps, self.txfilt_full_coeff_width,
+                self.rrc_alpha, tuple(self.constellation_map), self.offset_mode)
+
+    def mod_state(self):
+        '''
+        Return the structure and the live register values for the current
+        parameters, as compared by configure_mod.
+        '''
+        iif, nco = self.interpolation()
+        return {'structure' : self.mod_structure(),
+                'iif'       : iif,
+                'nco'       : nco,
+                'spll_ctrl' : 0x00000010 if self.free_running else 0x00000000,
+                'dac_ctrl'  : self.dac_ctrl()}
+
+    def interpolation(self):
+        '''
+        Return the IIF_CTRL and SPLL_INCR values for the symbol rate.
+        '''
+        return hdrmm_interpolation(self.sample_rate, self.symbol_rate)
+
+    def dac_ctrl(self):
+        return hdrmm_dac_ctrl(self.spectral_inversion)
+
+    def configure_mod(self, full=False):
+        '''
+        Configure the modulator.
+
+        If the modulator was last configured by this driver with the same
+        mod_structure() then only the live registers that differ are
+        written (IIF_CTRL, SPLL_INCR, SPLL_CTRL, DAC_CTRL) and the datapath
+        is not reset.  Otherwise, or if full is true, the whole datapath is
+        reset and rewritten.
+        '''
+        state = self.mod_state()
+        old = self.applied_state
+
+        # Unknown until configured, in case of failure part way through
+        self.applied_state = None
+        if not full and old and old['structure'] == state['structure']:
+            self.update_mod(old, state)
+        else:
+            self._configure_mod()
+        self.applied_state = state
+
+    def update_mod(self, old, new):
+        '''
+        Write the live registers that differ between two mod_state()
+        values, without resetting the datapath.
+        '''
+        update_hdrmm_live(self.smpi_gateway, self.base_address, old, new)
+        self.smpi_gateway.register_barrier()
+
+    def txfilt_coeffs(self):
+        '''
+        Return the transmit filter coefficient register values, raising
+        HdrmmDriverError for an illegal roll-off.
+        '''
+        if not 0 < self.rrc_alpha <= 100:
+            raise HdrmmDriverError('Illegal RRC roll-off: {}, must be in the range 0% to 100%'.format(self.rrc_alpha))
+        if self.legacy_mode:
+            # 24 coefficient registers, centre tap of 8192
+            return zaltys_rrc_utils.txfilt_registers(self.rrc_alpha, 24, centre_tap=8192)
+        # One side of the filter loaded outermost coefficient first via a single register
+        return zaltys_rrc_utils.txfilt_registers(self.rrc_alpha, (self.txfilt_num_taps - 1)//2,
+                                                 coeff_width=self.txfilt_full_coeff_width, reverse=True)
+
+    def _configure_mod(self):
+        # Check parameters before writing any register
+        rrc_coeffs = self.txfilt_coeffs()
         bits_per_symbol = int(round(math.log(len(self.constellation_map))/math.log(2)))
 
         # Hold datapath in reset
@@ -267,31 +472,32 @@ class HdrmmDriver (object):
         # Hold FIFO in reset
         self.smpi_gateway.register_write(self.base_address + 0x04, 0x00010000) # FIFO_CTRL
 
-        # Symbol mapper setup
-        self.smpi_gateway.register_write(self.base_address + 0x06, 0x00010000) # MAP_PBASE
-        for pt in self.constellation_map:
-            self.smpi_gateway.register_write(self.base_address + 0x07, pt)     # MAP_PBOX
-        self.smpi_gateway.register_write(self.base_address + 0x06, 0x00000000) # MAP_PBASE
+        # Symbol mapper setup, keeping preloaded banks clear of the new maps
+        for name in ('configured', 'CW'):
+            self.constellation_banks.pop(name, None)
+        cw_map = [0x04000400] * 2**bits_per_symbol
+        maps = [('configured', 0x00, self.constellation_map)]
+        if bits_per_symbol <= 7:
+            maps.append(('CW', 0x80, cw_map))
+        for name, base, constellation_map in maps:
+            for other in [bank for bank, (other_base, other_map) in self.constellation_banks.items()
+                          if other_base < base + len(constellation_map) and base < other_base + len(other_map)]:
+                del self.constellation_banks[other]
+
+        self.load_constellation_bank('configured', 0x00, self.constellation_map)
         self.smpi_gateway.register_write(self.base_address + 0x05, 0x00000000) # MAP_CBASE
+        self.active_bank = 'configured'
 
         # If we can, add an alternative constant symbol map for CW operation,
-        # above the current symbol map.  To switch to it set MAP_CBASE to 0x00000080.
+        # above the current symbol map.  To switch to it set MAP_CBASE to 0x00000080
+        # (see switch_to_cw).
         if bits_per_symbol <= 7:
-            self.smpi_gateway.register_write(self.base_address + 0x06, 0x00010080)     # MAP_PBASE
-            for n in range(0,2**bits_per_symbol):
-                self.smpi_gateway.register_write(self.base_address + 0x07, 0x04000400) # MAP_PBOX
-            self.smpi_gateway.register_write(self.base_address + 0x06, 0x00000000)     # MAP_PBASE
-            self.smpi_gateway.register_write(self.base_address + 0x05, 0x00000000)     # MAP_CBASE
+            self.load_constellation_bank('CW', 0x80, cw_map)
 
         # Interpolation filter and SPLL setup
         self.smpi_gateway.register_write(self.base_address + 0x10, 0x00000001) # SPLL_CTRL, hold SPLL in reset
 
-        sr = self.sample_rate/5
-        iif = 0
-        while self.symbol_rate < sr:
-            sr = sr/2
-            iif = iif + 1
-        nco = int(round((self.symbol_rate / self.sample_rate) * 2**iif * 2**28))
+        iif, nco = self.interpolation()
         self.smpi_gateway.register_write(self.base_address + 0x08, iif)   # IIF_CTRL
         self.smpi_gateway.register_write(self.base_address + 0x11, nco)   # SPLL_INCR
 
@@ -311,8 +517,7 @@ class HdrmmDriver (object):
             self.smpi_gateway.register_write(self.base_address + 0x10, 0x00000000)  # enable SPLL
 
         # DAC control setup
-        dac_ctrl = 0x00000302
-        if self.spectral_inversion: dac_ctrl = dac_ctrl | 0x00000020
+        dac_ctrl = self.dac_ctrl()
         self.smpi_gateway.register_write(self.base_address + 0x09, dac_ctrl)    # DAC_CTRL
         self.smpi_gateway.register_write(self.base_address + 0x0A, 0x00000000)  # DAC_IOFFSET
         self.smpi_gateway.register_write(self.base_address + 0x0B, 0x00000000)  # DAC_QOFFSET
@@ -321,14 +526,11 @@ class HdrmmDriver (object):
         
         # Transmit filter setup
         if self.legacy_mode:
-            rrc_coeffs = legacy_rrc_select.get(self.rrc_alpha)
-            if rrc_coeffs:
-                for offset in range(0,24):
-                    self.smpi_gateway.register_write(self.base_address + 0x20 + offset, rrc_coeffs[offset] % 65536)
-            else:
-                raise HdrmmDriverError('Illegal RRC coefficients specification: {}'.format(rrc_coeffs))
+            # 24 coefficient registers
+            self.smpi_gateway.register_multi_write(self.base_address + 0x20, rrc_coeffs, sequential=True)
         else:
-            raise HdrmmDriverError('Non-legacy transmit-filter programming not yet supported!')  # !!! TODO !!!
+            # Coefficient loading port
+            self.smpi_gateway.register_multi_write(self.base_address + 0x20, rrc_coeffs)
 
         if self.offset_mode:
             self.smpi_gateway.register_write(self.base_address + 0x38, 0x00000001)
@@ -340,3 +542,4 @@ class HdrmmDriver (object):
 
         # Release datapath from reset
         self.smpi_gateway.register_write(self.base_address + 0x00, 0x00000000)
+        self.smpi_gateway.register_barrier()
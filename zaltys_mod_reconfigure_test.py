@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test differential reconfiguration of the HDRM and DVB-S2 Modulator
+##  drivers against the simulated SMPI gateway, and full configuration
+##  through each kind of gateway (no hardware required).  Run it under
+##  both Python 2 and Python 3.
+##
+##  Invoke at a shell prompt with:-
+##    python2 zaltys_mod_reconfigure_test.py
+##    python3 zaltys_mod_reconfigure_test.py
+##
+
+
+import os
+import tempfile
+
+import zaltys_zwire
+import zaltys_smpi_gateway
+import zaltys_config_program
+import zaltys_hdrmm_driver
+import zaltys_dvbs2m_driver
+from zaltys_test_utils import check, finish, silenced
+
+
+drivers = [('hdrmm',  zaltys_hdrmm_driver.HdrmmDriver,   zaltys_hdrmm_driver.HdrmmDriverError,   0x1000),
+           ('dvbs2m', zaltys_dvbs2m_driver.Dvbs2mDriver, zaltys_dvbs2m_driver.Dvbs2mDriverError, 0x1300)]
+
+for name, driver_class, driver_error, sys_ctrl in drivers:
+    gateway = zaltys_smpi_gateway.SimulatedSmpiGateway()
+    driver  = driver_class(gateway, base_address=0x1000)
+    driver.sample_rate = 125e6
+    driver.symbol_rate = 10e6
+    driver.configure_mod()
+    full_writes = gateway.writes
+
+    # Live changes are written without a reset
+    gateway.reset_counters()
+    driver.symbol_rate = 5e6
+    driver.configure_mod()
+    check('{} differential update'.format(name), 0 < gateway.writes < full_writes)
+
+    # A full configuration that fails leaves the state unknown...
+    gateway.reset_counters()
+    driver.rrc_alpha = 0
+    try:
+        driver.configure_mod()
+        check('{} illegal roll-off rejected'.format(name), False)
+    except driver_error:
+        check('{} illegal roll-off rejected'.format(name), driver.applied_state is None)
+    check('{} nothing written when rejected'.format(name), gateway.writes == 0)
+
+    # ...so the next configuration is a full one, releasing the reset
+    gateway.reset_counters()
+    driver.rrc_alpha = 20
+    driver.configure_mod()
+    check('{} full configure after failure'.format(name), gateway.writes == full_writes)
+    check('{} datapath out of reset'.format(name), gateway.peek(sys_ctrl) == 0)
+
+# Full configurations (packed RRC coefficients included) through every gateway
+REGISTERS = range(0x1000, 0x1400)
+
+for name, driver_class, driver_error, sys_ctrl in drivers:
+    reference = zaltys_smpi_gateway.SimulatedSmpiGateway()
+    driver    = driver_class(reference, base_address=0x1000)
+    driver.configure_mod()
+    expected  = [reference.peek(address) for address in REGISTERS]
+
+    wrappers = [('batching',  zaltys_smpi_gateway.BatchingSmpiGateway),
+                ('caching',   zaltys_smpi_gateway.CachingSmpiGateway),
+                ('tracing',   zaltys_smpi_gateway.TracingSmpiGateway),
+                ('recording', zaltys_config_program.RecordingSmpiGateway)]
+    for wrapper_name, wrapper_class in wrappers:
+        target  = zaltys_smpi_gateway.SimulatedSmpiGateway()
+        gateway = wrapper_class(target)
+        driver  = driver_class(gateway, base_address=0x1000)
+        driver.configure_mod()
+        gateway.register_barrier()
+        check('{} through {} gateway'.format(name, wrapper_name), [target.peek(address) for address in REGISTERS] == expected)
+
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, bytearray(4 * 0x1400))
+        os.close(fd)
+        gateway = zaltys_smpi_gateway.MmapSmpiGateway(path)
+        driver  = driver_class(gateway, base_address=0x1000)
+        driver.configure_mod()
+        check('{} through mmap gateway'.format(name), gateway.register_multi_read(0x1000, len(REGISTERS), sequential=True) == expected)
+        gateway.close()
+    finally:
+        os.remove(path)
+
+    with silenced():
+        gateway = zaltys_smpi_gateway.ZwireSmpiGateway(zaltys_zwire.ZwireDummy())
+        driver  = driver_class(gateway, base_address=0x1000)
+        driver.configure_mod()
+    check('{} through zwire gateway'.format(name), driver.applied_state is not None)
+
+finish()
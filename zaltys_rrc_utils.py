@@ -0,0 +1,117 @@
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Root-raised-cosine (RRC) transmit filter coefficient utilities.
+##
+##  The HDRMM transmit filters are symmetric, sampled at 2 samples per
+##  symbol, with an implicit centre tap.  A coefficient set is the one-sided
+##  half of the filter, coefficient k being the tap (k+1)/2 symbols from the
+##  centre, scaled so that the centre tap would be centre_tap.  This is the
+##  form of the legacy and standard coefficient tables in the modulator
+##  drivers, which rrc_coeffs reproduces exactly.
+##
+##  Roll-off factors (rrc_alpha) are given in percent, as in the drivers.
+##
+
+import math
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#
+# Memoised coefficient sets
+#
+rrc_coeff_sets = {}          # (rrc_alpha, num_coeffs, centre_tap) -> tuple of coefficients
+txfilt_register_sets = {}    # (rrc_alpha, num_coeffs, centre_tap, coeff_width, reverse) -> array('I')
+
+
+def rrc_impulse(t, alpha):
+    '''
+    Return the RRC impulse response at time t (in symbols) for a roll-off
+    factor alpha (as a fraction, 0 to 1).
+    '''
+    if t == 0:
+        return 1 - alpha + 4*alpha/math.pi
+    if alpha > 0 and abs(abs(t) - 1/(4*alpha)) < 1e-9:
+        return (alpha/math.sqrt(2))*((1 + 2/math.pi)*math.sin(math.pi/(4*alpha)) + (1 - 2/math.pi)*math.cos(math.pi/(4*alpha)))
+    return (math.sin(math.pi*t*(1 - alpha)) + 4*alpha*t*math.cos(math.pi*t*(1 + alpha))) / (math.pi*t*(1 - (4*alpha*t)**2))
+
+def design_rrc_coeffs(rrc_alpha, num_coeffs, centre_tap=32768):
+    '''
+    Design a one-sided RRC coefficient set (see module notes) for a
+    roll-off of rrc_alpha percent.  Returns a list of num_coeffs integers.
+    Uses NumPy when installed.
+    '''
+    alpha = rrc_alpha / 100.0
+    scale = centre_tap / rrc_impulse(0, alpha)
+
+    if numpy is None:
+        return [int(round(scale * rrc_impulse((k + 1)/2.0, alpha))) for k in range(num_coeffs)]
+
+    t = (numpy.arange(num_coeffs) + 1) / 2.0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        h = (numpy.sin(numpy.pi*t*(1 - alpha)) + 4*alpha*t*numpy.cos(numpy.pi*t*(1 + alpha))) / (numpy.pi*t*(1 - (4*alpha*t)**2))
+    if alpha > 0:
+        singular = numpy.abs(t - 1/(4*alpha)) < 1e-9
+        h[singular] = rrc_impulse(1/(4*alpha), alpha)
+    return [int(c) for c in numpy.round(scale * h)]
+
+def add_rrc_coeffs(rrc_alpha, coeffs, centre_tap=32768):
+    '''
+    Add a precomputed one-sided coefficient set to the memo, so that
+    rrc_coeffs returns it rather than designing one.
+    '''
+    rrc_coeff_sets[(rrc_alpha, len(coeffs), centre_tap)] = tuple(coeffs)
+
+def rrc_coeffs(rrc_alpha, num_coeffs, centre_tap=32768):
+    '''
+    Return a (memoised) one-sided RRC coefficient set, as a tuple of
+    num_coeffs integers.
+    '''
+    if not 0 < rrc_alpha <= 100:
+        raise ValueError('Illegal RRC roll-off: {}, must be in the range 0% to 100%'.format(rrc_alpha))
+    key = (rrc_alpha, num_coeffs, centre_tap)
+    coeffs = rrc_coeff_sets.get(key)
+    if coeffs is None:
+        coeffs = tuple(design_rrc_coeffs(rrc_alpha, num_coeffs, centre_tap))
+        rrc_coeff_sets[key] = coeffs
+    return coeffs
+
+def txfilt_registers(rrc_alpha, num_coeffs, centre_tap=32768, coeff_width=16, reverse=False):
+    '''
+    Return the (memoised) transmit filter register values for an RRC
+    coefficient set, as a packed array('I'), ready for a single
+    register_multi_write.  Coefficients are rescaled from 16 bits to
+    coeff_width bits and stored as 16-bit two's complement.  If reverse
+    is true the outermost coefficient comes first.
+    '''
+    key = (rrc_alpha, num_coeffs, centre_tap, coeff_width, reverse)
+    registers = txfilt_register_sets.get(key)
+    if registers is None:
+        coeffs = rrc_coeffs(rrc_alpha, num_coeffs, centre_tap)
+        if reverse:
+            coeffs = coeffs[::-1]
+        shift = float(2**(16 - coeff_width))
+        registers = array.array('I', [int(round(c / shift)) % 65536 for c in coeffs])
+        txfilt_register_sets[key] = registers
+    return registers
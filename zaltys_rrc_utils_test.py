@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test the RRC coefficient designer against the modulator driver tables.
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_rrc_utils_test.py [rrc_alpha]
+##
+
+import sys
+
+import zaltys_rrc_utils
+import zaltys_dvbs2m_driver
+
+# Design afresh, rather than returning the tables added by the driver
+zaltys_rrc_utils.rrc_coeff_sets.clear()
+
+failed = False
+for alpha, coeffs in sorted(zaltys_dvbs2m_driver.legacy_rrc_select.items()):
+    ok = list(zaltys_rrc_utils.rrc_coeffs(alpha, 24, centre_tap=8192)) == coeffs
+    print('Legacy   {0:3}%: {1}'.format(alpha, 'OK' if ok else 'MISMATCH'))
+    failed = failed or not ok
+
+for alpha, coeffs in sorted(zaltys_dvbs2m_driver.standard_rrc_select.items()):
+    ok = list(zaltys_rrc_utils.rrc_coeffs(alpha, 90)) == coeffs[:90]
+    print('Standard {0:3}%: {1}'.format(alpha, 'OK' if ok else 'MISMATCH'))
+    failed = failed or not ok
+
+if len(sys.argv) == 2:
+    alpha = float(sys.argv[1])
+    print('{}% roll-off, 181 taps: {}'.format(alpha, list(zaltys_rrc_utils.rrc_coeffs(alpha, 90))))
+
+if failed:
+    sys.exit(1)
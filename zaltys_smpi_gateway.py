@@ -25,13 +25,280 @@
 ##  (register_address = byte_address // 4).
 ##
 
+import os
+import sys
+import mmap
+import stat
+import time
+import errno
+import select
+import array
+import struct
+import threading
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import zaltys_buffer_utils
+
+
+#
+# Packed register buffers
+#
+# Registers are 32 bits wide, so bulk data is best held in packed uint32
+# buffers (array('I')) rather than lists of python integers.  When NumPy
+# is installed these are exposed as uint32 ndarray views, without
+# copying, so that decoding can be vectorised.
+#
+# Caller-owned buffers (bytearray, array, memoryview, ...) passed to the
+# gateways hold one register value per item; byte buffers hold
+# native-endian 32-bit words.  They are viewed as memoryviews on Python
+# 3, and as zaltys_buffer_utils.WordBuffer views on Python 2, which lacks
+# memoryview.cast.
+#
+def register_buffer_words(buf):
+    '''
+    Return a memoryview (a WordBuffer on Python 2) of a caller-owned
+    buffer with one item per register value, byte buffers being viewed
+    as 32-bit words.
+    '''
+    if not hasattr(memoryview, 'cast'):
+        return zaltys_buffer_utils.WordBuffer(buf)
+    view = memoryview(buf)
+    if view.itemsize == 1:
+        view = view.cast('B').cast('I')
+    elif view.format not in ('H', 'I', 'L', 'Q'):
+        # e.g. ctypes arrays, whose formats carry a byte order prefix
+        view = view.cast('B').cast({2: 'H', 4: 'I', 8: 'Q'}[view.itemsize])
+    return view
+
+def register_values(data):
+    '''
+    Return register data as an indexable sequence of values: lists,
+    tuples and arrays as they are, other buffers via register_buffer_words.
+    '''
+    if isinstance(data, (list, tuple, array.array)):
+        return data
+    return register_buffer_words(data)
+
+def store_register_words(view, words):
+    '''
+    Copy register values (a list or packed buffer) into a view returned
+    by register_buffer_words.
+    '''
+    if isinstance(view, zaltys_buffer_utils.WordBuffer):
+        view[:] = list(words)
+        return
+    if not isinstance(words, (array.array, memoryview)) or words.itemsize != view.itemsize:
+        words = array.array(view.format[-1], words)
+    view.cast('B')[:] = memoryview(words).cast('B')
+
+def make_register_buffer(count):
+    '''
+    Return a zero-filled packed buffer of count 32-bit register values.
+    '''
+    return array.array('I', [0]) * count
+
+def register_buffer_view(buf):
+    '''
+    Return a NumPy uint32 view of a packed register buffer, or the buffer
+    itself if NumPy is not installed.
+    '''
+    if numpy is not None:
+        return numpy.frombuffer(buf, dtype=numpy.uint32)
+    return buf
+
+def register_buffer_from_bytes(data):
+    '''
+    Pack a sequence of byte values, most significant byte of each register
+    first, into a packed register buffer.  Length of data should be a
+    multiple of 4.
+    '''
+    words = zaltys_buffer_utils.words_frombytes('I', bytearray(data))
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words
+
+def register_buffer_bytes(buf):
+    '''
+    Unpack a packed register buffer into a bytearray, most significant
+    byte of each register first.
+    '''
+    if numpy is not None:
+        return bytearray(numpy.asarray(buf, dtype='>u4').tobytes())
+    words = array.array('I', buf)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return bytearray(zaltys_buffer_utils.words_tobytes(words))
+
+
+#
+# Timing, for wait and trace statistics
+#
+_clock = getattr(time, 'perf_counter', time.time)
+
+TRACE_HISTOGRAM_BINS = 32
+
+def _latency_bin(duration):
+    '''
+    Histogram bin for a duration in seconds: bin 0 is under 1us, bin n
+    covers 2**(n-1) to 2**n us.
+    '''
+    return min(int(duration * 1e6).bit_length(), TRACE_HISTOGRAM_BINS - 1)
+
+
+#
+# Register polling
+#
+WAIT_SPIN_POLLS = 16       # back-to-back polls before backing off
+WAIT_MIN_DELAY  = 0.00001  # first backoff delay, in seconds
+WAIT_MAX_DELAY  = 0.01     # longest backoff delay, in seconds
+
+def _acknowledge_interrupt(fd):
+    # UIO devices are read 4 bytes at a time, eventfds 8.  A non-blocking
+    # fd with nothing pending (e.g. taken by another waiter) is left as is.
+    for size in (4, 8):
+        try:
+            os.read(fd, size)
+            return
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            if e.errno != errno.EINVAL or size == 8:
+                raise
+
+class WaitStatistics(object):
+    '''
+    Statistics of SmpiGateway.wait_until calls: counts of waits, timeouts
+    and polls, total and longest wait time, and a histogram of wait times
+    (binned as for TracingSmpiGateway).
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.waits     = 0
+        self.timeouts  = 0
+        self.polls     = 0
+        self.total     = 0.0
+        self.longest   = 0.0
+        self.histogram = [0] * TRACE_HISTOGRAM_BINS
+
+    def record(self, polls, duration, ready):
+        self.waits = self.waits + 1
+        if not ready:
+            self.timeouts = self.timeouts + 1
+        self.polls   = self.polls + polls
+        self.total   = self.total + duration
+        self.longest = max(self.longest, duration)
+        self.histogram[_latency_bin(duration)] += 1
+
+    def mean(self):
+        return self.total / self.waits if self.waits else 0.0
+
+
 class SmpiGateway(object):
     '''
         Coordinate accesses to/from SMPI bus registers
     '''
+    wait_stats = None
+
     def __init__(self):
         pass
 
+    def wait_until(self, address, condition, timeout=None, interrupt=None,
+                   spin=WAIT_SPIN_POLLS, min_delay=WAIT_MIN_DELAY, max_delay=WAIT_MAX_DELAY):
+        '''
+        Poll a register until condition(value) is true.  Returns true, or
+        false if timeout seconds (None for no limit) pass first.
+
+        The register is first polled spin times back-to-back, then with
+        delays doubling from min_delay up to max_delay.  If interrupt is
+        given (a file descriptor, e.g. a UIO device or an eventfd) each
+        delay is spent waiting on it instead, and the register is polled
+        as soon as it signals.  Wait times are accumulated in wait_stats.
+        '''
+        start = _clock()
+        deadline = None if timeout is None else start + timeout
+        delay = min_delay
+        polls = 0
+        while True:
+            polls = polls + 1
+            if condition(self.register_read(address)):
+                ready = True
+                break
+            now = _clock()
+            if deadline is not None and now >= deadline:
+                ready = False
+                break
+            if polls < spin:
+                continue
+            pause = delay if deadline is None else min(delay, deadline - now)
+            if interrupt is None:
+                time.sleep(pause)
+            elif select.select([interrupt], [], [], pause)[0]:
+                _acknowledge_interrupt(interrupt)
+            delay = min(2*delay, max_delay)
+        if self.wait_stats is None:
+            self.wait_stats = WaitStatistics()
+        self.wait_stats.record(polls, _clock() - start, ready)
+        return ready
+
+    def wait_for(self, address, mask, value, timeout=None, interrupt=None, **schedule):
+        '''
+        Poll a register until (register & mask) == value, see wait_until.
+        Returns true, or false on timeout.
+        '''
+        return self.wait_until(address, lambda data: data & mask == value, timeout, interrupt, **schedule)
+
+    def register_barrier(self):
+        '''
+        Ensure all preceding register writes have been issued to the
+        hardware.  Gateways that write straight through need do nothing.
+        '''
+        pass
+
+    def register_scatter_write(self, addresses, data):
+        '''
+        Write data[n] to register addresses[n] for each n, in order.
+        Runs of consecutive or repeated addresses are issued as multi-writes
+        (see coalesce_register_writes); gateways able to send the whole
+        sequence as one transfer override this.
+        '''
+        for address, values, sequential in coalesce_register_writes(addresses, data):
+            if len(values) == 1:
+                self.register_write(address, values[0])
+            else:
+                self.register_multi_write(address, values, sequential)
+
+
+def coalesce_register_writes(addresses, data):
+    '''
+    Group a sequence of single register writes, given as parallel address
+    and data sequences, into bulk transfers without reordering them.
+    Yields (address, values, sequential) for each run of writes to
+    consecutive addresses (sequential is true) or to one address.
+    '''
+    count = len(addresses)
+    start = 0
+    while start < count:
+        address = addresses[start]
+        end = start + 1
+        if end < count and addresses[end] == address:
+            while end < count and addresses[end] == address:
+                end = end + 1
+            yield address, data[start:end], False
+        elif end < count and addresses[end] == address + 1:
+            while end < count and addresses[end] == addresses[end-1] + 1:
+                end = end + 1
+            yield address, data[start:end], True
+        else:
+            yield address, data[start:end], False
+        start = end
+
 
 class ZwireSmpiGateway(SmpiGateway):
     '''
@@ -52,15 +319,45 @@ class ZwireSmpiGateway(SmpiGateway):
 
     def register_multi_write(self, address, data, sequential=False):
         '''
-        Write a list of integer data values to 32-bit register(s).
+        Write a list (or packed buffer) of integer data values to 32-bit register(s).
         If sequential is true then increment the address for each write,
         otherwise keep the address constant (the default).
-        Length of data should be less than 2**16.
+        Transfers longer than the Zwire's maximum count are split into
+        maximum-size chunks, issued back-to-back.
         '''
         if sequential:
-            self.zwire.seqWrite(address, data)
+            write = self.zwire.seqWrite
         else:
-            self.zwire.rptWrite(address, data)
+            write = self.zwire.rptWrite
+
+        data  = register_values(data)
+        count = len(data)
+        chunk = self.zwire.max_transfer
+        if count <= chunk:
+            write(address, data)
+            return
+
+        for start in range(0, count, chunk):
+            write(address + start if sequential else address, data[start:start+chunk])
+
+    def register_scatter_write(self, addresses, data):
+        '''
+        Write data[n] to register addresses[n] for each n, in order.  If the
+        Zwire supports batches (e.g. ZwireTCP) the writes are sent as one
+        batch, otherwise runs are issued as multi-writes.
+        '''
+        if not hasattr(self.zwire, 'batch'):
+            return SmpiGateway.register_scatter_write(self, addresses, data)
+
+        batch = self.zwire.batch()
+        for address, values, sequential in coalesce_register_writes(addresses, data):
+            if len(values) == 1:
+                batch.write(address, values[0])
+            elif sequential:
+                batch.seqWrite(address, values)
+            else:
+                batch.rptWrite(address, values)
+        batch.execute()
 
     def register_read(self, address):
         '''
@@ -68,18 +365,816 @@ class ZwireSmpiGateway(SmpiGateway):
         '''
         return self.zwire.read(address)
 
-    def register_multi_read(self, address, count, sequential=False):
+    def register_multi_read(self, address, count, sequential=False, packed=False):
+        '''
+        Read multiple data values from 32-bit register(s).
+        If sequential is true then increment the address for each read,
+        otherwise keep the address constant (the default).
+        Returns a list of integers, or if packed is true a packed uint32
+        buffer (see register_buffer_view).
+        Transfers longer than the Zwire's maximum count are split into
+        maximum-size chunks, issued back-to-back.
+        '''
+        if packed:
+            buf = make_register_buffer(count)
+            self.register_multi_read_into(address, buf, sequential)
+            return register_buffer_view(buf)
+
+        if sequential:
+            read = self.zwire.seqRead
+        else:
+            read = self.zwire.rptRead
+
+        chunk = self.zwire.max_transfer
+        if count <= chunk:
+            return read(address, count)
+
+        # Pipeline the chunks if the Zwire supports it, otherwise issue them in turn
+        pipelined = hasattr(self.zwire, 'submitRead')
+        chunks = []
+        for start in range(0, count, chunk):
+            chunk_address = address + start if sequential else address
+            chunk_count   = min(chunk, count-start)
+            if pipelined:
+                chunks.append(self.zwire.submitRead(chunk_address, chunk_count, sequential))
+            else:
+                chunks.append(read(chunk_address, chunk_count))
+
+        data = []
+        for values in chunks:
+            data.extend(values.result() if pipelined else values)
+        return data
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        '''
+        Read multiple data values from 32-bit register(s) into the
+        caller-owned buffer buf, one value per item (byte buffers are
+        filled with native-endian 32-bit words).
+        If sequential is true then increment the address for each read,
+        otherwise keep the address constant (the default).
+        Returns the number of values read.
+        Transfers longer than the Zwire's maximum count are split into
+        maximum-size chunks, issued back-to-back.
+        '''
+        if sequential:
+            read = self.zwire.seqReadInto
+        else:
+            read = self.zwire.rptReadInto
+
+        view  = register_buffer_words(buf)
+        count = len(view)
+        chunk = self.zwire.max_transfer
+        if count <= chunk:
+            read(address, view)
+            return count
+
+        for start in range(0, count, chunk):
+            read(address + start if sequential else address, view[start:start+chunk])
+        return count
+
+
+def mmap_length(path, fd, offset):
+    '''
+    Return the number of bytes to map from byte offset in the open file
+    fd: the rest of a regular file, or the size of the UIO map selected
+    by offset for /dev/uioN.  Character devices report no size of their
+    own, so raise ValueError for any other device.
+    '''
+    if not stat.S_ISCHR(os.fstat(fd).st_mode):
+        return os.fstat(fd).st_size - offset
+    device = os.path.basename(os.path.realpath(path))
+    size   = '/sys/class/uio/{}/maps/map{}/size'.format(device, offset // mmap.PAGESIZE)
+    if not device.startswith('uio') or not os.path.exists(size):
+        raise ValueError('No map length known for {}, give length explicitly'.format(path))
+    with open(size) as f:
+        return int(f.read(), 0)
+
+
+class MmapSmpiGateway(SmpiGateway):
+    '''
+    Coordinate access to SMPI registers mapped into memory from a file,
+    such as a UIO device (/dev/uioN) or a PCIe BAR resource file
+    (/sys/bus/pci/devices/<dev>/resourceN).  Any mmap-able file will do,
+    so a plain file can stand in for the hardware in tests.
+
+    Register address 0 is at byte offset 'offset' in the file (for UIO,
+    map N is selected with offset N*mmap.PAGESIZE).  If length is not
+    given the rest of a regular file is mapped, or for a UIO device the
+    size of the selected map is read from sysfs; other character devices
+    need an explicit length.
+
+    Single accesses are direct 32-bit loads and stores.  Sequential
+    multi-reads/writes are bulk slice copies; repeated multi-reads/writes
+    access the one register once per value.
+    '''
+    def __init__(self, path, length=None, offset=0):
+        self.fd = os.open(path, os.O_RDWR | getattr(os, 'O_SYNC', 0))
+        if length is None:
+            try:
+                length = mmap_length(path, self.fd, offset)
+            except Exception:
+                os.close(self.fd)
+                raise
+        self.map  = mmap.mmap(self.fd, length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+        self.regs = register_buffer_words(self.map)
+
+    def close(self):
+        if isinstance(self.regs, memoryview):
+            self.regs.release()
+        self.map.close()
+        os.close(self.fd)
+
+    def register_write(self, address, data):
+        '''
+        Write a single integer data value to a 32-bit register.
+        '''
+        self.regs[address] = data
+
+    def register_multi_write(self, address, data, sequential=False):
+        '''
+        Write a list (or packed buffer) of integer data values to 32-bit register(s).
+        If sequential is true then increment the address for each write,
+        otherwise keep the address constant (the default).
+        '''
+        data = register_values(data)
+        if sequential:
+            if not isinstance(data, array.array) or data.typecode != 'I':
+                data = array.array('I', data)
+            self.regs[address:address+len(data)] = data
+        else:
+            regs = self.regs
+            for value in data:
+                regs[address] = value
+
+    def register_read(self, address):
+        '''
+        Read a single data value from a 32-bit register.  Return an integer.
+        '''
+        return self.regs[address]
+
+    def register_multi_read(self, address, count, sequential=False, packed=False):
         '''
         Read multiple data values from 32-bit register(s).
         If sequential is true then increment the address for each read,
         otherwise keep the address constant (the default).
-        Returns a list of integers.
-        Length of data should be less than 2**16.
+        Returns a list of integers, or if packed is true a packed uint32
+        buffer (see register_buffer_view).
+        '''
+        if packed:
+            buf = make_register_buffer(count)
+            self.register_multi_read_into(address, buf, sequential)
+            return register_buffer_view(buf)
+        if sequential:
+            return self.regs[address:address+count].tolist()
+        else:
+            regs = self.regs
+            return [regs[address] for n in range(count)]
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        '''
+        Read multiple data values from 32-bit register(s) into the
+        caller-owned buffer buf, one value per item (byte buffers are
+        filled with native-endian 32-bit words).
+        If sequential is true then increment the address for each read,
+        otherwise keep the address constant (the default).
+        Returns the number of values read.
         '''
+        view  = register_buffer_words(buf)
+        count = len(view)
         if sequential:
-            return self.zwire.seqRead(address, count)
+            store_register_words(view, self.regs[address:address+count])
         else:
-            return self.zwire.rptRead(address, count)
+            regs = self.regs
+            for n in range(count):
+                view[n] = regs[address]
+        return count
+
+
+class SimulatedSmpiGateway(SmpiGateway):
+    '''
+    A silent, functional model of an SMPI register file, for tests and
+    benchmarks.  Registers are held in sparse, array-backed pages and read
+    back the last value written (0 if never written).
+
+    Individual addresses can be given behaviours:-
+      set_read_only(address, value)      -- reads return value, writes are ignored
+      set_fifo(address, values=None)     -- writes push, reads pop (0 when empty)
+      set_self_clearing(address, mask)   -- masked bits read back as 0 after a write
+      set_behaviour(address, read, write) -- read() returns a value, write(data) stores one
+
+    Accesses are counted in reads, writes (calls) and words_read,
+    words_written (register values transferred).
+
+    Example usage:-
+      gateway = SimulatedSmpiGateway()
+      gateway.set_read_only(0x1003, 0)  # SMPI-to-SPI bridge never busy
+      ad9361 = AD9361Driver(gateway, smpi2spi_base_address=0x1000)
+    '''
+    PAGE_BITS = 10
+    PAGE_SIZE = 2**PAGE_BITS
+    PAGE_MASK = PAGE_SIZE - 1
+
+    def __init__(self):
+        self.pages      = {}
+        self.behaviours = {}    # address -> (read, write), either may be None
+        self.behaviour_pages = set()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.reads         = 0
+        self.writes        = 0
+        self.words_read    = 0
+        self.words_written = 0
+
+    def _page(self, address):
+        page = self.pages.get(address >> self.PAGE_BITS)
+        if page is None:
+            page = make_register_buffer(self.PAGE_SIZE)
+            self.pages[address >> self.PAGE_BITS] = page
+        return page
+
+    def peek(self, address):
+        '''
+        Return the stored value of a register, bypassing behaviours and counters.
+        '''
+        page = self.pages.get(address >> self.PAGE_BITS)
+        if page is None:
+            return 0
+        return page[address & self.PAGE_MASK]
+
+    def poke(self, address, data):
+        '''
+        Set the stored value of a register, bypassing behaviours and counters.
+        '''
+        self._page(address)[address & self.PAGE_MASK] = data % 2**32
+
+    def set_behaviour(self, address, read=None, write=None):
+        '''
+        Attach read and/or write functions to a register.  read() returns the
+        value to read, write(data) handles a written value.  Where either is
+        None the stored register value is used.
+        '''
+        self.behaviours[address] = (read, write)
+        self.behaviour_pages.add(address >> self.PAGE_BITS)
+
+    def set_read_only(self, address, value):
+        self.set_behaviour(address, read=lambda: value, write=lambda data: None)
+
+    def set_fifo(self, address, values=None):
+        '''
+        Make a register a FIFO port, initially holding values.  Return the
+        underlying deque.
+        '''
+        fifo = collections.deque(values or [])
+        self.set_behaviour(address, read=lambda: fifo.popleft() if fifo else 0, write=fifo.append)
+        return fifo
+
+    def set_self_clearing(self, address, mask):
+        self.set_behaviour(address, write=lambda data: self.poke(address, data & ~mask))
+
+    def _load(self, address):
+        behaviour = self.behaviours.get(address)
+        if behaviour and behaviour[0]:
+            return behaviour[0]()
+        return self.peek(address)
+
+    def _store(self, address, data):
+        behaviour = self.behaviours.get(address)
+        if behaviour and behaviour[1]:
+            behaviour[1](data)
+        else:
+            self.poke(address, data)
+
+    def _plain(self, address, count):
+        '''
+        Return true if address..address+count-1 lie in one page with no behaviours.
+        '''
+        return ((address >> self.PAGE_BITS) == ((address + count - 1) >> self.PAGE_BITS)
+                and (address >> self.PAGE_BITS) not in self.behaviour_pages)
+
+    def register_write(self, address, data):
+        self.writes = self.writes + 1
+        self.words_written = self.words_written + 1
+        self._store(address, data)
+
+    def register_multi_write(self, address, data, sequential=False):
+        data  = register_values(data)
+        count = len(data)
+        self.writes = self.writes + 1
+        self.words_written = self.words_written + count
+        if count == 0:
+            return
+        if sequential and self._plain(address, count):
+            offset = address & self.PAGE_MASK
+            if not isinstance(data, array.array) or data.typecode != 'I':
+                try:
+                    data = array.array('I', data)
+                except OverflowError:
+                    data = array.array('I', [d % 2**32 for d in data])
+            self._page(address)[offset:offset+count] = data
+        elif sequential:
+            for n in range(count):
+                self._store(address + n, data[n])
+        elif self._plain(address, 1):
+            self.poke(address, data[-1])
+        else:
+            for value in data:
+                self._store(address, value)
+
+    def register_read(self, address):
+        self.reads = self.reads + 1
+        self.words_read = self.words_read + 1
+        return self._load(address)
+
+    def _read_words(self, address, count, sequential):
+        self.reads = self.reads + 1
+        self.words_read = self.words_read + count
+        if count == 0:
+            return make_register_buffer(0)
+        if sequential and self._plain(address, count):
+            # Reads of unwritten pages don't allocate them
+            page = self.pages.get(address >> self.PAGE_BITS)
+            if page is None:
+                return make_register_buffer(count)
+            offset = address & self.PAGE_MASK
+            return page[offset:offset+count]
+        elif sequential:
+            return array.array('I', [self._load(address + n) for n in range(count)])
+        elif self._plain(address, 1):
+            return array.array('I', [self.peek(address)]) * count
+        else:
+            return array.array('I', [self._load(address) for n in range(count)])
+
+    def register_multi_read(self, address, count, sequential=False, packed=False):
+        words = self._read_words(address, count, sequential)
+        if packed:
+            return register_buffer_view(words)
+        return words.tolist()
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        view  = register_buffer_words(buf)
+        words = self._read_words(address, len(view), sequential)
+        store_register_words(view, words)
+        return len(view)
+
+
+class BatchingSmpiGateway(SmpiGateway):
+    '''
+    Write-combining wrapper around another SMPI gateway.  Single register
+    writes are buffered, then issued as bulk transfers: runs of writes to
+    consecutive addresses become one sequential multi-write and runs to
+    the same address one repeated multi-write.  Write order is preserved.
+
+    Buffered writes are flushed before any read, before any multi-write,
+    when max_pending writes are buffered, and explicitly by flush() or
+    register_barrier().
+
+    Example usage:-
+      gateway = BatchingSmpiGateway(ZwireSmpiGateway(zwire))
+      dvbs2m = Dvbs2mDriver(gateway, base_address=0x0000)
+      dvbs2m.configure_mod()  # ends with a barrier
+    '''
+    def __init__(self, gateway, max_pending=4096):
+        self.gateway     = gateway
+        self.max_pending = max_pending
+        self.addresses   = []
+        self.data        = []
+
+    def close(self):
+        self.flush()
+        if hasattr(self.gateway, 'close'):
+            self.gateway.close()
+
+    def flush(self):
+        '''
+        Issue all buffered register writes to the underlying gateway.
+        '''
+        if not self.addresses:
+            return
+        addresses, data = self.addresses, self.data
+        self.addresses = []
+        self.data      = []
+        self.gateway.register_scatter_write(addresses, data)
+
+    def register_barrier(self):
+        self.flush()
+        self.gateway.register_barrier()
+
+    barrier = register_barrier
+
+    def register_write(self, address, data):
+        self.addresses.append(address)
+        self.data.append(data)
+        if len(self.addresses) >= self.max_pending:
+            self.flush()
+
+    def register_multi_write(self, address, data, sequential=False):
+        self.flush()
+        self.gateway.register_multi_write(address, data, sequential)
+
+    def register_scatter_write(self, addresses, data):
+        self.addresses.extend(addresses)
+        self.data.extend(data)
+        if len(self.addresses) >= self.max_pending:
+            self.flush()
+
+    def register_read(self, address):
+        self.flush()
+        return self.gateway.register_read(address)
+
+    def register_multi_read(self, address, count, sequential=False, packed=False):
+        self.flush()
+        return self.gateway.register_multi_read(address, count, sequential, packed)
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        self.flush()
+        return self.gateway.register_multi_read_into(address, buf, sequential)
+
+
+class CachingSmpiGateway(SmpiGateway):
+    '''
+    Shadow-register wrapper around another SMPI gateway.  The last value
+    read from or written to each cacheable register is kept, so reads of
+    it are served locally and writes of an unchanged value are dropped.
+
+    Only registers listed in cacheable are shadowed, so by default
+    nothing is.  Registers whose value the hardware can change (status
+    registers, FIFO ports, coefficient loading ports, self-clearing
+    controls) must not be listed, or can be excluded from a wider
+    cacheable range by listing them in volatile.  Both are lists of
+    (address, count) ranges.
+
+    set_bits, clear_bits and update_field perform a locked
+    read-modify-write from the shadow copy, so need no bus read once a
+    register's value is known.
+
+    Example usage:-
+      gateway = CachingSmpiGateway(ZwireSmpiGateway(zwire),
+                                   cacheable=[(0x0100, 0x100)],
+                                   volatile=[(0x0120, 8)])
+      gateway.register_write(0x0100, 0x00000001)
+      gateway.clear_bits(0x0100, 0x00000001)  # no bus read
+    '''
+    def __init__(self, gateway, cacheable=None, volatile=None):
+        self.gateway   = gateway
+        self.cacheable = list(cacheable or [])
+        self.volatile  = list(volatile or [])
+        self.shadow    = {}
+        self.lock      = threading.RLock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits       = 0
+        self.misses     = 0
+        self.suppressed = 0
+
+    def close(self):
+        if hasattr(self.gateway, 'close'):
+            self.gateway.close()
+
+    def register_barrier(self):
+        self.gateway.register_barrier()
+
+    def set_volatile(self, address, count=1):
+        '''
+        Declare a range of registers volatile, dropping any shadow values.
+        '''
+        with self.lock:
+            self.volatile.append((address, count))
+            self.invalidate(address, count)
+
+    def invalidate(self, address=None, count=1):
+        '''
+        Forget the shadow values of a range of registers, or of all
+        registers if address is None, so that they are next read from the bus.
+        '''
+        with self.lock:
+            if address is None:
+                self.shadow.clear()
+            else:
+                for n in range(address, address + count):
+                    self.shadow.pop(n, None)
+
+    def is_cacheable(self, address):
+        for start, count in self.volatile:
+            if start <= address < start + count:
+                return False
+        for start, count in self.cacheable:
+            if start <= address < start + count:
+                return True
+        return False
+
+    def _shadowed(self, address, count, sequential):
+        '''
+        Return the shadow values for a multi-read, or None if any must come from the bus.
+        '''
+        if count == 0:
+            return []
+        if not sequential:
+            if address in self.shadow and self.is_cacheable(address):
+                return [self.shadow[address]] * count
+            return None
+        values = []
+        for n in range(address, address + count):
+            if n not in self.shadow or not self.is_cacheable(n):
+                return None
+            values.append(self.shadow[n])
+        return values
+
+    def _update(self, address, values, sequential):
+        if sequential:
+            for n in range(len(values)):
+                if self.is_cacheable(address + n):
+                    self.shadow[address + n] = int(values[n]) % 2**32
+        elif len(values) and self.is_cacheable(address):
+            self.shadow[address] = int(values[-1]) % 2**32
+
+    def register_write(self, address, data):
+        with self.lock:
+            data = data % 2**32
+            if self.is_cacheable(address):
+                if self.shadow.get(address) == data:
+                    self.suppressed = self.suppressed + 1
+                    return
+                self.shadow[address] = data
+            self.gateway.register_write(address, data)
+
+    def register_multi_write(self, address, data, sequential=False):
+        with self.lock:
+            self.gateway.register_multi_write(address, data, sequential)
+            self._update(address, register_values(data), sequential)
+
+    def register_scatter_write(self, addresses, data):
+        with self.lock:
+            send_addresses = []
+            send_data      = []
+            for n in range(len(addresses)):
+                address = addresses[n]
+                value   = data[n] % 2**32
+                if self.is_cacheable(address):
+                    if self.shadow.get(address) == value:
+                        self.suppressed = self.suppressed + 1
+                        continue
+                    self.shadow[address] = value
+                send_addresses.append(address)
+                send_data.append(value)
+            if send_addresses:
+                self.gateway.register_scatter_write(send_addresses, send_data)
+
+    def register_read(self, address):
+        with self.lock:
+            if self.is_cacheable(address):
+                if address in self.shadow:
+                    self.hits = self.hits + 1
+                    return self.shadow[address]
+                self.misses = self.misses + 1
+                data = self.gateway.register_read(address)
+                self.shadow[address] = data
+                return data
+            return self.gateway.register_read(address)
+
+    def register_multi_read(self, address, count, sequential=False, packed=False):
+        with self.lock:
+            values = self._shadowed(address, count, sequential)
+            if values is not None:
+                self.hits = self.hits + 1
+                if packed:
+                    return register_buffer_view(array.array('I', values))
+                return values
+            data = self.gateway.register_multi_read(address, count, sequential, packed)
+            self._update(address, data, sequential)
+            return data
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        with self.lock:
+            view   = register_buffer_words(buf)
+            values = self._shadowed(address, len(view), sequential)
+            if values is not None:
+                self.hits = self.hits + 1
+                store_register_words(view, values)
+                return len(view)
+            count = self.gateway.register_multi_read_into(address, buf, sequential)
+            self._update(address, view.tolist(), sequential)
+            return count
+
+    def wait_until(self, address, condition, timeout=None, interrupt=None, **schedule):
+        '''
+        Poll a register on the wrapped gateway, never the shadow copy, see
+        SmpiGateway.wait_until.  The register's shadow value is dropped.
+        '''
+        ready = self.gateway.wait_until(address, condition, timeout, interrupt, **schedule)
+        self.wait_stats = self.gateway.wait_stats
+        self.invalidate(address)
+        return ready
+
+    def set_bits(self, address, mask):
+        '''
+        Set the bits of mask in a register.  Returns the new register value.
+        '''
+        return self.update_field(address, mask, mask)
+
+    def clear_bits(self, address, mask):
+        '''
+        Clear the bits of mask in a register.  Returns the new register value.
+        '''
+        return self.update_field(address, mask, 0)
+
+    def update_field(self, address, mask, value):
+        '''
+        Replace the bits of mask in a register with the corresponding bits
+        of value (already shifted into position), leaving other bits
+        unchanged.  Returns the new register value.
+        '''
+        with self.lock:
+            data = (self.register_read(address) & ~mask) | (value & mask)
+            self.register_write(address, data)
+            return data % 2**32
+
+
+#
+# Bus transaction tracing
+#
+TRACE_OPS = ('write', 'rpt_write', 'seq_write', 'read', 'rpt_read', 'seq_read', 'barrier', 'scatter_write')
+(TRACE_WRITE, TRACE_RPT_WRITE, TRACE_SEQ_WRITE,
+ TRACE_READ, TRACE_RPT_READ, TRACE_SEQ_READ, TRACE_BARRIER, TRACE_SCATTER_WRITE) = range(len(TRACE_OPS))
+TRACE_MAGIC  = b'SMPITRC1'
+TRACE_HEADER = struct.Struct('<8sI')
+
+def _column(typecode, values):
+    column = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def read_trace(path):
+    '''
+    Read a trace file written by TracingSmpiGateway.save.  Returns a list
+    of (op, address, count, timestamp, duration) tuples, oldest first.
+    '''
+    with open(path, 'rb') as f:
+        magic, total = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC:
+            raise ValueError('Not an SMPI trace file: {}'.format(path))
+        columns = []
+        for typecode in ('B', 'I', 'I', 'd', 'd'):
+            column = array.array(typecode)
+            column.fromfile(f, total)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append(column)
+    ops, addresses, counts, timestamps, durations = columns
+    return [(TRACE_OPS[ops[n]], addresses[n], counts[n], timestamps[n], durations[n]) for n in range(total)]
+
+
+class TracingSmpiGateway(SmpiGateway):
+    '''
+    Profiling wrapper around another SMPI gateway.  Every access is
+    recorded as (op, address, count, timestamp, duration) in a fixed-size
+    ring buffer of packed columns, keeping the most recent capacity
+    records, and tallied per register and per block of block_size
+    registers.  Tallies hold call and word counts, total time and a
+    log2 latency histogram (see _latency_bin), and cover all accesses
+    made since reset, not just those still in the ring.
+
+    Example usage:-
+      gateway = TracingSmpiGateway(ZwireSmpiGateway(zwire),
+                                   block_names={0x100:'FE', 0x200:'PLF', 0x300:'HDRMM'})
+      dvbs2m = Dvbs2mDriver(gateway, base_address=0x0000)
+      dvbs2m.configure_mod()
+      gateway.report()
+      gateway.save('configure_mod.trace')
+    '''
+    def __init__(self, gateway, capacity=65536, block_size=0x100, block_names=None):
+        self.gateway     = gateway
+        self.capacity    = capacity
+        self.block_size  = block_size
+        self.block_names = dict(block_names or {})
+        self.ops        = array.array('B', [0]) * capacity
+        self.addresses  = array.array('I', [0]) * capacity
+        self.counts     = array.array('I', [0]) * capacity
+        self.timestamps = array.array('d', [0.0]) * capacity
+        self.durations  = array.array('d', [0.0]) * capacity
+        self.reset()
+
+    def reset(self):
+        '''
+        Discard all records and tallies.
+        '''
+        self.next  = 0
+        self.total = 0
+        self.address_tallies = {}
+        self.block_tallies   = {}
+
+    def close(self):
+        if hasattr(self.gateway, 'close'):
+            self.gateway.close()
+
+    def _tally(self, tallies, key, count, duration):
+        tally = tallies.get(key)
+        if tally is None:
+            tally = [0, 0, 0.0, array.array('I', [0]) * TRACE_HISTOGRAM_BINS]
+            tallies[key] = tally
+        tally[0] = tally[0] + 1
+        tally[1] = tally[1] + count
+        tally[2] = tally[2] + duration
+        tally[3][_latency_bin(duration)] += 1
+
+    def _record(self, op, address, count, start):
+        duration = _clock() - start
+        n = self.next
+        self.ops[n]        = op
+        self.addresses[n]  = address
+        self.counts[n]     = count
+        self.timestamps[n] = start
+        self.durations[n]  = duration
+        self.next  = (n + 1) % self.capacity
+        self.total = self.total + 1
+        if op != TRACE_BARRIER:
+            self._tally(self.address_tallies, address, count, duration)
+            self._tally(self.block_tallies, address - address % self.block_size, count, duration)
+
+    def register_barrier(self):
+        start = _clock()
+        self.gateway.register_barrier()
+        self._record(TRACE_BARRIER, 0, 0, start)
+
+    def register_write(self, address, data):
+        start = _clock()
+        self.gateway.register_write(address, data)
+        self._record(TRACE_WRITE, address, 1, start)
+
+    def register_multi_write(self, address, data, sequential=False):
+        start = _clock()
+        self.gateway.register_multi_write(address, data, sequential)
+        self._record(TRACE_SEQ_WRITE if sequential else TRACE_RPT_WRITE, address, len(register_values(data)), start)
+
+    def register_scatter_write(self, addresses, data):
+        start = _clock()
+        self.gateway.register_scatter_write(addresses, data)
+        self._record(TRACE_SCATTER_WRITE, addresses[0] if len(addresses) else 0, len(addresses), start)
+
+    def register_read(self, address):
+        start = _clock()
+        data = self.gateway.register_read(address)
+        self._record(TRACE_READ, address, 1, start)
+        return data
+
+    def register_multi_read(self, address, count, sequential=False, packed=False):
+        start = _clock()
+        data = self.gateway.register_multi_read(address, count, sequential, packed)
+        self._record(TRACE_SEQ_READ if sequential else TRACE_RPT_READ, address, count, start)
+        return data
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        start = _clock()
+        count = self.gateway.register_multi_read_into(address, buf, sequential)
+        self._record(TRACE_SEQ_READ if sequential else TRACE_RPT_READ, address, count, start)
+        return count
+
+    def _ordered(self, column):
+        if self.total <= self.capacity:
+            return column[:self.total]
+        return column[self.next:] + column[:self.next]
+
+    def records(self):
+        '''
+        Return the recorded accesses still in the ring buffer, oldest first,
+        as a list of (op, address, count, timestamp, duration) tuples.
+        '''
+        columns = [self._ordered(column) for column in (self.ops, self.addresses, self.counts, self.timestamps, self.durations)]
+        return [(TRACE_OPS[op], address, count, timestamp, duration) for op, address, count, timestamp, duration in zip(*columns)]
+
+    def save(self, path):
+        '''
+        Write the ring buffer contents to a binary trace file (see read_trace).
+        '''
+        total = min(self.total, self.capacity)
+        with open(path, 'wb') as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, total))
+            for typecode, column in (('B', self.ops), ('I', self.addresses), ('I', self.counts),
+                                     ('d', self.timestamps), ('d', self.durations)):
+                _column(typecode, self._ordered(column)).tofile(f)
+
+    def block_name(self, block):
+        return self.block_names.get(block, '0x{0:04x}'.format(block))
+
+    def report(self, out=sys.stdout, top=10):
+        '''
+        Print per-block and busiest per-register tallies, by total time.
+        Histograms are listed as counts in log2 microsecond bins, from <1us.
+        '''
+        def table(title, tallies, name, limit):
+            out.write('{0:<12} {1:>8} {2:>9} {3:>10} {4:>9}  histogram\n'.format(title, 'calls', 'words', 'total ms', 'mean us'))
+            rows = sorted(tallies.items(), key=lambda item: -item[1][2])[:limit]
+            for key, (calls, words, total, histogram) in rows:
+                last = max([n for n in range(TRACE_HISTOGRAM_BINS) if histogram[n]] or [0])
+                out.write('{0:<12} {1:>8} {2:>9} {3:>10.3f} {4:>9.1f}  {5}\n'.format(
+                    name(key), calls, words, total * 1e3, total * 1e6 / calls, ' '.join(str(h) for h in histogram[:last+1])))
+
+        out.write('{} accesses, {:.3f} ms\n'.format(sum(t[0] for t in self.block_tallies.values()),
+                                                     sum(t[2] for t in self.block_tallies.values()) * 1e3))
+        table('block', self.block_tallies, self.block_name, None)
+        table('register', self.address_tallies, lambda address: '0x{0:04x}'.format(address), top)
 
 
 class DummySmpiGateway(SmpiGateway):
@@ -102,9 +1197,18 @@ class DummySmpiGateway(SmpiGateway):
         print("DummySmpiGateway read  0x{0:08x}".format(address))
         return 0
 
-    def register_multi_read(self, address, count, sequential=False):
+    def register_multi_read(self, address, count, sequential=False, packed=False):
         if sequential:
             print("DummySmpiGateway multi read seq  0x{0:08x}".format(address) + " {}".format(count))
         else:
             print("DummySmpiGateway multi read rpt  0x{0:08x}".format(address) + " {}".format(count))
+        if packed:
+            return register_buffer_view(make_register_buffer(count))
         return [0]*count
+
+    def register_multi_read_into(self, address, buf, sequential=False):
+        view  = register_buffer_words(buf)
+        count = len(view)
+        self.register_multi_read(address, count, sequential)
+        store_register_words(view, [0] * count)
+        return count
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test SMPI gateway transfers of caller-owned buffers (no hardware
+##  required).  Buffers hold one register value per item, byte buffers
+##  holding 32-bit words.
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_smpi_gateway_buffer_test.py
+##
+
+import array
+
+import zaltys_zwire
+import zaltys_buffer_utils
+import zaltys_smpi_gateway
+from zaltys_test_utils import check, finish, silenced
+
+
+class ChunkRecordingZwire(zaltys_zwire.ZwireDummy):
+    '''
+        A dummy Zwire with a small maximum transfer, recording the size
+        (in register values) of each transfer.
+    '''
+    max_transfer = 4
+
+    def __init__(self):
+        zaltys_zwire.ZwireDummy.__init__(self)
+        self.chunks = []
+
+    def seqReadInto(self, _addr, _buf):
+        count = zaltys_zwire.ZwireDummy.seqReadInto(self, _addr, _buf)
+        self.chunks.append(('read', _addr, count))
+        return count
+
+    def seqWrite(self, _addr, _data):
+        self.chunks.append(('write', _addr, len(_data)))
+        return zaltys_zwire.ZwireDummy.seqWrite(self, _addr, _data)
+
+
+# Reads past max_transfer are chunked by register values, not bytes
+with silenced():
+    zwire   = ChunkRecordingZwire()
+    gateway = zaltys_smpi_gateway.ZwireSmpiGateway(zwire)
+for name, buf in [('bytearray', bytearray(b'\xff' * 40)),
+                  ('array(I)', array.array('I', [0xFFFFFFFF] * 10))]:
+    del zwire.chunks[:]
+    with silenced():
+        count = gateway.register_multi_read_into(0x100, buf, sequential=True)
+    check('multi_read_into {} count'.format(name), count == 10)
+    check('multi_read_into {} chunks'.format(name), zwire.chunks == [('read', 0x100, 4), ('read', 0x104, 4), ('read', 0x108, 2)])
+    check('multi_read_into {} filled'.format(name), not any(zaltys_smpi_gateway.register_buffer_words(buf).tolist()))
+
+# Writes likewise
+del zwire.chunks[:]
+with silenced():
+    gateway.register_multi_write(0x200, bytearray(40), sequential=True)
+check('multi_write bytearray chunks', zwire.chunks == [('write', 0x200, 4), ('write', 0x204, 4), ('write', 0x208, 2)])
+
+# Byte buffers are 32-bit words on the simulated gateway too
+values  = [0x01020304, 0xFFFFFFFF, 0x80000000, 7]
+sim     = zaltys_smpi_gateway.SimulatedSmpiGateway()
+sim.register_multi_write(0x300, bytearray(zaltys_buffer_utils.words_tobytes(array.array('I', values))), sequential=True)
+check('simulated bytearray write', [sim.peek(0x300 + n) for n in range(4)] == values)
+buf = bytearray(16)
+check('simulated bytearray read count', sim.register_multi_read_into(0x300, buf, sequential=True) == 4)
+check('simulated bytearray read', zaltys_buffer_utils.words_frombytes('I', buf).tolist() == values)
+
+finish()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test the shadow-register SMPI gateway wrapper over the simulated
+##  gateway (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_smpi_gateway_caching_test.py
+##
+
+import threading
+
+import zaltys_smpi_gateway
+from zaltys_test_utils import check, finish
+
+
+# By default nothing is cached: hardware changes and FIFO ports are seen
+hardware = zaltys_smpi_gateway.SimulatedSmpiGateway()
+gateway  = zaltys_smpi_gateway.CachingSmpiGateway(hardware)
+gateway.register_write(0x10, 1)
+hardware.poke(0x10, 2)
+check('default: reads reach the bus', gateway.register_read(0x10) == 2)
+hardware.set_fifo(0x20, [5, 6])
+check('default: FIFO port read each time', gateway.register_read(0x20) == 5 and gateway.register_read(0x20) == 6)
+gateway.register_write(0x10, 2)
+gateway.register_write(0x10, 2)
+check('default: no writes suppressed', gateway.suppressed == 0)
+
+# Listed registers are shadowed, except those declared volatile
+gateway = zaltys_smpi_gateway.CachingSmpiGateway(hardware, cacheable=[(0x100, 16)], volatile=[(0x104, 1)])
+gateway.register_write(0x100, 7)
+hardware.poke(0x100, 8)
+check('cacheable read from shadow', gateway.register_read(0x100) == 7 and gateway.hits == 1)
+gateway.register_write(0x100, 7)
+check('cacheable unchanged write suppressed', gateway.suppressed == 1)
+gateway.register_write(0x104, 1)
+hardware.poke(0x104, 3)
+check('volatile read from bus', gateway.register_read(0x104) == 3)
+check('uncached read from bus', gateway.register_read(0x200) == 0 and gateway.misses == 0)
+
+# Volatile lists are per instance
+other = zaltys_smpi_gateway.CachingSmpiGateway(hardware, cacheable=[(0x100, 16)])
+other.set_volatile(0x101)
+fresh = zaltys_smpi_gateway.CachingSmpiGateway(hardware, cacheable=[(0x100, 16)])
+check('volatile list not shared', fresh.is_cacheable(0x101))
+
+# Waits poll the hardware, not the shadow
+gateway.register_write(0x108, 0)
+timer = threading.Timer(0.05, hardware.poke, (0x108, 1))
+timer.start()
+check('wait_until sees hardware change', gateway.wait_for(0x108, 1, 1, timeout=2.0))
+timer.join()
+check('shadow refreshed after wait', gateway.register_read(0x108) == 1)
+
+finish()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test the memory-mapped SMPI gateway against a temporary file standing
+##  in for a register window (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_smpi_gateway_mmap_test.py
+##
+
+import os
+import mmap
+import array
+import tempfile
+
+import zaltys_buffer_utils
+import zaltys_smpi_gateway
+from zaltys_test_utils import check, finish
+
+
+fd, path = tempfile.mkstemp()
+try:
+    os.write(fd, zaltys_buffer_utils.words_tobytes(array.array('I', range(2 * mmap.PAGESIZE // 4))))
+    os.close(fd)
+
+    # Without a length the rest of a regular file is mapped
+    gateway = zaltys_smpi_gateway.MmapSmpiGateway(path)
+    check('whole file mapped', len(gateway.regs) == 2 * mmap.PAGESIZE // 4)
+    check('register read', gateway.register_read(5) == 5)
+    gateway.register_multi_write(8, [0x11, 0x22, 0x33], sequential=True)
+    check('sequential multi-write', gateway.register_multi_read(8, 3, sequential=True) == [0x11, 0x22, 0x33])
+    for name, buf in [('bytearray', bytearray(12)), ('array(L)', array.array('L', [0] * 3))]:
+        gateway.register_multi_read_into(8, buf, sequential=True)
+        check('sequential read into {}'.format(name), zaltys_smpi_gateway.register_buffer_words(buf).tolist() == [0x11, 0x22, 0x33])
+    gateway.close()
+
+    gateway = zaltys_smpi_gateway.MmapSmpiGateway(path, offset=mmap.PAGESIZE)
+    check('rest of file mapped from offset', len(gateway.regs) == mmap.PAGESIZE // 4)
+    check('register 0 at offset', gateway.register_read(0) == mmap.PAGESIZE // 4)
+    gateway.close()
+
+    gateway = zaltys_smpi_gateway.MmapSmpiGateway(path, length=64)
+    check('explicit length', len(gateway.regs) == 16)
+    gateway.close()
+finally:
+    os.remove(path)
+
+# Character devices other than UIO report no size, so need a length
+try:
+    zaltys_smpi_gateway.MmapSmpiGateway('/dev/zero')
+    check('character device needs length', False)
+except ValueError:
+    check('character device needs length', True)
+
+finish()
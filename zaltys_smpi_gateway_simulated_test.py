@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test the simulated SMPI gateway, and a driver running against it (no
+##  hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_smpi_gateway_simulated_test.py
+##
+
+
+import zaltys_smpi_gateway
+import zaltys_dvbs2m_driver
+from zaltys_test_utils import check, finish
+
+
+gateway = zaltys_smpi_gateway.SimulatedSmpiGateway()
+
+# Reads of unwritten registers return 0 without allocating pages
+check('unwritten read', gateway.register_read(0x5000) == 0)
+check('unwritten multi-read', gateway.register_multi_read(0x6000, 8, sequential=True) == [0]*8)
+check('reads allocate no pages', gateway.pages == {})
+
+# FIFOs don't share their initial contents
+gateway.set_fifo(0x10)
+fifo_b = gateway.set_fifo(0x11)
+gateway.register_write(0x10, 42)
+check('FIFO push/pop', list(fifo_b) == [] and gateway.register_read(0x10) == 42)
+check('FIFO initial values', list(gateway.set_fifo(0x12, [1, 2])) == [1, 2])
+
+# A driver configured on the simulator leaves its registers in place
+dvbs2m = zaltys_dvbs2m_driver.Dvbs2mDriver(gateway, base_address=0x1000)
+dvbs2m.sample_rate = 125e6
+dvbs2m.symbol_rate = 10e6
+dvbs2m.configure_mod()
+iif, nco = dvbs2m.interpolation()
+check('driver IIF_CTRL/SPLL_INCR', gateway.register_read(0x1308) == iif and gateway.register_read(0x1311) == nco)
+check('driver datapath out of reset', gateway.register_read(0x1300) == 0 and gateway.register_read(0x1100) & 1 == 0)
+
+# A differential reconfiguration reaches the same state as a full one
+dvbs2m.symbol_rate = 3e6
+gateway.reset_counters()
+dvbs2m.configure_mod()
+update_writes = gateway.writes
+reference = zaltys_smpi_gateway.SimulatedSmpiGateway()
+full = zaltys_dvbs2m_driver.Dvbs2mDriver(reference, base_address=0x1000)
+full.sample_rate = 125e6
+full.symbol_rate = 3e6
+full.configure_mod()
+check('differential update writes less', update_writes < reference.writes)
+check('differential update state matches', all(gateway.peek(a) == reference.peek(a) for a in range(0x1000, 0x1400)))
+
+finish()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test SMPI gateway register waits against the simulated gateway,
+##  including interrupt wake-ups via an eventfd where the platform has
+##  them (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_smpi_gateway_wait_test.py
+##
+
+import os
+import time
+import threading
+
+import zaltys_smpi_gateway
+from zaltys_test_utils import check, finish
+
+
+gateway = zaltys_smpi_gateway.SimulatedSmpiGateway()
+
+# Polling with backoff
+timer = threading.Timer(0.02, gateway.poke, (0x10, 1))
+timer.start()
+check('wait_for ready', gateway.wait_for(0x10, 1, 1, timeout=2.0))
+timer.join()
+check('wait_for timeout', not gateway.wait_for(0x20, 1, 1, timeout=0.02))
+stats = gateway.wait_stats
+check('wait statistics', stats.waits == 2 and stats.timeouts == 1 and stats.polls >= 2 and sum(stats.histogram) == 2)
+
+if hasattr(os, 'eventfd'):
+    # The interrupt wakes the wait long before the next poll is due
+    efd = os.eventfd(0, os.EFD_NONBLOCK)
+    def interrupt():
+        gateway.poke(0x30, 1)
+        os.eventfd_write(efd, 1)
+    timer = threading.Timer(0.05, interrupt)
+    start = time.time()
+    timer.start()
+    ready = gateway.wait_for(0x30, 1, 1, timeout=10.0, interrupt=efd, spin=1, min_delay=5.0, max_delay=5.0)
+    timer.join()
+    check('interrupt wakes wait', ready and time.time() - start < 2.0)
+
+    # Acknowledging an eventfd clears its count
+    os.eventfd_write(efd, 3)
+    zaltys_smpi_gateway._acknowledge_interrupt(efd)
+    try:
+        os.eventfd_read(efd)
+        check('interrupt acknowledged', False)
+    except BlockingIOError:
+        check('interrupt acknowledged', True)
+    zaltys_smpi_gateway._acknowledge_interrupt(efd)
+    check('acknowledge with no interrupt pending', True)
+    os.close(efd)
+else:
+    print('{0:50}: {1}'.format('interrupt tests', 'SKIPPED (no eventfd)'))
+
+finish()
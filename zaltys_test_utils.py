@@ -0,0 +1,62 @@
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Helpers shared by the offline (no hardware) test scripts.
+##
+
+import os
+import sys
+import contextlib
+
+g_failures = []
+
+def check(name, ok):
+    '''
+    Print a named check result, remembering failures for finish().
+    '''
+    print('{0:50}: {1}'.format(name, 'OK' if ok else 'FAILED'))
+    if not ok:
+        g_failures.append(name)
+    return ok
+
+def failures():
+    '''
+    Return the names of the checks failed so far.
+    '''
+    return list(g_failures)
+
+def finish():
+    '''
+    Exit with status 1 if any check failed.
+    '''
+    if g_failures:
+        sys.exit(1)
+
+@contextlib.contextmanager
+def silenced():
+    '''
+    Discard anything printed (e.g. by DummySmpiGateway or ZwireDummy)
+    within the with block.
+    '''
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
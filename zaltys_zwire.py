@@ -28,11 +28,37 @@
 #
 # The SPI routines interface to C SPI functions in libzaltys-zwire.so
 #
+# ZwireTCP runs the same interface to a remote ZwireServer, which exposes
+# a local Zwire interface or SmpiGateway over a TCP socket.
+#
+# All Zwire interface classes also provide rptReadInto and seqReadInto,
+# which fill a caller-owned buffer (e.g. a packed array('I')), and
+# ZwireSPI's rptWrite and seqWrite accept buffers as well as lists.  Use
+# these in streaming loops to avoid per-call allocation and conversion.
+#
 
 import sys
+import array
 import ctypes
+import socket
+import struct
+import threading
+import collections
 import serial
 
+import zaltys_buffer_utils
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+#
+# Zwire exceptions
+#
+class ZwireError(Exception): pass
+
 
 #
 # Zwire base class
@@ -41,10 +67,43 @@ class Zwire(object):
     '''
         Base class for Zwire SPI/other serial interfaces
     '''
+    # Largest count a single multi-read/write command can carry
+    max_transfer = 2**16 - 1
+
     def __init__(self):
         pass
 
 
+#
+# Word buffers
+#
+# As on every Zwire transport, a caller-owned buffer holds one register
+# value per item, and byte buffers (e.g. bytearray) hold native-endian
+# 32-bit words (see buffer_words).  The libzaltys-zwire data arguments
+# are C unsigned long arrays, so only c_ulong arrays and unsigned integer
+# buffers of the same item size (array('L')) are handed straight to the
+# library; others (e.g. array('I') or a bytearray on a 64-bit host) are
+# converted via a reusable staging array.  On Python 2, which lacks
+# memoryview.cast, buffers are viewed through
+# zaltys_buffer_utils.WordBuffer.
+#
+ZWSPI_WORD_SIZE = ctypes.sizeof(ctypes.c_ulong)
+
+def _word_array(buf):
+    '''
+        Return a (c_ulong array, count) pair viewing buf in place, or
+        (None, count) if buf must be staged.
+    '''
+    if isinstance(buf, ctypes.Array) and buf._type_ is ctypes.c_ulong:
+        return buf, len(buf)
+    view = buffer_words(buf)
+    if view.itemsize == ZWSPI_WORD_SIZE and view.format[-1] in 'ILQ' and not view.readonly:
+        if isinstance(view, zaltys_buffer_utils.WordBuffer):
+            return (ctypes.c_ulong * len(view)).from_buffer(view.obj, view.start * view.itemsize), len(view)
+        return (ctypes.c_ulong * len(view)).from_buffer(view), len(view)
+    return None, len(view)
+
+
 #
 # Zwire over SPI
 #        
@@ -58,6 +117,7 @@ class ZwireSPI(Zwire):
         '''
         self.bus  = 'SPI'
         self.dspi = dspi
+        self.fd   = -1
 
         if libzaltys_zwire_path:
             self.libzaltys_zwire_path = libzaltys_zwire_path
@@ -65,6 +125,31 @@ class ZwireSPI(Zwire):
             self.libzaltys_zwire_path = "/usr/lib/libzaltys-zwire.so"
 
         self.lib = ctypes.CDLL(self.libzaltys_zwire_path)
+
+        # Declare library prototypes once, rather than have ctypes
+        # convert untyped arguments on every call
+        data_ptr = ctypes.POINTER(ctypes.c_ulong)
+
+        self.lib.zwspiOpen.argtypes = [ctypes.c_ubyte]
+        self.lib.zwspiOpen.restype  = ctypes.c_int
+
+        self.lib.zwspiRead.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ushort, data_ptr]
+        self.lib.zwspiRead.restype  = ctypes.c_int
+
+        self.lib.zwspiSeqRead.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ushort, data_ptr]
+        self.lib.zwspiSeqRead.restype  = ctypes.c_int
+
+        self.lib.zwspiWrite.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ushort, data_ptr]
+        self.lib.zwspiWrite.restype  = ctypes.c_int
+
+        self.lib.zwspiSeqWrite.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ushort, data_ptr]
+        self.lib.zwspiSeqWrite.restype  = ctypes.c_int
+
+        self.lib.zwspiClose.argtypes = [ctypes.c_int]
+
+        # Preallocated storage for single-word and staged transfers
+        self.word    = (ctypes.c_ulong * 1)()
+        self.staging = (ctypes.c_ulong * 0)()
        
     def open(self):
         '''
@@ -72,26 +157,23 @@ class ZwireSPI(Zwire):
             Class variable fd set to the returned file descriptor (fd).
             Assumes dspi class variable already set
         '''
-        self.fd = self.lib.zwspiOpen(ctypes.c_ubyte(self.dspi))
+        self.fd = self.lib.zwspiOpen(self.dspi)
                 
     def read(self, _addr):
         '''
             Read a single value at _addr using SPI bus.  Return value read.
         '''
-        longArray = ctypes.c_ulong * 1
-        data = longArray(0)
-        if self.fd != -1:
-            val = self.lib.zwspiRead(ctypes.c_int(self.fd), ctypes.c_ulong(_addr), ctypes.c_ushort(1), data)
-        return data[0]
+        if self.fd == -1:
+            return 0
+        self.lib.zwspiRead(self.fd, _addr, 1, self.word)
+        return self.word[0]
         
     def rptRead(self, _addr, _count):
         '''
             Read multiple values from _addr using SPI bus.  Return list of values read.
         '''
-        longArray = ctypes.c_ulong * _count
-        data = longArray(0)
-        if self.fd != -1:
-            val = self.lib.zwspiRead(ctypes.c_int(self.fd), ctypes.c_ulong(_addr), ctypes.c_ushort(_count), data)
+        data = (ctypes.c_ulong * _count)()
+        self.rptReadInto(_addr, data)
         return data
 
     def seqRead(self, _addr, _count):
@@ -99,53 +181,155 @@ class ZwireSPI(Zwire):
             Read values from sequential addresses, starting at_addr, using SPI bus.
             Return list of values read.
         '''
-        longArray = ctypes.c_ulong * _count
-        data = longArray(0)
-        if self.fd != -1:
-            val = self.lib.zwspiSeqRead(ctypes.c_int(self.fd), ctypes.c_ulong(_addr), ctypes.c_ushort(_count), data)
+        data = (ctypes.c_ulong * _count)()
+        self.seqReadInto(_addr, data)
         return data
+
+    def rptReadInto(self, _addr, _buf):
+        '''
+            Read multiple values from _addr using SPI bus, filling the
+            caller-owned buffer _buf (bytearray, memoryview, array, ...)
+            with one value per item (32-bit words for byte buffers).
+            Return the number of values read.
+        '''
+        return self._readinto(self.lib.zwspiRead, _addr, _buf)
+
+    def seqReadInto(self, _addr, _buf):
+        '''
+            Read values from sequential addresses, starting at _addr, using
+            SPI bus, filling the caller-owned buffer _buf.
+            Return the number of values read.
+        '''
+        return self._readinto(self.lib.zwspiSeqRead, _addr, _buf)
+
+    def _readinto(self, fn, _addr, _buf):
+        data, count = _word_array(_buf)
+        if data is None:
+            data = self._stage(count)
+        if self.fd != -1 and count > 0:
+            fn(self.fd, _addr, count, data)
+        if data is self.staging:
+            store_words(buffer_words(_buf), data[:count])
+        return count
+
+    def _stage(self, count):
+        '''
+            Return the staging array, grown to hold at least count words.
+        '''
+        if len(self.staging) < count:
+            self.staging = (ctypes.c_ulong * count)()
+        return self.staging
     
     def write(self, _addr, _data):
         '''
             Write a single value, _data, to _addr using SPI bus.
         '''
-        longArray = ctypes.c_ulong * 1
-        data = longArray(_data)
+        val = -1
+        self.word[0] = _data
         if self.fd != -1:
-            val = self.lib.zwspiWrite(ctypes.c_int(self.fd), ctypes.c_ulong(_addr), ctypes.c_ushort(1), data)
+            val = self.lib.zwspiWrite(self.fd, _addr, 1, self.word)
         return val
         
     def rptWrite(self, _addr, _data):
         '''
             Write a list of values, _data, to the same address, _addr, using SPI bus.
+            _data may also be a buffer (bytearray, memoryview, array, ...)
+            holding one value per item (32-bit words for byte buffers),
+            which is passed to the library without copying if its items
+            are C unsigned longs.
         '''
-        ret = []
-        longArray = ctypes.c_ulong * len(_data)
-        data = longArray(0)
-        for n in range(0, len(_data)):
-            data[n] = ctypes.c_uint(_data[n])
-        if self.fd != -1:
-            val = self.lib.zwspiWrite(ctypes.c_int(self.fd), ctypes.c_ulong(_addr), ctypes.c_ushort(len(_data)), data)
-        return val
+        return self._writefrom(self.lib.zwspiWrite, _addr, _data)
 
     def seqWrite(self, _addr, _data):
         '''
             Write a list of values, _data, to sequential addresses starting at _addr, using SPI bus.
+            _data may also be a buffer (bytearray, memoryview, array, ...)
+            holding one value per item (32-bit words for byte buffers),
+            which is passed to the library without copying if its items
+            are C unsigned longs.
         '''
-        ret = []
-        longArray = ctypes.c_ulong * len(_data)
-        data = longArray(0)
-        for n in range(0, len(_data)):
-            data[n] = ctypes.c_uint(_data[n])
+        return self._writefrom(self.lib.zwspiSeqWrite, _addr, _data)
+
+    def _writefrom(self, fn, _addr, _data):
+        if isinstance(_data, list) or isinstance(_data, tuple):
+            data, count = None, len(_data)
+            words = _data
+        else:
+            data, count = _word_array(_data)
+            words = None if data is not None else buffer_words(_data)
+        if data is None:
+            # One C-level copy into the reusable staging array
+            data = self._stage(count)
+            data[:count] = words
+        val = -1
         if self.fd != -1:
-            val = self.lib.zwspiSeqWrite(ctypes.c_int(self.fd), ctypes.c_ulong(_addr), ctypes.c_ushort(len(_data)), data)
+            val = fn(self.fd, _addr, count, data)
         return val
         
     def close(self):
         '''
             Closes the sysfs device file for the SPI device
         '''
-        self.lib.zwspiClose(ctypes.c_int(self.fd))
+        self.lib.zwspiClose(self.fd)
+        self.fd = -1
+
+
+#
+# Wire word encoding
+#
+# The UART and TCP links carry data words most significant byte first,
+# so on little-endian hosts packed word arrays are byte-swapped on the
+# way in and out.
+#
+WORD_BYTESWAP = (sys.byteorder == 'little')
+
+def pack_words(data):
+    '''
+        Encode a sequence of integer register values as big-endian bytes.
+    '''
+    try:
+        words = array.array('I', data)
+    except OverflowError:
+        words = array.array('I', [d % 2**32 for d in data])
+    if WORD_BYTESWAP:
+        words.byteswap()
+    return zaltys_buffer_utils.words_tobytes(words)
+
+def unpack_words(data):
+    '''
+        Decode big-endian bytes into a list of integer register values.
+    '''
+    words = zaltys_buffer_utils.words_frombytes('I', data)
+    if WORD_BYTESWAP:
+        words.byteswap()
+    return words.tolist()
+
+def buffer_words(buf):
+    '''
+        Return a memoryview of buf with one item per register value
+        (byte buffers are taken to hold native-endian 32-bit words), or
+        a WordBuffer on Python 2.
+    '''
+    if not hasattr(memoryview, 'cast'):
+        return zaltys_buffer_utils.WordBuffer(buf)
+    view = memoryview(buf)
+    if view.itemsize == 1:
+        view = view.cast('B').cast('I')
+    elif view.format not in ('I', 'L', 'Q'):
+        # e.g. ctypes arrays, whose formats carry a byte order prefix
+        view = view.cast('B').cast({2: 'H', 4: 'I', 8: 'Q'}[view.itemsize])
+    return view
+
+def store_words(view, words):
+    '''
+        Copy register values into a view returned by buffer_words.
+    '''
+    if isinstance(view, zaltys_buffer_utils.WordBuffer):
+        view[:] = list(words)
+        return
+    if not isinstance(words, array.array) or words.itemsize != view.itemsize:
+        words = array.array(view.format[-1], words)
+    view.cast('B')[:] = words.tobytes()
 
 
 #
@@ -155,11 +339,59 @@ class ZwireSPI(Zwire):
 # and data values are encoded and transported over the serial link are
 # somewhat unusual.
 #
+
+#
+# Result of a pipelined ZwireUART command
+#
+class ZwireRequest(object):
+    '''
+        The outstanding result of a pipelined Zwire command.  Behaves like
+        a future: result() services the UART until the response has
+        arrived, and add_done_callback() registers a function to be called
+        with this request when it completes.
+    '''
+    def __init__(self, zwire, length, decode=None):
+        self.zwire     = zwire
+        self.length    = length    # number of response bytes expected
+        self.decode    = decode
+        self.value     = None
+        self.finished  = False
+        self.callbacks = []
+
+    def done(self):
+        return self.finished
+
+    def result(self):
+        while not self.finished:
+            self.zwire.poll(block=True)
+        return self.value
+
+    def add_done_callback(self, fn):
+        if self.finished:
+            fn(self)
+        else:
+            self.callbacks.append(fn)
+
+    def complete(self, response):
+        if self.decode:
+            self.value = self.decode(response)
+        self.finished = True
+        for fn in self.callbacks:
+            fn(self)
+
+
 class ZwireUART(Zwire):
     '''
         Zwire protocol over a UART serial line
+
+        Besides the blocking methods, commands may be pipelined: submitRead
+        and submitWrite send a command without waiting for earlier responses
+        and return a ZwireRequest.  Responses are matched to requests in
+        order as their bytes arrive, via poll(), sync() or
+        ZwireRequest.result().  At most pipeline_depth reads are left
+        outstanding at once.
     '''
-    def __init__(self, port, baud=115200):
+    def __init__(self, port, baud=115200, pipeline_depth=16):
         self.CMD_GETVER   = "$00"    # Read software ID & revision
         self.CMD_SETEEP   = "$01"    # Write EEPROM data
         self.CMD_GETEEP   = "$02"    # Read EEPROM data
@@ -173,6 +405,20 @@ class ZwireUART(Zwire):
         self.port = port
         self.baud = baud
 
+        # Pipelined requests awaiting responses, oldest first
+        self.pipeline_depth = pipeline_depth
+        self.pending        = collections.deque()
+        self.num_reads      = 0
+        self.rxbuf          = bytearray()
+
+        # Cache each command's encoded header and its checksum contribution
+        self.cmd_headers = {}
+        for cmd in [self.CMD_GETVER, self.CMD_SETEEP, self.CMD_GETEEP,
+                    self.CMD_SETBAUD, self.CMD_CFGFPGA, self.CMD_GETRFPGA,
+                    self.CMD_GETSFPGA, self.CMD_SETRFPGA, self.CMD_SETSFPGA]:
+            header = cmd.encode('ascii')
+            self.cmd_headers[cmd] = (header, sum(bytearray(header)))
+
     def open(self):
         '''
             Open serial connection.  Return an 18-character version string
@@ -180,61 +426,67 @@ class ZwireUART(Zwire):
         '''
         self.uart = serial.Serial(self.port, self.baud)
         self.uart.flushInput()
-        cmd = self.appendCmdChkSum(self.CMD_GETVER)
-        if sys.version_info.major == 2:
-            self.uart.write(bytes(cmd))
-        else:
-            self.uart.write(bytes(cmd, encoding='ascii'))
+        self.uart.write(self.appendCmdChkSum(self.CMD_GETVER).encode('ascii'))
 
         # read the 18-byte response
-        response = ""
-        for n in range(18):
-            byte = self.uart.read()
-            response = response + byte.decode('ascii')
-        return response
+        return self.readResponse(18).decode('ascii')
 
     def appendCmdChkSum(self, cmd):
-        check_sum = 0
-        for character in cmd:
-            check_sum = check_sum + ord(character)              
-        check_sum = check_sum % 256
-        full_cmd = cmd + ":" + hex(check_sum)[2:].zfill(2)
-        return full_cmd
-        
-    def multiRead(self, address, count, seq=False):
-        '''Send a multi-read command, returning a list of integer register values.
-           If seq is true then read from sequentially increasing addresses,
-           otherwise do multiple reads from the same address (the default).
-           Count should be less than 2**16.
+        check_sum = sum(bytearray(cmd.encode('ascii'))) % 256
+        return cmd + ":" + "{0:02x}".format(check_sum)
+
+    def encodeCmd(self, cmd, address, count):
         '''
+            Return the encoded bytes of a multi-read/write command,
+            including its checksum.
+        '''
+        header, header_sum = self.cmd_headers[cmd]
+        args = "{0:08x}{1:04x}".format(address, count).encode('ascii')
+        check_sum = (header_sum + sum(bytearray(args))) % 256
+        return header + args + ":{0:02x}".format(check_sum).encode('ascii')
+
+    def readResponse(self, length):
+        '''
+            Read a whole response of length bytes in a single call.
+        '''
+        response = self.uart.read(length)
+        if len(response) != length:
+            raise ZwireError('Short UART response: {} of {} bytes'.format(len(response), length))
+        return response
+
+    def readWords(self, address, count, seq=False):
+        '''
+            Send a multi-read command, returning the register values as a
+            packed array('I').
+        '''
+        if self.pending:
+            self.sync()
         self.uart.flushInput()
 
         if seq:
-            cmd = self.appendCmdChkSum(self.CMD_GETSFPGA + hex(address)[2:].zfill(8) + hex(count)[2:].zfill(4))
+            self.uart.write(self.encodeCmd(self.CMD_GETSFPGA, address, count))
         else:
-            cmd = self.appendCmdChkSum(self.CMD_GETRFPGA + hex(address)[2:].zfill(8) + hex(count)[2:].zfill(4))
-
-        if sys.version_info.major == 2:
-            self.uart.write(bytes(cmd))
-        else:
-            self.uart.write(bytes(cmd, encoding='ascii'))
+            self.uart.write(self.encodeCmd(self.CMD_GETRFPGA, address, count))
 
         # read the 4*count-byte response
-        response = [0]*(4*count)
-        for n in range(4*count):
-            response[n] = ord(self.uart.read())
+        words = array.array('I', self.readResponse(4*count))
+        if WORD_BYTESWAP:
+            words.byteswap()
+        return words
         
-        # return a list of register values
-        rtnval = [0]*count
-        for n in range(count):
-            rtnval[n] = response[4*n+0]*2**24 + response[4*n+1]*2**16 + response[4*n+2]*2**8 + response[4*n+3]
-        return rtnval
+    def multiRead(self, address, count, seq=False):
+        '''Send a multi-read command, returning a list of integer register values.
+           If seq is true then read from sequentially increasing addresses,
+           otherwise do multiple reads from the same address (the default).
+           Count should be less than 2**16.
+        '''
+        return self.readWords(address, count, seq).tolist()
 
     def read(self, address):
         '''
             Read integer value from 32-bit register.
         '''
-        return self.multiRead(address, 1)[0]
+        return self.readWords(address, 1)[0]
 
     def rptRead(self, address, count):
         '''
@@ -251,33 +503,49 @@ class ZwireUART(Zwire):
         '''
         return self.multiRead(address, count, seq=True)
 
+    def multiReadInto(self, address, buf, seq=False):
+        '''
+            Send a multi-read command, filling the caller-owned buffer buf
+            (one register value per item; byte buffers are filled with
+            native-endian 32-bit words).  Return the number of values read.
+        '''
+        view = buffer_words(buf)
+        store_words(view, self.readWords(address, len(view), seq))
+        return len(view)
+
+    def rptReadInto(self, address, buf):
+        '''
+            Repeatedly read values from a 32-bit register into buf.
+            Return the number of values read.
+        '''
+        return self.multiReadInto(address, buf, seq=False)
+
+    def seqReadInto(self, address, buf):
+        '''
+            Read values from sequential 32-bit registers, starting at address,
+            into buf.  Return the number of values read.
+        '''
+        return self.multiReadInto(address, buf, seq=True)
+
     def multiWrite(self, address, data, seq=False):
         '''Send a multi-write command with the given list of integer data values.
            If seq is true then write to sequentially increasing addresses,
            otherwise do multiple writes to the same address (the default).
            Length of data should be less than 2**16.
         '''
-        self.uart.flushInput()
         count = len(data)
+        payload = pack_words(data)
 
-        if seq:
-            cmd = self.appendCmdChkSum(self.CMD_SETSFPGA + hex(address)[2:].zfill(8) + hex(count)[2:].zfill(4))
-        else:
-            cmd = self.appendCmdChkSum(self.CMD_SETRFPGA + hex(address)[2:].zfill(8) + hex(count)[2:].zfill(4))
-
-        for n in range(count):
-            byts = [0]*(4*count)
-            byts[4*n+0] = (data[n] // 2**24) % 256
-            byts[4*n+1] = (data[n] // 2**16) % 256
-            byts[4*n+2] = (data[n] // 2**8) % 256
-            byts[4*n+3] = data[n] % 256
+        if self.pending:
+            self.sync()
+        self.uart.flushInput()
 
-        if sys.version_info.major == 2:
-            self.uart.write(bytes(cmd))
+        if seq:
+            cmd = self.encodeCmd(self.CMD_SETSFPGA, address, count)
         else:
-            self.uart.write(bytes(cmd, encoding='ascii'))
+            cmd = self.encodeCmd(self.CMD_SETRFPGA, address, count)
 
-        self.uart.write(bytearray(byts))
+        self.uart.write(cmd + payload)
 
     def write(self, address, data):
         '''
@@ -299,13 +567,495 @@ class ZwireUART(Zwire):
         '''
         return self.multiWrite(address, data, seq=True)
 
+    def submitRead(self, address, count, seq=False, callback=None):
+        '''
+            Send a multi-read command without waiting for its response.
+            Return a ZwireRequest whose result is a list of integer register
+            values.  If given, callback is called with the request once it
+            completes.
+        '''
+        if self.num_reads >= self.pipeline_depth:
+            self.pending[0].result()
+
+        if seq:
+            self.uart.write(self.encodeCmd(self.CMD_GETSFPGA, address, count))
+        else:
+            self.uart.write(self.encodeCmd(self.CMD_GETRFPGA, address, count))
+
+        request = ZwireRequest(self, 4*count, unpack_words)
+        if callback:
+            request.add_done_callback(callback)
+        self.pending.append(request)
+        self.num_reads = self.num_reads + 1
+        return request
+
+    def submitWrite(self, address, data, seq=False, callback=None):
+        '''
+            Send a multi-write command without waiting for outstanding
+            reads.  Return a ZwireRequest that completes, in order, once
+            all previously submitted requests have completed.
+        '''
+        if seq:
+            cmd = self.encodeCmd(self.CMD_SETSFPGA, address, len(data))
+        else:
+            cmd = self.encodeCmd(self.CMD_SETRFPGA, address, len(data))
+        self.uart.write(cmd + pack_words(data))
+
+        request = ZwireRequest(self, 0)
+        if callback:
+            request.add_done_callback(callback)
+        if self.pending:
+            self.pending.append(request)
+        else:
+            request.complete(b'')
+        return request
+
+    def poll(self, block=False):
+        '''
+            Collect any response bytes that have arrived and complete the
+            pipelined requests they satisfy.  If block is true, wait for
+            the oldest outstanding request to complete.
+        '''
+        if block and self.pending:
+            wanted = self.pending[0].length - len(self.rxbuf)
+        else:
+            wanted = 0
+        try:
+            waiting = self.uart.in_waiting
+        except AttributeError:
+            waiting = self.uart.inWaiting()
+        wanted = max(wanted, waiting)
+        if wanted > 0:
+            self.rxbuf.extend(self.readResponse(wanted))
+
+        while self.pending and self.pending[0].length <= len(self.rxbuf):
+            request = self.pending.popleft()
+            response = bytes(self.rxbuf[:request.length])
+            del self.rxbuf[:request.length]
+            if request.length > 0:
+                self.num_reads = self.num_reads - 1
+            request.complete(response)
+
+    def sync(self):
+        '''
+            Wait for all pipelined requests to complete.
+        '''
+        while self.pending:
+            self.poll(block=True)
+
     def close(self):
         '''
             Close serial connection.
         '''
+        if self.pending:
+            self.sync()
         self.uart.close()
 
 
+#
+# Zwire over TCP
+#
+# A ZwireServer exposes a local Zwire interface or SmpiGateway on a TCP
+# socket, and ZwireTCP drives it remotely.  Operations are batched so
+# that many register accesses cost one network round trip.
+#
+# Every message is a 4-byte big-endian byte count followed by that many
+# bytes.  A request message is a sequence of operations, each
+#
+#   opcode (1 byte), address (4 bytes), count (4 bytes)
+#
+# followed, for writes, by count data words.  The response is a status
+# byte, 0 for success, followed by the data words of each read operation
+# in order; otherwise it is followed by an ascii error message.  All
+# fields are big-endian.
+#
+# Messages are limited to ZWIRE_TCP_MAX_MESSAGE bytes and requests to
+# ZWIRE_TCP_MAX_OPERATIONS operations; ZwireBatch splits larger batches
+# into several messages.  The server closes a connection that sends an
+# oversized message, and rejects a request that is too long or whose
+# reads would make an oversized response without executing any of it.
+#
+ZWIRE_TCP_PORT = 9732
+
+ZWIRE_TCP_MAX_MESSAGE    = 2**24
+ZWIRE_TCP_MAX_OPERATIONS = 2**16
+
+ZWIRE_TCP_RPT_READ  = 0
+ZWIRE_TCP_SEQ_READ  = 1
+ZWIRE_TCP_RPT_WRITE = 2
+ZWIRE_TCP_SEQ_WRITE = 3
+
+ZWIRE_TCP_OP = struct.Struct('>BII')
+ZWIRE_TCP_LENGTH = struct.Struct('>I')
+
+def recv_exact(sock, length):
+    '''
+        Receive exactly length bytes from sock.  Return None if the
+        connection closes before any bytes arrive.
+    '''
+    data = bytearray(length)
+    view = memoryview(data)
+    received = 0
+    while received < length:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return None
+            raise ZwireError('TCP connection closed mid-message')
+        received = received + n
+    return data
+
+def recv_message(sock):
+    '''
+        Receive one message from sock.  Return None if the connection
+        closes between messages, raise ZwireError if the message is longer
+        than ZWIRE_TCP_MAX_MESSAGE.
+    '''
+    header = recv_exact(sock, 4)
+    if header is None:
+        return None
+    length = ZWIRE_TCP_LENGTH.unpack(bytes(header))[0]
+    if length > ZWIRE_TCP_MAX_MESSAGE:
+        raise ZwireError('TCP message too long: {} bytes'.format(length))
+    return recv_exact(sock, length)
+
+def send_message(sock, payload):
+    sock.sendall(ZWIRE_TCP_LENGTH.pack(len(payload)) + bytes(payload))
+
+
+class ZwireBatch(object):
+    '''
+        A batch of Zwire operations, sent to a ZwireServer as a single
+        message by execute().  Supports the Zwire read/write methods;
+        execute() returns a list with one result per operation, in order
+        (an integer for read, a list for rptRead/seqRead, None for writes).
+        A batch too large for one message is sent as several, the earlier
+        ones as operations are added.
+    '''
+    def __init__(self, zwire):
+        self.zwire    = zwire
+        self.request  = bytearray()
+        self.results  = []    # (read count, single value) per operation
+        self.response = bytearray()
+        self.pending  = 0     # operations in request
+        self.reading  = 0     # words read by request
+
+    def add(self, op, address, count, data=None):
+        size  = ZWIRE_TCP_OP.size + (4*count if data is not None else 0)
+        reads = count if data is None else 0
+        if (self.pending == ZWIRE_TCP_MAX_OPERATIONS or
+            len(self.request) + size > ZWIRE_TCP_MAX_MESSAGE or
+            1 + 4*(self.reading + reads) > ZWIRE_TCP_MAX_MESSAGE):
+            self.send()
+        self.pending = self.pending + 1
+        self.reading = self.reading + reads
+        self.request.extend(ZWIRE_TCP_OP.pack(op, address, count))
+        if data is not None:
+            self.request.extend(pack_words(data))
+
+    def read(self, _addr):
+        self.add(ZWIRE_TCP_RPT_READ, _addr, 1)
+        self.results.append((1, True))
+
+    def rptRead(self, _addr, _count):
+        self.add(ZWIRE_TCP_RPT_READ, _addr, _count)
+        self.results.append((_count, False))
+
+    def seqRead(self, _addr, _count):
+        self.add(ZWIRE_TCP_SEQ_READ, _addr, _count)
+        self.results.append((_count, False))
+
+    def write(self, _addr, _data):
+        self.add(ZWIRE_TCP_RPT_WRITE, _addr, 1, [_data])
+        self.results.append((0, False))
+
+    def rptWrite(self, _addr, _data):
+        self.add(ZWIRE_TCP_RPT_WRITE, _addr, len(_data), _data)
+        self.results.append((0, False))
+
+    def seqWrite(self, _addr, _data):
+        self.add(ZWIRE_TCP_SEQ_WRITE, _addr, len(_data), _data)
+        self.results.append((0, False))
+
+    def send(self):
+        '''
+            Send the operations added so far and collect their read data.
+        '''
+        if self.pending:
+            self.response.extend(self.zwire.transact(self.request))
+        self.request = bytearray()
+        self.pending = 0
+        self.reading = 0
+
+    def execute(self):
+        '''
+            Send the batch and wait for its response.  Return the list of
+            results.
+        '''
+        self.send()
+        response = self.response
+        rtnval = []
+        offset = 0
+        for count, single in self.results:
+            if count == 0:
+                rtnval.append(None)
+                continue
+            values = unpack_words(response[offset:offset+4*count])
+            offset = offset + 4*count
+            rtnval.append(values[0] if single else values)
+        self.results  = []
+        self.response = bytearray()
+        return rtnval
+
+
+class ZwireTCP(Zwire):
+    '''
+        Zwire protocol to a remote ZwireServer over a TCP connection
+
+        Each method call is one round trip.  To combine many operations
+        into one round trip use a batch:-
+          batch = zwire.batch()
+          batch.write(0x100, 1)
+          batch.seqRead(0x200, 16)
+          results = batch.execute()
+    '''
+    def __init__(self, host, port=ZWIRE_TCP_PORT):
+        self.bus  = 'TCP'
+        self.host = host
+        self.port = port
+        self.sock = None
+
+    def open(self):
+        '''
+            Connect to the server.
+        '''
+        self.sock = socket.create_connection((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def batch(self):
+        '''
+            Return a new, empty ZwireBatch for this connection.
+        '''
+        return ZwireBatch(self)
+
+    def transact(self, request):
+        '''
+            Send an encoded request message and return the read data of its
+            response, raising ZwireError if the server reports a failure.
+        '''
+        send_message(self.sock, request)
+        response = recv_message(self.sock)
+        if response is None:
+            raise ZwireError('TCP connection closed by server')
+        if response[0] != 0:
+            raise ZwireError('Server error: ' + response[1:].decode('ascii', 'replace'))
+        return bytes(response[1:])
+
+    def read(self, _addr):
+        '''
+            Read a single value at _addr.  Return value read.
+        '''
+        batch = self.batch()
+        batch.read(_addr)
+        return batch.execute()[0]
+
+    def rptRead(self, _addr, _count):
+        '''
+            Read multiple values from _addr.  Return list of values read.
+        '''
+        batch = self.batch()
+        batch.rptRead(_addr, _count)
+        return batch.execute()[0]
+
+    def seqRead(self, _addr, _count):
+        '''
+            Read values from sequential addresses, starting at _addr.
+            Return list of values read.
+        '''
+        batch = self.batch()
+        batch.seqRead(_addr, _count)
+        return batch.execute()[0]
+
+    def rptReadInto(self, _addr, _buf):
+        '''
+            Read multiple values from _addr into _buf.  Return the number of values read.
+        '''
+        view = buffer_words(_buf)
+        store_words(view, self.rptRead(_addr, len(view)))
+        return len(view)
+
+    def seqReadInto(self, _addr, _buf):
+        '''
+            Read values from sequential addresses, starting at _addr, into _buf.
+            Return the number of values read.
+        '''
+        view = buffer_words(_buf)
+        store_words(view, self.seqRead(_addr, len(view)))
+        return len(view)
+
+    def write(self, _addr, _data):
+        '''
+            Write a single value, _data, to _addr.
+        '''
+        batch = self.batch()
+        batch.write(_addr, _data)
+        batch.execute()
+
+    def rptWrite(self, _addr, _data):
+        '''
+            Write a list of values, _data, to the same address, _addr.
+        '''
+        batch = self.batch()
+        batch.rptWrite(_addr, _data)
+        batch.execute()
+
+    def seqWrite(self, _addr, _data):
+        '''
+            Write a list of values, _data, to sequential addresses starting at _addr.
+        '''
+        batch = self.batch()
+        batch.seqWrite(_addr, _data)
+        batch.execute()
+
+    def close(self):
+        '''
+            Disconnect from the server.
+        '''
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+class ZwireTCPServer(socketserver.ThreadingTCPServer):
+    '''
+        A threading TCP server that can rebind its port straight after a
+        restart.
+    '''
+    allow_reuse_address = True
+    daemon_threads      = True
+
+
+class ZwireServer(object):
+    '''
+        Serve a local Zwire interface or SmpiGateway to ZwireTCP clients.
+        The target should already be open.  Operations from all clients
+        are serialised, one request message at a time.
+
+        Clients get unauthenticated raw register access, so the server
+        listens on the loopback interface unless given another host
+        (e.g. host='' for all interfaces).
+
+        Example usage:-
+          server = ZwireServer(ZwireSmpiGateway(ZwireSPI(dspi=32)), port=9732)
+          server.serve_forever()
+    '''
+    def __init__(self, target, host='127.0.0.1', port=ZWIRE_TCP_PORT):
+        self.target = target
+        self.lock   = threading.Lock()
+
+        server = self
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                while True:
+                    try:
+                        request = recv_message(self.request)
+                    except ZwireError:
+                        break
+                    if request is None:
+                        break
+                    send_message(self.request, server.execute(request))
+
+        self.server = ZwireTCPServer((host, port), Handler)
+        self.address = self.server.server_address
+
+    def execute(self, request):
+        '''
+            Execute an encoded request message against the target.  Return
+            the encoded response message.
+        '''
+        response = bytearray(1)
+        try:
+            operations = self.decode(request)
+            with self.lock:
+                for op, address, count, data in operations:
+                    if op == ZWIRE_TCP_RPT_WRITE or op == ZWIRE_TCP_SEQ_WRITE:
+                        self.write(address, data, op == ZWIRE_TCP_SEQ_WRITE)
+                    else:
+                        response.extend(pack_words(self.read(address, count, op == ZWIRE_TCP_SEQ_READ)))
+        except Exception as e:
+            response = bytearray([1]) + str(e).encode('ascii', 'replace')
+        return response
+
+    def decode(self, request):
+        '''
+            Decode an encoded request message into a list of (opcode,
+            address, count, write data) operations, checking it all before
+            any is executed.
+        '''
+        operations = []
+        offset = 0
+        reading = 0
+        while offset < len(request):
+            if len(operations) == ZWIRE_TCP_MAX_OPERATIONS:
+                raise ZwireError('Too many operations in request')
+            if offset + ZWIRE_TCP_OP.size > len(request):
+                raise ZwireError('Truncated request')
+            op, address, count = ZWIRE_TCP_OP.unpack_from(request, offset)
+            offset = offset + ZWIRE_TCP_OP.size
+            if op == ZWIRE_TCP_RPT_WRITE or op == ZWIRE_TCP_SEQ_WRITE:
+                if offset + 4*count > len(request):
+                    raise ZwireError('Truncated request')
+                data = unpack_words(request[offset:offset+4*count])
+                offset = offset + 4*count
+            elif op == ZWIRE_TCP_RPT_READ or op == ZWIRE_TCP_SEQ_READ:
+                data = None
+                reading = reading + count
+                if 1 + 4*reading > ZWIRE_TCP_MAX_MESSAGE:
+                    raise ZwireError('Response too long')
+            else:
+                raise ZwireError('Unknown opcode: {}'.format(op))
+            operations.append((op, address, count, data))
+        return operations
+
+    def read(self, address, count, seq):
+        if hasattr(self.target, 'register_multi_read'):
+            return self.target.register_multi_read(address, count, sequential=seq)
+        elif seq:
+            return self.target.seqRead(address, count)
+        else:
+            return self.target.rptRead(address, count)
+
+    def write(self, address, data, seq):
+        if hasattr(self.target, 'register_multi_write'):
+            self.target.register_multi_write(address, data, sequential=seq)
+        elif seq:
+            self.target.seqWrite(address, data)
+        else:
+            self.target.rptWrite(address, data)
+
+    def serve_forever(self):
+        '''
+            Handle client connections until shutdown() is called.
+        '''
+        self.server.serve_forever()
+
+    def start(self):
+        '''
+            Handle client connections in a background thread.
+        '''
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def shutdown(self):
+        '''
+            Stop handling client connections and close the listening socket.
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+
+
 #
 # A dummy Zwire connection for test purposes
 #
@@ -354,6 +1104,25 @@ class ZwireDummy(Zwire):
         for n in range(0, _count):
             ret.append(0)
         return ret
+
+    def rptReadInto(self, _addr, _buf):
+        '''
+            Pretend to read multiple values from _addr into _buf.  Return the number of values read.
+        '''
+        count = len(buffer_words(_buf))
+        print("ZwireDummy rptReadInto " + str(_addr) + " " + str(count))
+        store_words(buffer_words(_buf), [0] * count)
+        return count
+
+    def seqReadInto(self, _addr, _buf):
+        '''
+            Pretend to read multiple values from sequential addresses, starting at _addr, into _buf.
+            Return the number of values read.
+        '''
+        count = len(buffer_words(_buf))
+        print("ZwireDummy seqReadInto " + str(_addr) + " " + str(count))
+        store_words(buffer_words(_buf), [0] * count)
+        return count
     
     def write(self, _addr, _data):
         '''
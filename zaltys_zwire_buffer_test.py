@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test ZwireSPI buffer transfers, with the libzaltys-zwire functions
+##  replaced by a python register file (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_zwire_buffer_test.py
+##
+
+import array
+import ctypes
+
+import zaltys_zwire
+import zaltys_buffer_utils
+from zaltys_test_utils import check, finish
+
+
+class RegisterFileLib(object):
+    '''
+        Stands in for libzaltys-zwire, recording the data arrays it is given.
+    '''
+    def __init__(self):
+        self.regs   = {}
+        self.arrays = []
+
+    def zwspiRead(self, fd, addr, count, data):
+        self.arrays.append(data)
+        for n in range(count):
+            data[n] = self.regs.get(addr, 0)
+        return 0
+
+    def zwspiSeqRead(self, fd, addr, count, data):
+        self.arrays.append(data)
+        for n in range(count):
+            data[n] = self.regs.get(addr + n, 0)
+        return 0
+
+    def zwspiWrite(self, fd, addr, count, data):
+        self.arrays.append(data)
+        for n in range(count):
+            self.regs[addr] = data[n]
+        return count
+
+    def zwspiSeqWrite(self, fd, addr, count, data):
+        self.arrays.append(data)
+        for n in range(count):
+            self.regs[addr + n] = data[n]
+        return count
+
+    def zwspiClose(self, fd):
+        return 0
+
+
+def make_zwire(fd=3):
+    zwire = zaltys_zwire.ZwireSPI.__new__(zaltys_zwire.ZwireSPI)
+    zwire.lib     = RegisterFileLib()
+    zwire.fd      = fd
+    zwire.word    = (ctypes.c_ulong * 1)()
+    zwire.staging = (ctypes.c_ulong * 0)()
+    return zwire
+
+
+values = [0x01020304, 0xFFFFFFFF, 0x80000000, 7]
+zwire  = make_zwire()
+
+# Every buffer type holds one register value per item, 32-bit words for bytes
+zwire.seqWrite(0x100, values)
+for name, buf in [('array(I)', array.array('I', [0]*4)),
+                  ('array(L)', array.array('L', [0]*4)),
+                  ('bytearray', bytearray(16)),
+                  ('c_ulong array', (ctypes.c_ulong * 4)())]:
+    count = zwire.seqReadInto(0x100, buf)
+    check('seqReadInto {} count'.format(name), count == 4)
+    check('seqReadInto {} values'.format(name), list(zaltys_zwire.buffer_words(buf)) == values)
+
+# Byte buffers are written as 32-bit words, as on the other transports
+zwire.seqWrite(0x200, zaltys_buffer_utils.words_tobytes(array.array('I', values)))
+check('seqWrite bytes', [zwire.lib.regs[0x200 + n] for n in range(4)] == values)
+zwire.seqWrite(0x300, bytearray(zaltys_buffer_utils.words_tobytes(array.array('I', values))))
+check('seqWrite bytearray', [zwire.lib.regs[0x300 + n] for n in range(4)] == values)
+
+# Buffers of C unsigned longs go to the library in place
+buf = array.array('L', [0]*4)
+zwire.seqReadInto(0x100, buf)
+check('array(L) passed in place', ctypes.addressof(zwire.lib.arrays[-1]) == buf.buffer_info()[0])
+
+# Lists and other buffers go through the one reusable staging array
+zwire.rptWrite(0x400, values)
+staging = zwire.staging
+zwire.seqWrite(0x500, array.array('I', values))
+zwire.seqWrite(0x600, tuple(values))
+check('staging array reused', zwire.lib.arrays[-1] is staging and zwire.lib.arrays[-2] is staging)
+check('staged writes', zwire.lib.regs[0x400] == 7 and [zwire.lib.regs[0x500 + n] for n in range(4)] == values)
+
+# Single reads of a closed interface return 0, not the last value read
+zwire.write(0x700, 0x1234)
+check('read', zwire.read(0x700) == 0x1234)
+zwire.fd = -1
+check('read when closed', zwire.read(0x700) == 0)
+
+finish()
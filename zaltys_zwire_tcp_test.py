@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+##
+##  Author        : Paul Onions
+##  Creation date : 18 October 2026
+##
+##  Copyright 2026 Silicon Infusion Limited
+##
+##  Silicon Infusion Limited
+##  CP House
+##  Otterspool Way
+##  Watford WD25 8HP
+##  Hertfordshire, UK
+##  Tel: +44 (0)1923 650404
+##  Fax: +44 (0)1923 650374
+##  Web: www.siliconinfusion.com
+##
+##  Licence: MIT, see LICENCE file for details.
+##
+
+##
+##  Test Zwire over TCP end to end on localhost, with a ZwireServer
+##  serving a simulated register file (no hardware required).
+##
+##  Invoke at a shell prompt with:-
+##    python zaltys_zwire_tcp_test.py
+##
+
+import socket
+
+import zaltys_zwire
+import zaltys_smpi_gateway
+from zaltys_test_utils import check, finish
+
+
+target = zaltys_smpi_gateway.SimulatedSmpiGateway()
+server = zaltys_zwire.ZwireServer(target, port=0)
+server.start()
+host, port = server.address
+check('server listens on loopback', host == '127.0.0.1')
+
+zwire = zaltys_zwire.ZwireTCP(host, port)
+zwire.open()
+gateway = zaltys_smpi_gateway.ZwireSmpiGateway(zwire)
+
+# Single and multi-register accesses
+gateway.register_write(0x10, 0x12345678)
+check('register write/read', gateway.register_read(0x10) == 0x12345678 and target.peek(0x10) == 0x12345678)
+gateway.register_multi_write(0x20, [1, 2, 3, 4], sequential=True)
+check('sequential multi write/read', gateway.register_multi_read(0x20, 4, sequential=True) == [1, 2, 3, 4])
+gateway.register_scatter_write([0x30, 0x31, 0x40], [5, 6, 7])
+check('scatter write', [target.peek(a) for a in (0x30, 0x31, 0x40)] == [5, 6, 7])
+
+# Batches bigger than one message are split, results still in order
+zaltys_zwire.ZWIRE_TCP_MAX_OPERATIONS = 4
+batch = zwire.batch()
+for n in range(10):
+    batch.write(0x100 + n, n)
+    batch.read(0x100 + n)
+results = batch.execute()
+check('split batch results', results == [x for n in range(10) for x in (None, n)])
+
+# Requests over the operation limit are rejected without executing any
+request = bytearray()
+for n in range(5):
+    request.extend(zaltys_zwire.ZWIRE_TCP_OP.pack(zaltys_zwire.ZWIRE_TCP_RPT_WRITE, 0x200, 1))
+    request.extend(zaltys_zwire.pack_words([n + 1]))
+try:
+    zwire.transact(request)
+    check('too many operations rejected', False)
+except zaltys_zwire.ZwireError:
+    check('too many operations rejected', target.peek(0x200) == 0)
+zaltys_zwire.ZWIRE_TCP_MAX_OPERATIONS = 2**16
+
+# As are reads whose response would be too long, and unknown opcodes
+for name, op, count in [('oversized read rejected', zaltys_zwire.ZWIRE_TCP_RPT_READ, 2**30),
+                        ('unknown opcode rejected', 9, 1)]:
+    try:
+        zwire.transact(zaltys_zwire.ZWIRE_TCP_OP.pack(op, 0, count))
+        check(name, False)
+    except zaltys_zwire.ZwireError:
+        check(name, True)
+check('connection still usable', gateway.register_read(0x10) == 0x12345678)
+zwire.close()
+
+# Oversized messages close the connection
+sock = socket.create_connection((host, port))
+sock.sendall(zaltys_zwire.ZWIRE_TCP_LENGTH.pack(zaltys_zwire.ZWIRE_TCP_MAX_MESSAGE + 1))
+sock.settimeout(5)
+check('oversized message closes connection', sock.recv(1) == b'')
+sock.close()
+
+server.shutdown()
+
+finish()